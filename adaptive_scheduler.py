@@ -0,0 +1,136 @@
+import time
+
+SCALE_LADDER = (0.5, 0.4, 0.33, 0.25, 0.2, 0.16, 0.125)
+
+
+class AdaptiveScheduler:
+    """Picks detection cadence and downscale factor to meet a per-frame latency budget
+
+    Costs are measured online and smoothed with an exponential moving average:
+      - base cost of every frame (capture, drawing, display),
+      - detection cost per full-frame pixel, scaled by scale**2 for other scales,
+      - encoding cost per face.
+    Processing one frame in `cadence` spreads its recognition cost over that
+    many frames, so the predicted average frame time is
+        base + (detect(scale) + encode * faces) / cadence.
+
+    The scheduler prefers the smallest cadence that fits the budget at
+    `preferred_scale` or larger, then spends any slack on a larger scale.
+    If nothing fits at the preferred scale, it gives up resolution before
+    exceeding `max_cadence`. With target_recognition_fps, candidates must also
+    process at least that many frames per second.
+    """
+
+    def __init__(self, budget_ms=66.0, target_recognition_fps=None, preferred_scale=0.25,
+                 max_cadence=8, scales=SCALE_LADDER, smoothing=0.2, decide_every=10,
+                 initial_cadence=2, log=print):
+        self.budget = budget_ms / 1000.0
+        self.target_recognition_fps = target_recognition_fps
+        self.preferred_scale = preferred_scale
+        self.max_cadence = max_cadence
+        self.scales = sorted(scales, reverse=True)
+        self.smoothing = smoothing
+        self.decide_every = decide_every
+        self.log = log
+
+        self.cadence = initial_cadence
+        self.scale = preferred_scale
+        self.predicted_frame_time = None
+
+        # Smoothed cost model (seconds)
+        self.base_cost = None
+        self.detect_cost_per_pixel = None
+        self.encode_cost_per_face = None
+        self.faces_per_frame = 0.0
+
+        self._frames_since_processing = 0
+        self._processed_since_decision = 0
+        self._recognition_time = 0.0
+        self._frame_started = None
+        self._full_pixels = 0
+
+    def _ewma(self, current, sample):
+        return sample if current is None else current + self.smoothing * (sample - current)
+
+    def should_process(self):
+        """Called once per frame; True if this frame should run detection"""
+        self._frame_started = time.perf_counter()
+        self._recognition_time = 0.0
+        self._frames_since_processing += 1
+        if self._frames_since_processing >= self.cadence:
+            self._frames_since_processing = 0
+            return True
+        return False
+
+    def record_recognition(self, frame_shape, detect_seconds, encode_seconds, n_faces):
+        """Report the cost of a processed frame at the current scale"""
+        pixels = frame_shape[0] * frame_shape[1] * self.scale * self.scale
+        self.detect_cost_per_pixel = self._ewma(self.detect_cost_per_pixel, detect_seconds / max(pixels, 1.0))
+        if n_faces:
+            self.encode_cost_per_face = self._ewma(self.encode_cost_per_face, encode_seconds / n_faces)
+        self.faces_per_frame = self._ewma(self.faces_per_frame, float(n_faces))
+        self._recognition_time = detect_seconds + encode_seconds
+        self._full_pixels = frame_shape[0] * frame_shape[1]
+
+        self._processed_since_decision += 1
+        if self._processed_since_decision >= self.decide_every:
+            self._processed_since_decision = 0
+            self._decide()
+
+    def frame_done(self):
+        """Called at the end of every frame, after display"""
+        if self._frame_started is None:
+            return
+        elapsed = time.perf_counter() - self._frame_started
+        self._frame_started = None
+        self.base_cost = self._ewma(self.base_cost, max(elapsed - self._recognition_time, 0.0))
+
+    def predict(self, cadence, scale):
+        """Predicted (average frame time, recognitions per second) for a setting"""
+        detect = self.detect_cost_per_pixel * self._full_pixels * scale * scale
+        encode = (self.encode_cost_per_face or 0.0) * self.faces_per_frame
+        frame_time = (self.base_cost or 0.0) + (detect + encode) / cadence
+        return frame_time, 1.0 / (frame_time * cadence)
+
+    def _fits(self, cadence, scale):
+        frame_time, recognition_rate = self.predict(cadence, scale)
+        if frame_time > self.budget:
+            return False
+        return self.target_recognition_fps is None or recognition_rate >= self.target_recognition_fps
+
+    def _decide(self):
+        if self.detect_cost_per_pixel is None:
+            return
+
+        choice = None
+        preferred = [s for s in self.scales if s >= self.preferred_scale]
+        for cadence in range(1, self.max_cadence + 1):
+            fitting = [s for s in preferred if self._fits(cadence, s)]
+            if fitting:
+                choice = (cadence, fitting[0])
+                break
+        if choice is None:
+            # Over budget even at the preferred scale: trade resolution for time
+            smaller = [s for s in self.scales if s < self.preferred_scale]
+            for scale in smaller:
+                for cadence in range(1, self.max_cadence + 1):
+                    if self._fits(cadence, scale):
+                        choice = (cadence, scale)
+                        break
+                if choice is not None:
+                    break
+        if choice is None:
+            choice = (self.max_cadence, self.scales[-1])
+
+        if choice != (self.cadence, self.scale):
+            frame_time, _ = self.predict(*choice)
+            self.log(f"[SCHEDULER] cadence {self.cadence} -> {choice[0]}, scale {self.scale} -> {choice[1]} "
+                     f"(predicted {1000 * frame_time:.1f} ms/frame, budget {1000 * self.budget:.0f} ms)")
+            self.cadence, self.scale = choice
+        self.predicted_frame_time = self.predict(self.cadence, self.scale)[0]
+
+    def status(self):
+        """One-line summary for the on-screen overlay"""
+        predicted = f"{1000 * self.predicted_frame_time:.0f}" if self.predicted_frame_time else "--"
+        return (f"Sched: every {self.cadence} frame(s) @ {self.scale:g}x | "
+                f"{predicted}/{1000 * self.budget:.0f} ms")
@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from metrics import METRICS
+from model_loader import dlib, face_recognition_api
+
+CHIP_SIZE = 150      # Aligned face chips are this many pixels square, as dlib's ResNet expects
+CHIP_PADDING = 0.25  # Same padding face_recognition.face_encodings uses
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_DEADLINE_MS = 10.0
+
+
+def face_chips(rgb_image, face_locations):
+    """Aligned 150x150 chips for (top, right, bottom, left) faces of an RGB image
+
+    Uses the same 5-point landmarks and alignment as
+    face_recognition.face_encodings, so encodings of the chips are identical.
+    """
+    if not face_locations:
+        return []
+    shapes = dlib.full_object_detections()
+    for shape in face_recognition_api._raw_face_landmarks(rgb_image, face_locations, model="small"):
+        shapes.append(shape)
+    return list(dlib.get_face_chips(rgb_image, shapes, size=CHIP_SIZE, padding=CHIP_PADDING))
+
+
+def encode_chips(chips):
+    """128-d encodings of aligned face chips, computed in one batched network call"""
+    if not chips:
+        return []
+    with METRICS.time('encode_batch'):
+        descriptors = face_recognition_api.face_encoder.compute_face_descriptor(chips)
+    METRICS.counter('encode_batches_total', 'Batched encoder calls').inc()
+    METRICS.counter('encodes_total', 'Faces run through the 128-d encoder').inc(len(chips))
+    return [np.array(descriptor) for descriptor in descriptors]
+
+
+def encode_faces(rgb_image, face_locations):
+    """Drop-in for face_recognition.face_encodings that encodes all faces of a frame as one batch"""
+    return encode_chips(face_chips(rgb_image, face_locations))
+
+
+class _Request:
+    __slots__ = ('chips', 'future', 'submitted_at')
+
+    def __init__(self, chips):
+        self.chips = chips
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class MicroBatchEncoder:
+    """Collects face chips from many frames or streams and encodes them in batches
+
+    Callers align their faces on their own thread (landmarks are cheap) and
+    submit the chips. A background thread waits until batch_size chips are
+    queued or the oldest request has waited deadline_ms, then runs the
+    encoder once over everything it took and routes each slice of results
+    back to its request's Future. A larger batch raises throughput, a longer
+    deadline raises it further under light load at the cost of latency.
+
+    Requests are never split across batches, so a single request larger
+    than batch_size forms a batch of its own.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, deadline_ms=DEFAULT_DEADLINE_MS):
+        self.batch_size = batch_size
+        self.deadline = deadline_ms / 1000.0
+        self._pending = deque()
+        self._pending_chips = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flushing = False
+        self.batches_run = 0
+        self.faces_encoded = 0
+        self._thread = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+        self._thread.start()
+
+    def submit(self, rgb_image, face_locations):
+        """Future resolving to the encodings of the given faces of an RGB image"""
+        return self.submit_chips(face_chips(rgb_image, face_locations))
+
+    def submit_chips(self, chips):
+        request = _Request(chips)
+        if not chips:
+            request.future.set_result([])
+            return request.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MicroBatchEncoder is closed")
+            self._pending.append(request)
+            self._pending_chips += len(chips)
+            self._cond.notify()
+        return request.future
+
+    def encode(self, rgb_image, face_locations):
+        """Blocking encode through the shared batcher, for use from worker threads"""
+        return self.submit(rgb_image, face_locations).result()
+
+    def flush(self):
+        """Encode everything queued now, without waiting for a full batch or the deadline"""
+        with self._cond:
+            self._flushing = True
+            self._cond.notify()
+
+    def status(self):
+        mean = self.faces_encoded / self.batches_run if self.batches_run else 0.0
+        return f"Encoder: {self.faces_encoded} faces in {self.batches_run} batches ({mean:.1f} per batch)"
+
+    def close(self):
+        """Encode what is still queued, then stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _take_batch(self):
+        """Wait for a full batch or the oldest request's deadline; None once closed and drained"""
+        with self._cond:
+            while True:
+                if self._pending:
+                    if self._pending_chips >= self.batch_size or self._closed or self._flushing:
+                        break
+                    remaining = self._pending[0].submitted_at + self.deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            batch = []
+            size = 0
+            while self._pending and (not batch or size + len(self._pending[0].chips) <= self.batch_size):
+                request = self._pending.popleft()
+                batch.append(request)
+                size += len(request.chips)
+            self._pending_chips -= size
+            if not self._pending:
+                self._flushing = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            chips = [chip for request in batch for chip in request.chips]
+            try:
+                encodings = encode_chips(chips)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.faces_encoded += len(chips)
+            start = 0
+            for request in batch:
+                request.future.set_result(encodings[start:start + len(request.chips)])
+                start += len(request.chips)
+
+
+def encode_frames(encoder, frames):
+    """Encodings of the faces of several (rgb_image, face_locations) frames, in shared batches
+
+    Every frame's chips are queued on the MicroBatchEncoder before it is
+    flushed, so faces from different frames and streams share encoder calls
+    of up to batch_size faces. Returns one list of encodings per frame.
+    """
+    futures = [encoder.submit(rgb_image, face_locations) for rgb_image, face_locations in frames]
+    encoder.flush()
+    return [future.result() for future in futures]
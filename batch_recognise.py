@@ -0,0 +1,259 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+import cv2
+from batch_encoder import encode_faces
+from face_gallery import GALLERY_FILE, load_gallery
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, scale_locations
+from ivf_index import IVFIndex, DEFAULT_NPROBE
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')
+IMAGES_PER_TASK = 32
+
+# Per-process state, set up once by init_worker
+_worker = {}
+
+
+def collect_inputs(paths):
+    """Expand the command line paths into sorted lists of image and video files"""
+    images, videos = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for file_path in files:
+            lower = file_path.lower()
+            if lower.endswith(IMAGE_EXTENSIONS):
+                images.append(file_path)
+            elif lower.endswith(VIDEO_EXTENSIONS):
+                videos.append(file_path)
+            elif not os.path.isdir(path):
+                print(f"[WARNING] Skipping {file_path}: unknown file type", file=sys.stderr)
+    return images, videos
+
+
+def video_frame_count(path):
+    video_capture = cv2.VideoCapture(path)
+    count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 0.0
+    video_capture.release()
+    return count, fps
+
+
+def make_tasks(images, videos, shard_frames):
+    """Split the work into ordered tasks: image chunks and video frame ranges
+
+    The frame count is only an estimate for many containers, so the last
+    range of a video is open-ended and runs until read() fails.
+    """
+    tasks = []
+    for i in range(0, len(images), IMAGES_PER_TASK):
+        tasks.append(('images', images[i:i + IMAGES_PER_TASK]))
+    for video in videos:
+        count, _ = video_frame_count(video)
+        if count <= 0 or not shard_frames:
+            # Unknown length (or sharding disabled): one task reads the whole video
+            tasks.append(('video', video, 0, None))
+            continue
+        for start in range(0, count, shard_frames):
+            end = start + shard_frames if start + shard_frames < count else None
+            tasks.append(('video', video, start, end))
+    return tasks
+
+
+def init_worker(gallery_file, ann, nprobe, scale, tolerance, every):
+    """Load the gallery (memory-mapped, shared between workers) once per process"""
+    gallery = load_gallery(gallery_file)
+    if ann:
+        gallery.attach_index(IVFIndex.load(os.path.splitext(gallery_file)[0] + '.ivf.npz', nprobe=nprobe))
+    _worker.update(gallery=gallery, scale=scale, tolerance=tolerance, every=every)
+
+
+def recognise_image(bgr_image):
+    """Faces in a BGR image as dicts with full-resolution box, name and distance"""
+    scale = _worker['scale']
+    rgb_small_frame = prepare_frame(bgr_image, scale)
+    face_locations = detect_faces(rgb_small_frame)
+    if not face_locations:
+        return []
+    face_encodings = encode_faces(rgb_small_frame, face_locations)
+    matches = _worker['gallery'].identify(face_encodings, tolerance=_worker['tolerance'])
+    return [{'box': list(box), 'name': name, 'distance': round(distance, 4)}
+            for box, (name, distance) in zip(scale_locations(face_locations, 1 / scale), matches)]
+
+
+def recognise_record(source, frame_index, timestamp, bgr_image):
+    """Output record for one image or frame; an error is recorded instead of failing the whole run"""
+    record = {'source': source, 'frame': frame_index, 'timestamp': timestamp}
+    try:
+        record['faces'] = recognise_image(bgr_image)
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def open_at_frame(video, start):
+    """VideoCapture positioned at frame start, or None if the video has fewer frames
+
+    Seeking with CAP_PROP_POS_FRAMES is not frame-accurate on every backend.
+    If the position read back differs, the video is reopened and the frames
+    before start are skipped with grab(), so frame indices stay exact.
+    """
+    video_capture = cv2.VideoCapture(video)
+    if not start:
+        return video_capture
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    if int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return video_capture
+    video_capture.release()
+    video_capture = cv2.VideoCapture(video)
+    for _ in range(start):
+        if not video_capture.grab():
+            video_capture.release()
+            return None
+    return video_capture
+
+
+def run_task(task):
+    """Process one task, returning (frame records, frames processed)"""
+    records = []
+    if task[0] == 'images':
+        for image_path in task[1]:
+            image = cv2.imread(image_path)
+            if image is None:
+                records.append({'source': image_path, 'frame': 0, 'timestamp': 0.0, 'error': 'unreadable'})
+                continue
+            records.append(recognise_record(image_path, 0, 0.0, image))
+        return records, len(task[1])
+
+    _, video, start, end = task
+    video_capture = open_at_frame(video, start)
+    if video_capture is None:
+        # The frame count overestimated the length; this range is past the end
+        return records, 0
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 0.0
+    every = _worker['every']
+    frame_index = start
+    processed = 0
+    try:
+        while end is None or frame_index < end:
+            if frame_index % every:
+                # grab() skips decoding the frames we don't analyse
+                if not video_capture.grab():
+                    break
+                frame_index += 1
+                continue
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            timestamp = frame_index / fps if fps else None
+            records.append(recognise_record(video, frame_index, timestamp, frame))
+            processed += 1
+            frame_index += 1
+    finally:
+        video_capture.release()
+    return records, processed
+
+
+class ResultWriter:
+    """Streams frame records to JSONL (one line per frame) or CSV (one row per face)"""
+
+    CSV_FIELDS = ['source', 'frame', 'timestamp', 'top', 'right', 'bottom', 'left', 'name', 'distance']
+
+    def __init__(self, path):
+        self.path = path
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        self.csv = None
+        if path.lower().endswith('.csv'):
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(self.CSV_FIELDS)
+
+    def write(self, record):
+        if self.csv is None:
+            self.file.write(json.dumps(record) + '\n')
+            return
+        for face in record.get('faces', []):
+            self.csv.writerow([record['source'], record['frame'], record['timestamp'], *face['box'],
+                               face['name'], face['distance']])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless face recognition over video files and image folders")
+    parser.add_argument('inputs', nargs='+', help="video files, images or directories")
+    parser.add_argument('-o', '--output', default='-', help="results file (.jsonl or .csv), '-' for stdout")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (0 = one per CPU core)")
+    parser.add_argument('--shard-frames', type=int, default=1500,
+                        help="split videos into frame ranges of this size across workers (0 = no sharding)")
+    parser.add_argument('--every', type=int, default=1, help="analyse every Nth video frame")
+    parser.add_argument('--scale', type=float, default=DETECTION_SCALE, help="downscale factor before detection")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--ann', action='store_true', help="match with the approximate nearest-neighbour index")
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gallery):
+        print(f"[ERROR] {args.gallery} not found! Please run train_model_improved.py first.", file=sys.stderr)
+        return 1
+
+    images, videos = collect_inputs(args.inputs)
+    tasks = make_tasks(images, videos, args.shard_frames)
+    if not tasks:
+        print("[ERROR] No images or videos found", file=sys.stderr)
+        return 1
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    print(f"[INFO] {len(images)} images, {len(videos)} videos, {len(tasks)} tasks on {workers} worker(s)",
+          file=sys.stderr)
+
+    init_args = (args.gallery, args.ann, args.nprobe, args.scale, args.tolerance, max(args.every, 1))
+    writer = ResultWriter(args.output)
+    frames = 0
+    faces = 0
+    start_time = time.time()
+    pool = None
+    try:
+        if workers > 1:
+            pool = Pool(processes=workers, initializer=init_worker, initargs=init_args)
+            results = pool.imap(run_task, tasks)
+        else:
+            init_worker(*init_args)
+            results = map(run_task, tasks)
+
+        # imap yields in task order, so output is ordered by input and frame number
+        for done, (records, processed) in enumerate(results, start=1):
+            for record in records:
+                writer.write(record)
+                faces += len(record.get('faces', []))
+            writer.flush()
+            frames += processed
+            elapsed = time.time() - start_time
+            print(f"[INFO] {done}/{len(tasks)} tasks, {frames} frames, {frames / elapsed:.1f} frames/s",
+                  file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+
+    elapsed = time.time() - start_time
+    print(f"[SUCCESS] Processed {frames} frames ({faces} faces) in {elapsed:.1f}s "
+          f"= {frames / elapsed:.1f} frames/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import face_recognition
+import cv2
+import numpy as np
+from benchmark_ann import synthetic_gallery
+from face_gallery import FaceGallery
+from frame_processing import DETECTION_SCALE, prepare_frame, recognize_frame
+from ivf_index import IVFIndex
+from multiscale_detection import DETECTION_MODES, make_detector
+
+DATASET_IMAGES = os.path.join('dataset', 'Sammy')
+FRAME_WIDTH = 640  # Camera width used by the live scripts; stills keep their aspect ratio
+
+
+def percentiles_ms(samples):
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds"""
+    ms = 1000.0 * np.asarray(samples)
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+    }
+
+
+def measure(fn, inputs, repeat, warmup=2):
+    """Time fn(item) for every input, `repeat` times over, after a few warm-up calls"""
+    for item in inputs[:warmup]:
+        fn(item)
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def stage_result(name, samples, items_per_call=1, **extra):
+    result = {'stage': name, 'calls': len(samples)}
+    result.update(percentiles_ms(samples))
+    result['throughput_per_s'] = round(items_per_call * len(samples) / float(np.sum(samples)), 2)
+    result.update(extra)
+    print(f"{name:<34}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+          f"{result['throughput_per_s']:>12.1f}")
+    return result
+
+
+def load_dataset_frames(directory=DATASET_IMAGES, width=FRAME_WIDTH):
+    """Dataset photos scaled to the camera width, as BGR frames"""
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, name))
+        if image is not None:
+            height = max(1, round(image.shape[0] * width / image.shape[1]))
+            frames.append(cv2.resize(image, (width, height)))
+    return frames
+
+
+def synthetic_video(frames, length):
+    """Pan slowly across the dataset frames to imitate a live camera"""
+    video = []
+    for i in range(length):
+        frame = frames[(i // 10) % len(frames)]
+        shift = np.float32([[1, 0, (i % 10) * 2 - 10], [0, 1, 0]])
+        video.append(cv2.warpAffine(frame, shift, (frame.shape[1], frame.shape[0]), borderMode=cv2.BORDER_REPLICATE))
+    return video
+
+
+def load_video(path, limit):
+    video_capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    video_capture.release()
+    return frames
+
+
+def environment():
+    """Machine and version details stored alongside results"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=False).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'face_recognition': getattr(face_recognition, '__version__', 'unknown'),
+    }
+
+
+def compare(baseline_path, results):
+    """Print p50 and throughput changes against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {r['stage']: r for r in json.load(f)['stages']}
+    print(f"\nComparison with {baseline_path}:")
+    print(f"{'stage':<34}{'p50 before':>12}{'p50 now':>10}{'change':>9}")
+    for result in results:
+        before = baseline.get(result['stage'])
+        if before is None:
+            continue
+        change = 100.0 * (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0.0
+        flag = "  <-- slower" if change > 10 else ""
+        print(f"{result['stage']:<34}{before['p50_ms']:>12.2f}{result['p50_ms']:>10.2f}{change:>8.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage and end-to-end recognition benchmarks (no camera needed)")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="machine-readable results file")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over the dataset images per stage")
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[100, 10000, 100000])
+    parser.add_argument('--faces-per-frame', type=int, default=4, help="faces matched per gallery call")
+    parser.add_argument('--video', help="recorded video for the end-to-end stage (default: synthetic)")
+    parser.add_argument('--video-frames', type=int, default=150)
+    parser.add_argument('--scale', type=float, default=DETECTION_SCALE)
+    parser.add_argument('--compare', help="previous results file to compare against")
+    args = parser.parse_args()
+
+    frames = load_dataset_frames()
+    if not frames:
+        print(f"[ERROR] No images found in {DATASET_IMAGES}")
+        return
+    video = load_video(args.video, args.video_frames) if args.video else synthetic_video(frames, args.video_frames)
+    if not video:
+        print(f"[ERROR] No frames could be read from {args.video}")
+        return
+    print(f"[INFO] {len(frames)} dataset frames {FRAME_WIDTH} pixels wide, scale {args.scale}")
+    print(f"\n{'stage':<34}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per second':>12}")
+
+    results = []
+    results.append(stage_result('resize+cvtColor', measure(lambda f: prepare_frame(f, args.scale), frames,
+                                                           args.repeat * 20)))
+
+    small_frames = [prepare_frame(f, args.scale) for f in frames]
+    results.append(stage_result('hog_detection', measure(
+        lambda f: face_recognition.face_locations(f, model="hog"), small_frames, args.repeat)))
+
+    detections = [(f, face_recognition.face_locations(f, model="hog")) for f in small_frames]
+    detections = [(f, locations) for f, locations in detections if locations]
+    if detections:
+        faces = sum(len(locations) for _, locations in detections) / len(detections)
+        results.append(stage_result('face_encodings', measure(
+            lambda d: face_recognition.face_encodings(d[0], d[1]), detections, args.repeat),
+            items_per_call=faces, faces_per_call=faces))
+    else:
+        print("[WARNING] No faces detected in dataset frames; skipping encoding stage")
+
+    # Matching against synthetic galleries, exact and with the IVF index
+    rng = np.random.default_rng(0)
+    for size in args.gallery_sizes:
+        gallery = FaceGallery(*synthetic_gallery(size))
+        batches = [gallery.matrix[rng.integers(0, size, args.faces_per_frame)] + 0.02 for _ in range(200)]
+        results.append(stage_result(f'match_exact[{size}]', measure(gallery.identify, batches, 1),
+                                    items_per_call=args.faces_per_frame, gallery_size=size))
+        if size >= 1000:
+            gallery.attach_index(IVFIndex.build(gallery.matrix))
+            results.append(stage_result(f'match_ivf[{size}]', measure(gallery.identify, batches, 1),
+                                        items_per_call=args.faces_per_frame, gallery_size=size,
+                                        nprobe=gallery.index.nprobe))
+
+    # End-to-end: resize, detect, encode and match one full frame
+    gallery = FaceGallery(*synthetic_gallery(args.gallery_sizes[0]))
+    results.append(stage_result('full_frame', measure(lambda f: recognize_frame(f, gallery, args.scale), video, 1),
+                                source=args.video or 'synthetic'))
+
+    # Detection modes: milliseconds per frame against faces found on the same frames
+    for mode in DETECTION_MODES:
+        detector = make_detector(mode, args.scale)
+        found = []
+
+        def detect(frame):
+            if detector is None:
+                boxes = face_recognition.face_locations(prepare_frame(frame, args.scale), model="hog")
+            else:
+                boxes = detector.detect(frame)
+            found.append(len(boxes))
+
+        samples = measure(detect, video, 1)
+        faces_found = sum(found[-len(video):])
+        results.append(stage_result(f'detect[{mode}]', samples, faces_found=faces_found,
+                                    faces_per_frame=round(faces_found / len(video), 3)))
+        print(f"{'':<34}{faces_found} faces in {len(video)} frames")
+
+    report = {'environment': environment(), 'settings': vars(args), 'stages': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[INFO] Results saved to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
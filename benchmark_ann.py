@@ -0,0 +1,77 @@
+import argparse
+import os
+import time
+import numpy as np
+from face_gallery import FaceGallery, load_gallery, load_legacy_pickle
+from ivf_index import IVFIndex
+
+
+def synthetic_gallery(n_encodings, per_person=10, seed=0):
+    """Clustered random 128-d encodings that roughly mimic a real enrolment set"""
+    rng = np.random.default_rng(seed)
+    n_people = max(1, n_encodings // per_person)
+    centres = rng.normal(0.0, 0.09, size=(n_people, 128)).astype(np.float32)
+    labels = rng.integers(0, n_people, size=n_encodings)
+    encodings = centres[labels] + rng.normal(0.0, 0.03, size=(n_encodings, 128)).astype(np.float32)
+    names = [f"person_{label}" for label in labels]
+    return encodings, names
+
+
+def time_search(search, queries, batch_size):
+    """Run search over queries in frame-sized batches, returning results and ms per query"""
+    rows = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        rows.append(search(queries[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return np.concatenate(rows), 1000.0 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@1 and latency of the IVF index against exact search")
+    parser.add_argument('--gallery', help="gallery file (or legacy .pkl) to benchmark instead of a synthetic gallery")
+    parser.add_argument('--size', type=int, default=100000, help="synthetic gallery size")
+    parser.add_argument('--queries', type=int, default=1000, help="number of query faces")
+    parser.add_argument('--faces-per-frame', type=int, default=4, help="queries matched per call")
+    parser.add_argument('--lists', type=int, default=None, help="number of IVF lists (default 4*sqrt(N))")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if args.gallery:
+        if not os.path.exists(args.gallery):
+            print(f"[ERROR] {args.gallery} not found!")
+            return
+        if args.gallery.endswith('.pkl'):
+            gallery = load_legacy_pickle(args.gallery)
+        else:
+            gallery = load_gallery(args.gallery)
+    else:
+        gallery = FaceGallery(*synthetic_gallery(args.size))
+    print(f"[INFO] Gallery: {len(gallery)} encodings, {len(gallery.identities)} identities")
+
+    # Queries are noisy copies of gallery rows, like a new sighting of an enrolled face
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(gallery), size=args.queries)
+    queries = gallery.matrix[picks] + rng.normal(0.0, 0.02, size=(args.queries, 128)).astype(np.float32)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery.matrix, n_lists=args.lists)
+    index.bind(gallery.matrix)
+    print(f"[INFO] Built index with {index.n_lists} lists in {time.perf_counter() - start:.1f}s")
+
+    exact_rows, exact_ms = time_search(lambda q: np.argmin(gallery.distances(q), axis=1),
+                                       queries, args.faces_per_frame)
+    print(f"\n{'method':<14}{'recall@1':>10}{'ms/face':>10}{'speed-up':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{exact_ms:>10.3f}{1.0:>10.1f}")
+
+    for nprobe in args.nprobe:
+        if nprobe > index.n_lists:
+            continue
+        ann_rows, ann_ms = time_search(lambda q: index.search(q, k=1, nprobe=nprobe)[0][:, 0],
+                                       queries, args.faces_per_frame)
+        recall = np.mean(ann_rows == exact_rows)
+        print(f"{f'ivf nprobe={nprobe}':<14}{recall:>10.3f}{ann_ms:>10.3f}{exact_ms / ann_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
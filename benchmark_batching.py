@@ -0,0 +1,96 @@
+import argparse
+import json
+import threading
+import time
+import face_recognition
+from batch_encoder import MicroBatchEncoder
+from benchmark import DATASET_IMAGES, load_dataset_frames, percentiles_ms, environment
+from frame_processing import DETECTION_SCALE, prepare_frame
+
+
+def run_load(encode, requests, streams, per_stream):
+    """Closed-loop load: each stream thread encodes its frames one after another
+
+    Returns (per-request latencies in seconds, faces encoded, wall time).
+    """
+    latencies = []
+    faces = [0]
+    lock = threading.Lock()
+
+    def stream(offset):
+        local = []
+        count = 0
+        for i in range(per_stream):
+            rgb, locations = requests[(offset + i) % len(requests)]
+            start = time.perf_counter()
+            encode(rgb, locations)
+            local.append(time.perf_counter() - start)
+            count += len(locations)
+        with lock:
+            latencies.extend(local)
+            faces[0] += count
+
+    threads = [threading.Thread(target=stream, args=(s * 7,)) for s in range(streams)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, faces[0], time.perf_counter() - start
+
+
+def report(name, latencies, faces, wall, **extra):
+    result = {'config': name, 'requests': len(latencies), 'faces': faces,
+              'faces_per_s': round(faces / wall, 1)}
+    result.update(percentiles_ms(latencies))
+    result.update(extra)
+    print(f"{name:<28}{result['faces_per_s']:>12.1f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput versus latency of micro-batched face encoding")
+    parser.add_argument('-o', '--output', default='benchmark_batching.json')
+    parser.add_argument('--streams', type=int, default=4, help="concurrent frame producers")
+    parser.add_argument('--frames', type=int, default=30, help="frames submitted per stream and configuration")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--deadlines-ms', type=float, nargs='+', default=[2, 10, 25])
+    args = parser.parse_args()
+
+    frames = load_dataset_frames()
+    requests = []
+    for frame in frames:
+        rgb = prepare_frame(frame, DETECTION_SCALE)
+        locations = face_recognition.face_locations(rgb, model="hog")
+        if locations:
+            requests.append((rgb, locations))
+    if not requests:
+        print(f"[ERROR] No faces detected in {DATASET_IMAGES}")
+        return
+    faces_per_frame = sum(len(locations) for _, locations in requests) / len(requests)
+    print(f"[INFO] {len(requests)} frames with faces ({faces_per_frame:.1f} per frame), {args.streams} streams")
+    print(f"\n{'configuration':<28}{'faces/s':>12}{'p50 ms':>10}{'p95 ms':>10}")
+
+    results = []
+    # Baseline: every frame encodes its own faces with face_recognition.face_encodings
+    results.append(report('unbatched', *run_load(face_recognition.face_encodings, requests,
+                                                 args.streams, args.frames), batch_size=None, deadline_ms=None))
+    for batch_size in args.batch_sizes:
+        for deadline_ms in args.deadlines_ms:
+            encoder = MicroBatchEncoder(batch_size, deadline_ms)
+            latencies, faces, wall = run_load(encoder.encode, requests, args.streams, args.frames)
+            encoder.close()
+            results.append(report(f'batch={batch_size} deadline={deadline_ms:g}ms', latencies, faces, wall,
+                                  batch_size=batch_size, deadline_ms=deadline_ms,
+                                  mean_batch=round(encoder.faces_encoded / max(encoder.batches_run, 1), 2)))
+
+    best = max(results, key=lambda r: r['faces_per_s'])
+    print(f"\n[INFO] Highest throughput: {best['config']} ({best['faces_per_s']} faces/s, p95 {best['p95_ms']} ms)")
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'settings': vars(args), 'faces_per_frame': faces_per_frame,
+                   'results': results}, f, indent=2)
+    print(f"[INFO] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
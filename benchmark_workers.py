@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import threading
+import time
+from batch_encoder import encode_faces
+from benchmark import DATASET_IMAGES, load_dataset_frames, load_video, environment
+from frame_processing import DETECTION_SCALE, FrameBuffers, detect_faces
+from shm_workers import ShmWorkerPool
+
+
+def run_in_process(frames, count):
+    """Frames per second detecting and encoding on the calling thread"""
+    buffers = FrameBuffers()
+    start = time.perf_counter()
+    for i in range(count):
+        rgb_small_frame = buffers.prepare(frames[i % len(frames)], DETECTION_SCALE)
+        encode_faces(rgb_small_frame, detect_faces(rgb_small_frame))
+    return count / (time.perf_counter() - start)
+
+
+def run_pool(pool, frames, count):
+    """Frames per second through the pool, fed as fast as it frees ring slots"""
+    collected = [0]
+
+    def collect():
+        while collected[0] < count:
+            result = pool.get_result(timeout=1.0)
+            if result is not None:
+                pool.release(result[1])
+                collected[0] += 1
+
+    collector = threading.Thread(target=collect)
+    start = time.perf_counter()
+    collector.start()
+    for i in range(count):
+        pool.wait_for_slot()
+        pool.submit(i, frames[i % len(frames)])
+    collector.join()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition throughput of shared-memory worker processes")
+    parser.add_argument('-o', '--output', default='benchmark_workers.json')
+    parser.add_argument('--video', help="take frames from this video instead of the dataset photos")
+    parser.add_argument('--frames', type=int, default=200, help="frames recognised per configuration")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    frames = load_video(args.video, 100) if args.video else load_dataset_frames()
+    if not frames:
+        print(f"[ERROR] No frames found in {args.video or DATASET_IMAGES}")
+        return
+    if max(args.workers) > (os.cpu_count() or 1):
+        print(f"[WARNING] Only {os.cpu_count()} CPUs: more workers than that cannot scale")
+
+    print(f"[INFO] {args.frames} frames of {frames[0].shape[1]}x{frames[0].shape[0]} per configuration")
+    print(f"\n{'configuration':<20}{'frames/s':>10}{'speed-up':>10}{'per worker':>12}")
+    baseline = run_in_process(frames, args.frames)
+    print(f"{'in process':<20}{baseline:>10.1f}{1.0:>10.2f}{1.0:>12.2f}")
+    results = [{'config': 'in process', 'workers': 0, 'frames_per_s': round(baseline, 1)}]
+    for workers in args.workers:
+        pool = ShmWorkerPool(workers)
+        try:
+            # The first frames wait for the workers to load the models
+            run_pool(pool, frames, pool.slots * 2)
+            fps = run_pool(pool, frames, args.frames)
+        finally:
+            pool.close()
+        speedup = fps / baseline
+        print(f"{f'{workers} workers':<20}{fps:>10.1f}{speedup:>10.2f}{speedup / workers:>12.2f}")
+        results.append({'config': f'{workers} workers', 'workers': workers, 'frames_per_s': round(fps, 1),
+                        'speedup': round(speedup, 2), 'efficiency': round(speedup / workers, 2)})
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'settings': vars(args), 'results': results}, f, indent=2)
+    print(f"[INFO] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
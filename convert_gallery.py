@@ -0,0 +1,31 @@
+import argparse
+import os
+from face_gallery import GALLERY_FILE, LEGACY_ENCODINGS_FILE, load_gallery, load_legacy_pickle, save_gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a known_faces.pkl into the memory-mapped gallery format")
+    parser.add_argument('source', nargs='?', default=LEGACY_ENCODINGS_FILE, help="pickle to convert")
+    parser.add_argument('destination', nargs='?', default=GALLERY_FILE, help="gallery file to write")
+    parser.add_argument('--model', default='unknown',
+                        help="encoder/model description stored in the header")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"[ERROR] {args.source} not found!")
+        return
+
+    gallery = load_legacy_pickle(args.source)
+    gallery.model = args.model
+    save_gallery(gallery, args.destination)
+
+    # Read it back to make sure the file is usable before anyone relies on it
+    converted = load_gallery(args.destination)
+    print(f"[SUCCESS] Converted {args.source} -> {args.destination}")
+    print(f"- Encodings: {len(converted)}")
+    print(f"- People: {converted.identities}")
+    print(f"- Size: {os.path.getsize(args.source)} -> {os.path.getsize(args.destination)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,50 @@
-import face_recognition
 import cv2
+from frame_processing import FrameBuffers
+from metrics import METRICS, start_metrics_server
+from model_loader import face_recognition, prewarm
+from video_pipeline import find_camera
+
+# The detector loads in the background while the camera opens
+prewarm()
+
+METRICS_PORT = None  # e.g. 9100 to serve per-stage metrics at http://127.0.0.1:9100/metrics
+
+if METRICS_PORT is not None:
+    METRICS.enabled = True
+    start_metrics_server(METRICS_PORT)
 
 print("[INFO] Initializing camera...")
 
-# Start webcam
-video_capture = cv2.VideoCapture(0)
-
-# Check if camera opened successfully
-if not video_capture.isOpened():
-    print("[ERROR] Could not open camera. Trying different camera indices...")
-    for i in range(1, 4):
-        video_capture = cv2.VideoCapture(i)
-        if video_capture.isOpened():
-            print(f"[INFO] Camera found at index {i}")
-            break
-    else:
-        print("[ERROR] No camera found!")
-        exit(1)
-
-# Set camera properties for better performance
-video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-video_capture.set(cv2.CAP_PROP_FPS, 30)
+# Start webcam (the camera that worked last time is tried first)
+video_capture, camera_index = find_camera(width=640, height=480, fps=30)
+if video_capture is None:
+    print("[ERROR] No camera found!")
+    exit(1)
+print(f"[INFO] Camera found at index {camera_index}")
 
 print("[INFO] Starting live webcam face detection...")
 print("[INFO] Press 'q' to quit")
 
+buffers = FrameBuffers()
+
 while True:
-    ret, frame = video_capture.read()
+    with METRICS.time('capture'):
+        ret, frame = video_capture.read()
     if not ret:
         print("[ERROR] Failed to grab frame from camera")
         continue
+    METRICS.counter('frames_read_total', 'Frames read from the video source').inc()
 
     # Show original frame dimensions for debugging
     height, width = frame.shape[:2]
     
-    # Resize frame for speed
-    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-    rgb_small_frame = small_frame[:, :, ::-1]  # Convert BGR to RGB
+    # Resize frame for speed and convert BGR to RGB, into buffers reused every frame
+    rgb_small_frame = buffers.prepare(frame, 0.25)
 
     # Detect face locations
-    face_locations = face_recognition.face_locations(rgb_small_frame)
+    with METRICS.time('face_locations'):
+        face_locations = face_recognition.face_locations(rgb_small_frame)
+    METRICS.counter('faces_detected_total', 'Faces found by the detector').inc(len(face_locations))
     
     print(f"[DEBUG] Detected {len(face_locations)} faces in frame")
 
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+import numpy as np
+from training_images import DETECT_SIZE
+
+CACHE_FILE = 'encoding_cache.sqlite'
+
+
+def _package_version(name):
+    """Installed version of a package, or 'unknown'"""
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return 'unknown'
+
+
+_MODEL_VERSIONS = (f"face_recognition_models={_package_version('face_recognition_models')};"
+                   f"dlib={_package_version('dlib')}")
+
+
+def detection_config(detect_size=DETECT_SIZE):
+    """Everything that changes the face box and landmarks found in a training image"""
+    return f"{_MODEL_VERSIONS};detector=hog;upsample=1;detect_size={detect_size};landmarks=small;v3"
+
+
+def encoding_config(jitters=1, detect_size=DETECT_SIZE):
+    """Everything that changes the encoding of a training image (bump the suffix when encoding changes)"""
+    return f"{detection_config(detect_size)};jitters={jitters};v2"
+
+
+DETECTION_CONFIG = detection_config()
+ENCODING_CONFIG = encoding_config()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EncodingCache:
+    """Persistent per-image encoding cache keyed by content hash and encoder config
+
+    Files are hashed only when their size or mtime changes, so an unchanged
+    dataset costs one stat() per image. Renamed or copied images hit the cache
+    through their content hash. Images with no face are cached too, so they
+    are not re-run on every training.
+
+    Face boxes and landmarks are cached separately under the detection
+    config, so changing only encoding settings (e.g. jitters) re-runs the
+    encoder but not detection.
+    """
+
+    def __init__(self, path=CACHE_FILE, config=ENCODING_CONFIG, detection_config=DETECTION_CONFIG):
+        self.path = path
+        self.config = config
+        self.detection_config = detection_config
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT);
+            CREATE TABLE IF NOT EXISTS encodings (
+                digest TEXT, config TEXT, encoding BLOB, error TEXT,
+                PRIMARY KEY (digest, config));
+            CREATE TABLE IF NOT EXISTS detections (
+                digest TEXT, config TEXT, box BLOB, landmarks BLOB, error TEXT,
+                PRIMARY KEY (digest, config));
+        """)
+
+    def digest(self, path):
+        """Content hash of path, re-hashing only if the file changed since last seen"""
+        stat = os.stat(path)
+        row = self.db.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = file_digest(path)
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                        (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def get(self, digest):
+        """Cached (encoding, error) for a digest, or None on a miss"""
+        row = self.db.execute("SELECT encoding, error FROM encodings WHERE digest = ? AND config = ?",
+                              (digest, self.config)).fetchone()
+        if row is None:
+            return None
+        encoding = np.frombuffer(row[0], dtype=np.float64).copy() if row[0] is not None else None
+        return encoding, row[1]
+
+    def put(self, digest, encoding, error=None):
+        """Store the encoding (or the reason there is none) for a digest"""
+        blob = np.asarray(encoding, dtype=np.float64).tobytes() if encoding is not None else None
+        self.db.execute("INSERT OR REPLACE INTO encodings VALUES (?, ?, ?, ?)",
+                        (digest, self.config, blob, error))
+
+    def get_detection(self, digest):
+        """Cached (detection, error) for a digest, or None on a miss
+
+        detection is (box, landmarks) in full-resolution pixels, or None if
+        the image has no face.
+        """
+        row = self.db.execute("SELECT box, landmarks, error FROM detections WHERE digest = ? AND config = ?",
+                              (digest, self.detection_config)).fetchone()
+        if row is None:
+            return None
+        if row[0] is None:
+            return None, row[2]
+        box = tuple(int(v) for v in np.frombuffer(row[0], dtype=np.int32))
+        landmarks = np.frombuffer(row[1], dtype=np.int32).reshape(-1, 2).copy()
+        return (box, landmarks), row[2]
+
+    def put_detection(self, digest, detection, error=None):
+        """Store the face box and landmarks (or the reason there are none) for a digest"""
+        box = landmarks = None
+        if detection is not None:
+            box = np.asarray(detection[0], dtype=np.int32).tobytes()
+            landmarks = np.asarray(detection[1], dtype=np.int32).tobytes()
+        self.db.execute("INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)",
+                        (digest, self.detection_config, box, landmarks, error))
+
+    def prune(self, live_paths):
+        """Forget deleted images and encodings no image refers to any more"""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS live (path TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM live")
+        self.db.executemany("INSERT OR IGNORE INTO live VALUES (?)", ((p,) for p in live_paths))
+        removed_files = self.db.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM live)").rowcount
+        removed_encodings = self.db.execute(
+            "DELETE FROM encodings WHERE config != ? OR digest NOT IN (SELECT digest FROM files)",
+            (self.config,)).rowcount
+        self.db.execute("DELETE FROM detections WHERE config != ? OR digest NOT IN (SELECT digest FROM files)",
+                        (self.detection_config,))
+        return removed_files, removed_encodings
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from metrics import METRICS
+from video_pipeline import DropOldestQueue
+
+EVENT_LOG_FILE = 'recognition_events.sqlite'
+ENTER_AFTER = 2          # Sightings of a person needed before an enter event (filters one-frame misidentifications)
+LEAVE_AFTER = 3.0        # Seconds without a sighting before a leave event
+EVENT_QUEUE_SIZE = 4096  # Events waiting for the writer before the oldest are dropped
+EVENT_BATCH_SIZE = 256   # Most events written in one transaction
+FLUSH_INTERVAL = 1.0     # Seconds the writer waits to fill a batch
+RECENT_EVENTS = 256      # Events kept in memory for status lines and queries
+
+
+class RecognitionEvent:
+    """A person entering or leaving the view of one stream"""
+    __slots__ = ('kind', 'name', 'stream', 'time', 'confidence', 'duration')
+
+    def __init__(self, kind, name, stream, time, confidence, duration=None):
+        self.kind = kind
+        self.name = name
+        self.stream = stream
+        self.time = time
+        self.confidence = confidence
+        self.duration = duration
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __str__(self):
+        where = f" on stream {self.stream}" if self.stream is not None else ""
+        if self.kind == 'enter':
+            return f"{self.name} entered{where} (confidence: {self.confidence:.2f})"
+        return f"{self.name} left{where} after {self.duration:.1f}s (best confidence: {self.confidence:.2f})"
+
+
+class _Presence:
+    __slots__ = ('first_seen', 'last_seen', 'sightings', 'confidence', 'entered')
+
+    def __init__(self, now, confidence):
+        self.first_seen = self.last_seen = now
+        self.sightings = 1
+        self.confidence = confidence
+        self.entered = False
+
+
+class EventDebouncer:
+    """Turns per-frame sightings into one enter and one leave event per visit
+
+    A person enters after `enter_after` sightings and leaves once they have
+    not been seen for `leave_after` seconds. Unknown faces are ignored.
+    """
+
+    def __init__(self, enter_after=ENTER_AFTER, leave_after=LEAVE_AFTER):
+        self.enter_after = enter_after
+        self.leave_after = leave_after
+        self.present = {}  # (stream, name) -> _Presence
+
+    def observe(self, faces, stream=None, now=None):
+        """Events caused by the ((top, right, bottom, left), name, confidence) faces of one frame"""
+        now = time.time() if now is None else now
+        events = []
+        for _, name, confidence in faces:
+            if name == "Unknown":
+                continue
+            presence = self.present.get((stream, name))
+            if presence is None:
+                presence = self.present[stream, name] = _Presence(now, confidence)
+            else:
+                presence.last_seen = now
+                presence.sightings += 1
+                presence.confidence = max(presence.confidence, confidence)
+            if not presence.entered and presence.sightings >= self.enter_after:
+                presence.entered = True
+                events.append(RecognitionEvent('enter', name, stream, now, confidence))
+        events.extend(self.expire(now, stream))
+        return events
+
+    def expire(self, now=None, stream=None, force=False):
+        """Leave events for people of a stream not seen for leave_after seconds (everyone if force)"""
+        now = time.time() if now is None else now
+        events = []
+        for key in [key for key, p in self.present.items()
+                    if key[0] == stream and (force or now - p.last_seen > self.leave_after)]:
+            presence = self.present.pop(key)
+            if presence.entered:
+                events.append(RecognitionEvent('leave', key[1], stream, presence.last_seen, presence.confidence,
+                                               presence.last_seen - presence.first_seen))
+        return events
+
+    def names(self):
+        """People currently present on any stream"""
+        return sorted({name for (_, name), p in self.present.items() if p.entered})
+
+
+class SQLiteEventStore:
+    """Appends events to an SQLite table (opened on the writer thread)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+
+    def open(self):
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY, time REAL, kind TEXT, name TEXT, stream TEXT,
+            confidence REAL, duration REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_time ON events (time)")
+        self.db.commit()
+
+    def write(self, events):
+        self.db.executemany(
+            "INSERT INTO events (time, kind, name, stream, confidence, duration) VALUES (?, ?, ?, ?, ?, ?)",
+            [(e.time, e.kind, e.name, None if e.stream is None else str(e.stream), float(e.confidence),
+              e.duration) for e in events])
+        self.db.commit()
+
+    def read(self, limit=20, name=None):
+        """Latest events, oldest first"""
+        db = sqlite3.connect(self.path)
+        try:
+            query = "SELECT time, kind, name, stream, confidence, duration FROM events"
+            params = []
+            if name is not None:
+                query += " WHERE name = ?"
+                params.append(name)
+            rows = db.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        finally:
+            db.close()
+        return [RecognitionEvent(kind, name, stream, t, confidence, duration)
+                for t, kind, name, stream, confidence, duration in reversed(rows)]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+
+class JSONLEventStore:
+    """Appends events to a file with one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, events):
+        self.file.write(''.join(json.dumps(e.to_dict()) + '\n' for e in events))
+        self.file.flush()
+
+    def read(self, limit=20, name=None):
+        events = deque(maxlen=limit)
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if name is None or record['name'] == name:
+                    events.append(RecognitionEvent(**record))
+        return list(events)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def open_event_store(path=EVENT_LOG_FILE):
+    """JSON lines for .jsonl files, SQLite otherwise"""
+    if path.endswith('.jsonl'):
+        return JSONLEventStore(path)
+    return SQLiteEventStore(path)
+
+
+class EventLog:
+    """Debounces sightings into events and persists them without blocking the caller
+
+    observe() runs on the frame loop: it updates the debouncer, keeps the
+    event in a ring of recent events and puts it on a bounded drop-oldest
+    queue. A writer thread takes events off the queue in batches and writes
+    each batch in one transaction. If the store cannot keep up, the oldest
+    queued events are dropped and counted, and recognition is not slowed.
+    With no store, events are only printed.
+    """
+
+    def __init__(self, store, debouncer=None, queue_size=EVENT_QUEUE_SIZE, batch_size=EVENT_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, echo=True):
+        self.store = store
+        self.debouncer = debouncer or EventDebouncer()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.queue = DropOldestQueue(queue_size, name='events')
+        self.logged = 0
+        self.written = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def observe(self, faces, stream=None):
+        """Record the faces of one processed frame; returns the events it caused"""
+        with self._lock:
+            events = self.debouncer.observe(faces, stream)
+        self.record(events)
+        return events
+
+    def end_stream(self, stream=None):
+        """Leave events for everyone still present on a stream"""
+        with self._lock:
+            events = self.debouncer.expire(stream=stream, force=True)
+        self.record(events)
+
+    def record(self, events):
+        for event in events:
+            self.recent.append(event)
+            self.queue.put(event)
+            self.logged += 1
+            METRICS.counter('recognition_events_total', 'Enter and leave events', kind=event.kind).inc()
+
+    @property
+    def dropped(self):
+        return self.queue.dropped
+
+    def present(self):
+        with self._lock:
+            return self.debouncer.names()
+
+    def status(self):
+        present = self.present()
+        return (f"Events: {self.logged} ({self.dropped} dropped)"
+                + (f" | Present: {', '.join(present)}" if present else ""))
+
+    def _run(self):
+        try:
+            if self.store is not None:
+                self.store.open()
+        except Exception as e:
+            self.error = e
+            print(f"[WARNING] Event store {self.store.path} unavailable, events are not saved: {e}")
+        while True:
+            event = self.queue.get(timeout=self.flush_interval)
+            if event is None:
+                if self.queue.closed:
+                    break
+                continue
+            batch = [event]
+            while len(batch) < self.batch_size:
+                event = self.queue.get_nowait()
+                if event is None:
+                    break
+                batch.append(event)
+            self._write(batch)
+        if self.store is not None:
+            self.store.close()
+
+    def _write(self, batch):
+        if self.echo:
+            print("\n".join(f"[EVENT] {event}" for event in batch))
+        if self.store is None or self.error is not None:
+            return
+        try:
+            self.store.write(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.error = e
+            print(f"[WARNING] Writing events to {self.store.path} failed, events are no longer saved: {e}")
+
+    def close(self, timeout=5.0):
+        """Emit leave events for everyone still present, write everything queued and stop"""
+        with self._lock:
+            streams = {stream for stream, _ in self.debouncer.present}
+        for stream in streams:
+            self.end_stream(stream)
+        self.queue.close()
+        self._thread.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the latest recognition events")
+    parser.add_argument('path', nargs='?', default=EVENT_LOG_FILE)
+    parser.add_argument('-n', '--limit', type=int, default=20)
+    parser.add_argument('--name', help="only events for this person")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"[ERROR] {args.path} not found")
+        return
+    for event in open_event_store(args.path).read(args.limit, args.name):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.time))}  {event}")
+
+
+if __name__ == "__main__":
+    main()
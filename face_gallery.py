@@ -0,0 +1,247 @@
+import json
+import os
+import pickle
+import struct
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: gallery writers are not serialised between processes
+    fcntl = None
+
+DEFAULT_TOLERANCE = 0.6
+GALLERY_FILE = 'known_faces.gallery'
+LEGACY_ENCODINGS_FILE = 'known_faces.pkl'
+
+# On-disk gallery layout: magic, uint32 header length, JSON header, then the
+# float32 encoding matrix and int32 identity labels at 64-byte aligned offsets
+GALLERY_MAGIC = b'FACEGAL\0'
+GALLERY_FORMAT_VERSION = 1
+_ALIGNMENT = 64
+
+
+class FaceGallery:
+    """Known face encodings held as one contiguous float32 matrix
+
+    Rows are grouped by identity so that the per-identity minimum distance can
+    be taken with a single reduceat over the distance matrix. Squared row norms
+    are computed once, so matching a whole frame of faces is one matrix
+    multiply instead of a compare_faces + face_distance pass per face.
+    """
+
+    def __init__(self, encodings, names, model='unknown'):
+        names = list(names)
+        self.model = model
+        matrix = np.asarray(encodings, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, 128)
+        if matrix.ndim != 2 or matrix.shape[0] != len(names):
+            raise ValueError(f"Expected {len(names)} encodings, got array of shape {matrix.shape}")
+
+        # Identity index in order of first appearance
+        self.identities = list(dict.fromkeys(names))
+        identity_index = {name: i for i, name in enumerate(self.identities)}
+        labels = np.fromiter((identity_index[name] for name in names), dtype=np.int32, count=len(names))
+
+        # Group rows by identity (a no-op for galleries written by the training scripts)
+        if len(labels) > 1 and np.any(labels[1:] < labels[:-1]):
+            order = np.argsort(labels, kind='stable')
+            matrix = matrix[order]
+            labels = labels[order]
+
+        self._set_arrays(matrix, labels)
+
+    @classmethod
+    def from_arrays(cls, matrix, labels, identities, model='unknown'):
+        """Wrap an identity-grouped matrix (e.g. a read-only memmap) without copying it"""
+        gallery = cls.__new__(cls)
+        gallery.identities = list(identities)
+        gallery.model = model
+        gallery._set_arrays(matrix, np.asarray(labels, dtype=np.int32))
+        return gallery
+
+    def _set_arrays(self, matrix, labels):
+        """Set the encoding matrix and identity labels and derive the lookup tables"""
+        self.matrix = matrix if matrix.flags.c_contiguous else np.ascontiguousarray(matrix)
+        self.labels = labels
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self._starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]]) if len(labels) else labels
+        self._one_row_per_identity = len(self._starts) == len(labels)
+        self.index = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def names(self):
+        """Name of each gallery row"""
+        return [self.identities[i] for i in self.labels]
+
+    def with_encodings(self, name, encodings):
+        """New gallery with extra encodings for one (new or existing) person"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        return FaceGallery(np.vstack([self.matrix, encodings]), self.names + [name] * len(encodings), self.model)
+
+    def attach_index(self, index):
+        """Use an approximate nearest-neighbour index (e.g. IVFIndex) in identify()"""
+        index.bind(self.matrix)
+        self.index = index
+
+    def distances(self, face_encodings):
+        """Euclidean distance from every face to every gallery row, shape (faces, rows)"""
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        d2 = queries @ self.matrix.T
+        d2 *= -2.0
+        d2 += q_sq[:, None]
+        d2 += self.sq_norms[None, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def identity_distances(self, face_encodings):
+        """Distance from every face to the closest row of each identity, shape (faces, identities)"""
+        d = self.distances(face_encodings)
+        if self._one_row_per_identity or d.shape[1] == 0:
+            return d
+        return np.minimum.reduceat(d, self._starts, axis=1)
+
+    def match(self, face_encodings, k=1):
+        """Top-k identities for each face
+
+        Returns (identity_ids, distances), both of shape (faces, k), sorted by
+        increasing distance. Use self.identities to map ids to names.
+        """
+        per_identity = self.identity_distances(face_encodings)
+        k = min(k, per_identity.shape[1])
+        if k == 0:
+            empty = np.empty((per_identity.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        if k < per_identity.shape[1]:
+            top = np.argpartition(per_identity, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (per_identity.shape[0], k))
+        top_distances = np.take_along_axis(per_identity, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+    def identify(self, face_encodings, tolerance=DEFAULT_TOLERANCE):
+        """Best (name, distance) per face, with "Unknown" for faces above tolerance"""
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [("Unknown", float('inf')) for _ in face_encodings]
+
+        if self.index is not None:
+            rows, dists = self.index.search(face_encodings, k=1)
+            ids = np.where(rows >= 0, self.labels[np.maximum(rows, 0)], -1)
+        else:
+            ids, dists = self.match(face_encodings, k=1)
+
+        results = []
+        for identity_id, distance in zip(ids[:, 0], dists[:, 0]):
+            if identity_id >= 0 and distance <= tolerance:
+                results.append((self.identities[identity_id], float(distance)))
+            else:
+                results.append(("Unknown", float(distance)))
+        return results
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+@contextmanager
+def gallery_lock(path=GALLERY_FILE):
+    """Hold an exclusive lock on the gallery file while reading and rewriting it
+
+    Live enrolment, manage_unknowns.py and the trainers all write the same
+    file. Holding this lock (on a separate path.lock file, as the gallery
+    itself is replaced by rename) keeps one writer from overwriting a file
+    another wrote after it was read.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_gallery(gallery, path=GALLERY_FILE):
+    """Write a gallery in the versioned memory-mappable format
+
+    The file is written next to the target and renamed into place, so readers
+    only ever see a complete gallery.
+    """
+    count, dim = gallery.matrix.shape
+    header = {
+        'format_version': GALLERY_FORMAT_VERSION,
+        'model': gallery.model,
+        'count': count,
+        'dim': dim,
+        'dtype': 'float32',
+        'identities': gallery.identities,
+    }
+    # Offsets depend on the header length, so size the header with placeholders first
+    header['matrix_offset'] = header['labels_offset'] = 0
+    prefix_length = len(GALLERY_MAGIC) + 4 + len(json.dumps(header).encode('utf-8')) + 64
+    header['matrix_offset'] = _aligned(prefix_length)
+    header['labels_offset'] = _aligned(header['matrix_offset'] + count * dim * 4)
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(GALLERY_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (header['matrix_offset'] - f.tell()))
+        f.write(np.ascontiguousarray(gallery.matrix, dtype='<f4').tobytes())
+        f.write(b'\0' * (header['labels_offset'] - f.tell()))
+        f.write(np.ascontiguousarray(gallery.labels, dtype='<i4').tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_gallery_header(path):
+    """Read and validate the JSON header of a gallery file"""
+    with open(path, 'rb') as f:
+        if f.read(len(GALLERY_MAGIC)) != GALLERY_MAGIC:
+            raise ValueError(f"{path} is not a face gallery file")
+        (header_length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    if header.get('format_version') != GALLERY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported gallery format version {header.get('format_version')}")
+    return header
+
+
+def load_gallery(path=GALLERY_FILE, mmap=True):
+    """Load a gallery file, memory-mapping the encodings read-only by default
+
+    Mapped pages come from the OS page cache, so several recognition
+    processes on one host share a single copy of the gallery.
+    """
+    header = read_gallery_header(path)
+    shape = (header['count'], header['dim'])
+    if mmap and header['count'] > 0:
+        matrix = np.memmap(path, dtype='<f4', mode='r', offset=header['matrix_offset'], shape=shape)
+        labels = np.memmap(path, dtype='<i4', mode='r', offset=header['labels_offset'], shape=(header['count'],))
+    else:
+        with open(path, 'rb') as f:
+            f.seek(header['matrix_offset'])
+            matrix = np.fromfile(f, dtype='<f4', count=shape[0] * shape[1]).reshape(shape)
+            f.seek(header['labels_offset'])
+            labels = np.fromfile(f, dtype='<i4', count=shape[0])
+    return FaceGallery.from_arrays(matrix, labels, header['identities'], model=header['model'])
+
+
+def load_legacy_pickle(path=LEGACY_ENCODINGS_FILE):
+    """Load a (known_encodings, known_names) pickle written by older training scripts
+
+    Only use this on files you created yourself: unpickling can run arbitrary code.
+    """
+    with open(path, 'rb') as f:
+        known_encodings, known_names = pickle.load(f)
+    return FaceGallery(known_encodings, known_names)
@@ -1,169 +1,551 @@
-import face_recognition
 import cv2
-import pickle
 import os
 import time
+import argparse
+import threading
 import numpy as np
+from face_gallery import GALLERY_FILE, LEGACY_ENCODINGS_FILE, load_gallery, load_legacy_pickle
+from ivf_index import IVFIndex, DEFAULT_NPROBE
+from frame_processing import DETECTION_SCALE, FrameBuffers, recognize_frame, match_faces, draw_face_results
+from face_tracker import FaceTracker
+from motion_gate import MotionGate, MotionGatedRecognizer, ROI_SCALE
+from multiscale_detection import DETECTION_MODES, make_detector, recognize_frame_multiscale
+from adaptive_scheduler import AdaptiveScheduler
+from gallery_watcher import EnrolmentSession, watch_gallery
+from metrics import METRICS, start_metrics_server, draw_metrics_overlay
+from model_loader import StartupReport, prewarm
+from event_log import EventLog, EVENT_LOG_FILE, open_event_store
+from unknown_clusters import UnknownFaceClusters, UNKNOWN_DIR
+from output_sinks import OutputSinks, MJPEGPreviewSink, VideoRecorderSink, SnapshotSink, SNAPSHOT_DIR
+from shm_workers import ShmWorkerPool
+from video_pipeline import RecognitionPipeline, find_camera, open_video_source, is_camera_source
+
+ANN_INDEX_FILE = 'known_faces.ivf.npz'
 
 def load_known_faces():
-    """Load known face encodings from pickle file"""
-    encodings_file = 'known_faces.pkl'
-    
-    if not os.path.exists(encodings_file):
-        print(f"[ERROR] {encodings_file} not found!")
-        print("[INFO] Available files:", os.listdir('.'))
-        return None, None
-    
+    """Load known face encodings into a FaceGallery (memory-mapped when possible)"""
     try:
-        with open(encodings_file, 'rb') as f:
-            known_encodings, known_names = pickle.load(f)
-        print(f"[INFO] Loaded {len(known_names)} known faces: {known_names}")
-        return known_encodings, known_names
+        if os.path.exists(GALLERY_FILE):
+            gallery = load_gallery(GALLERY_FILE)
+        elif os.path.exists(LEGACY_ENCODINGS_FILE):
+            print(f"[WARNING] {GALLERY_FILE} not found, loading legacy {LEGACY_ENCODINGS_FILE}")
+            print("[INFO] Run convert_gallery.py once to convert it")
+            gallery = load_legacy_pickle(LEGACY_ENCODINGS_FILE)
+        else:
+            print(f"[ERROR] {GALLERY_FILE} not found!")
+            print("[INFO] Available files:", os.listdir('.'))
+            return None
+        
+        print(f"[INFO] Loaded {len(gallery)} encodings of {len(gallery.identities)} people: {gallery.identities[:20]}")
+        return gallery
     except Exception as e:
         print(f"[ERROR] Failed to load known faces: {e}")
-        return None, None
+        return None
+
+def attach_ann_index(gallery, nprobe):
+    """Attach the approximate nearest-neighbour index built by the training script"""
+    if not os.path.exists(ANN_INDEX_FILE):
+        print(f"[WARNING] {ANN_INDEX_FILE} not found, using exact matching")
+        return
+    
+    try:
+        gallery.attach_index(IVFIndex.load(ANN_INDEX_FILE, nprobe=nprobe))
+        print(f"[INFO] Using ANN index with {gallery.index.n_lists} lists (nprobe={nprobe})")
+    except Exception as e:
+        print(f"[WARNING] Failed to load ANN index, using exact matching: {e}")
 
 def initialize_camera():
     """Initialize camera with error handling"""
     print("[INFO] Initializing camera...")
     
-    # Try different camera indices
-    for camera_index in range(5):
-        video_capture = cv2.VideoCapture(camera_index)
-        if video_capture.isOpened():
-            # Test if we can actually read a frame
-            ret, test_frame = video_capture.read()
-            if ret:
-                print(f"[INFO] Camera successfully opened at index {camera_index}")
-                
-                # Set camera properties for optimal performance
-                video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                video_capture.set(cv2.CAP_PROP_FPS, 15)  # Lower FPS for stability
-                video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce buffer
-                
-                return video_capture
-            video_capture.release()
+    # Tries the camera that worked last time first (cached in camera_cache.json)
+    video_capture, camera_index = find_camera(width=640, height=480, fps=15)  # Lower FPS for stability
+    if video_capture is not None:
+        print(f"[INFO] Camera successfully opened at index {camera_index}")
+        return video_capture
     
     print("[ERROR] No working camera found!")
     return None
 
-def main():
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Live face recognition")
+    parser.add_argument('--ann', action='store_true',
+                        help=f"match with the approximate nearest-neighbour index ({ANN_INDEX_FILE})")
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE,
+                        help="index lists searched per face; higher is slower but more accurate")
+    parser.add_argument('--source',
+                        help="camera index or video file (default: first working camera)")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="run capture, recognition and display on separate threads")
+    parser.add_argument('--shm-workers', type=int, default=0, metavar='N',
+                        help="pipelined mode with detection and encoding in N worker processes "
+                             "fed through shared memory (fixed detection only)")
+    parser.add_argument('--no-display', action='store_true',
+                        help="pipelined mode without a window (prints statistics at the end)")
+    parser.add_argument('--budget-ms', type=float, default=66.0,
+                        help="target average time per displayed frame; detection cadence and scale adapt to it")
+    parser.add_argument('--target-recognition-fps', type=float, default=None,
+                        help="also require at least this many recognised frames per second")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record per-stage latency histograms and counters, shown on screen")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="also serve the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--track', action='store_true',
+                        help="track faces between detections and encode each face once per track")
+    parser.add_argument('--detect-every', type=int, default=5,
+                        help="frames between face detections in --track mode")
+    parser.add_argument('--motion', choices=['diff', 'mog2'], default=None,
+                        help="skip detection on static frames and search only moving regions")
+    parser.add_argument('--roi-scale', type=float, default=ROI_SCALE,
+                        help="detection scale inside motion regions")
+    parser.add_argument('--watch', action=argparse.BooleanOptionalAction, default=True,
+                        help=f"reload {GALLERY_FILE} in the background when it is rewritten")
+    parser.add_argument('--enrol-name',
+                        help="name used by the 'e' key (default: ask on the terminal)")
+    parser.add_argument('--warm-up', action=argparse.BooleanOptionalAction, default=True,
+                        help="run one inference on a blank image while the camera opens")
+    parser.add_argument('--detection', choices=DETECTION_MODES, default='fixed',
+                        help="fixed single downscale, coarse pass refined on full-resolution crops, "
+                             "or coarse-to-fine plus a sparse pyramid for small faces")
+    parser.add_argument('--event-log', action=argparse.BooleanOptionalAction, default=True,
+                        help="save enter/leave events (they are printed either way)")
+    parser.add_argument('--event-file', default=EVENT_LOG_FILE,
+                        help="SQLite file for events, or a .jsonl file for JSON lines")
+    parser.add_argument('--preview-port', type=int, default=None, metavar='PORT',
+                        help="serve the annotated video as MJPEG at http://<preview-host>:PORT/")
+    parser.add_argument('--preview-host', default='127.0.0.1')
+    parser.add_argument('--record', default=None, metavar='PATH',
+                        help="record the annotated video to PATH in the background")
+    parser.add_argument('--record-fps', type=float, default=None,
+                        help="frame rate of the recording (default: the source's)")
+    parser.add_argument('--snapshots', default=None, metavar='DIR',
+                        help="save a snapshot to DIR when a known person appears")
+    parser.add_argument('--collect-unknowns', action='store_true',
+                        help="cluster unknown faces for later naming with manage_unknowns.py")
+    parser.add_argument('--unknowns-dir', default=UNKNOWN_DIR,
+                        help="where unknown-face clusters and thumbnails are kept")
+    return parser.parse_args()
+
+def open_source(args):
+    """Open the requested video source, or probe for a camera"""
+    if args.source is None:
+        return initialize_camera()
+    
+    video_capture = open_video_source(args.source)
+    if video_capture is None:
+        print(f"[ERROR] Could not open video source {args.source}")
+    elif is_camera_source(args.source):
+        video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return video_capture
+
+def draw_status(frame, lines):
+    """Draw status lines in the top-left corner and the controls at the bottom"""
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (10, 30 + 25 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    cv2.putText(frame, "Press 'q'=quit, 'p'=pause, 's'=screenshot, 'e'=enrol", 
+               (10, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
+def open_output_sinks(args, video_capture):
+    """Background sinks for the annotated frames, plus the screenshot writer"""
+    sinks = []
+    if args.preview_port is not None:
+        preview = MJPEGPreviewSink(args.preview_port, args.preview_host)
+        print(f"[INFO] Preview at {preview.url}")
+        sinks.append(preview)
+    if args.record:
+        fps = args.record_fps or video_capture.get(cv2.CAP_PROP_FPS) or 15.0
+        sinks.append(VideoRecorderSink(args.record, fps))
+        print(f"[INFO] Recording to {args.record} at {fps:g} FPS")
+    # Screenshots ('s') are written by the same background writer as event snapshots
+    snapshots = SnapshotSink(args.snapshots or SNAPSHOT_DIR, events=args.snapshots is not None)
+    sinks.append(snapshots)
+    return OutputSinks(sinks), snapshots
+
+def save_screenshot(snapshots, frame):
+    snapshots.save(frame, f"recognition_screenshot_{int(time.time())}.jpg")
+
+_pause_frames = {}
+
+def pause_frame(height, width):
+    """The paused screen for a frame size, drawn once and reused"""
+    key = (height, width)
+    if key not in _pause_frames:
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        cv2.putText(frame, "PAUSED - Press 'p' to resume", 
+                   (width//2 - 150, height//2), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+        _pause_frames[key] = frame
+    return _pause_frames[key]
+
+def open_event_log(args):
+    """Enter/leave events, printed and (unless --no-event-log) saved in the background"""
+    store = open_event_store(args.event_file) if args.event_log else None
+    if store is not None:
+        print(f"[INFO] Recognition events are saved to {args.event_file}")
+    return EventLog(store)
+
+def open_unknown_clusters(args):
+    """Clusters of unknown faces (continuing the saved ones), or None without --collect-unknowns"""
+    if not args.collect_unknowns:
+        return None
+    unknowns = UnknownFaceClusters.load(args.unknowns_dir)
+    unknowns.start_autosave()
+    print(f"[INFO] Collecting unknown faces in {args.unknowns_dir} ({len(unknowns)} clusters so far)")
+    return unknowns
+
+def close_unknown_clusters(unknowns):
+    if unknowns is not None:
+        unknowns.close()
+        print(f"[INFO] {unknowns.status()}; name them with manage_unknowns.py")
+
+def open_shm_workers(args):
+    """Start the --shm-workers processes early, so they load the models while the camera opens"""
+    if not args.shm_workers:
+        return None
+    if args.track or args.motion or args.detection != 'fixed':
+        print("[WARNING] --shm-workers uses fixed detection; --track, --motion and --detection are ignored")
+    if not (args.pipelined or args.no_display):
+        args.pipelined = True
+    print(f"[INFO] Starting {args.shm_workers} detection worker processes")
+    return ShmWorkerPool(args.shm_workers, warm_up=args.warm_up)
+
+def make_result_processor(gallery, events, unknowns=None):
+    """Matches the boxes and encodings returned by the worker processes against the gallery"""
+    def finish_frame(image, face_locations, face_encodings):
+        faces = match_faces(image, face_locations, face_encodings, gallery, scale=1.0, unknowns=unknowns, rgb=False)
+        events.observe(faces)
+        return faces
+    return finish_frame
+
+def make_frame_processor(args, gallery, events, unknowns=None):
+    """Per-frame recognition function for the chosen mode, with the tracker and motion gate if any"""
+    if args.track:
+        tracker = FaceTracker(gallery, detect_every=args.detect_every, unknowns=unknowns)
+        
+        def process_frame(image):
+            faces = tracker.process(image)
+            events.observe(faces)
+            return faces
+        return process_frame, tracker, None
+    
+    if args.motion:
+        motion = MotionGatedRecognizer(gallery, MotionGate(args.motion), roi_scale=args.roi_scale,
+                                       unknowns=unknowns)
+        
+        def process_frame(image, timings=None, scale=DETECTION_SCALE):
+            motion.scale = scale
+            faces = motion.process(image, timings)
+            events.observe(faces)
+            return faces
+        return process_frame, None, motion
+    
+    detector = make_detector(args.detection)
+    buffers = FrameBuffers()
+    
+    def process_frame(image, timings=None, scale=DETECTION_SCALE):
+        if detector is not None:
+            detector.coarse_scale = scale
+            faces = recognize_frame_multiscale(image, gallery, detector, timings=timings, unknowns=unknowns)
+        else:
+            faces = recognize_frame(image, gallery, scale=scale, timings=timings, buffers=buffers,
+                                    unknowns=unknowns)
+        events.observe(faces)
+        return faces
+    return process_frame, None, None
+
+class EnrolmentControl:
+    """Handles the 'e' key: gets a name and collects encodings without stopping the video
+
+    The name comes from --enrol-name or is read from the terminal on a
+    background thread. The enrolment itself (saving the gallery file and
+    swapping in the new gallery) also runs in the background.
+    """
+    
+    def __init__(self, gallery, name=None):
+        self.gallery = gallery
+        self.name = name
+        self.session = None
+        self._asking = False
+    
+    def start(self):
+        if not hasattr(self.gallery, 'enrol'):
+            print(f"[WARNING] Enrolment needs {GALLERY_FILE} and --watch")
+            return
+        if self.session is not None or self._asking:
+            return
+        if self.name:
+            self._begin(self.name)
+            return
+        self._asking = True
+        threading.Thread(target=self._ask_name, name="enrol-prompt", daemon=True).start()
+    
+    def _ask_name(self):
+        try:
+            name = input("[INPUT] Name to enrol (empty to cancel): ").strip()
+        except EOFError:
+            name = ''
+        self._asking = False
+        if name:
+            self._begin(name)
+    
+    def _begin(self, name):
+        print(f"[INFO] Enrolling {name}: look at the camera, alone in the frame")
+        self.session = EnrolmentSession(name)
+    
+    def feed(self, frame):
+        """Offer an undrawn BGR frame to the running enrolment, if any"""
+        session = self.session
+        if session is not None and session.feed(frame):
+            self.gallery.enrol_async(session.name, session.encodings)
+            self.session = None
+    
+    def status(self):
+        session = self.session
+        if session is not None:
+            return session.status()
+        return "Enrolment: type the name in the terminal" if self._asking else None
+
+def report_first_recognition(startup, prewarmer):
+    """Complete the start-up report once the first frame has been recognised"""
+    if not startup.reported:
+        startup.mark('first recognised frame')
+        startup.report(prewarmer)
+
+def tracker_status(tracker):
+    """Overlay line with the tracker's work counters"""
+    return (f"Tracks: {len(tracker.tracks)} | Detections: {tracker.detections_run} | "
+            f"Encoded faces: {tracker.faces_encoded}")
+
+def run_pipelined(args, gallery, video_capture, events, unknowns, sinks, snapshots, startup, prewarmer, workers=None):
+    """Recognition loop with capture, inference and rendering on separate threads"""
+    if workers is not None:
+        tracker = motion = None
+        pipeline = RecognitionPipeline(video_capture, make_result_processor(gallery, events, unknowns),
+                                       make_worker=workers.inference_worker)
+    else:
+        process_frame, tracker, motion = make_frame_processor(args, gallery, events, unknowns)
+        pipeline = RecognitionPipeline(video_capture, process_frame)
+    enrolment = EnrolmentControl(gallery, args.enrol_name)
+    
+    pipeline.start()
+    paused = False
+    display_frame = None
+    
+    try:
+        while True:
+            item = pipeline.next_frame()
+            if item is None:
+                print("[INFO] End of video source")
+                break
+            captured, faces = item
+            if pipeline.latest_result_seq:
+                report_first_recognition(startup, prewarmer)
+            if not paused:
+                enrolment.feed(captured.image)
+                # The inference thread may still be reading this frame, so draw on a copy (into a reused buffer)
+                if display_frame is None or display_frame.shape != captured.image.shape:
+                    display_frame = np.empty_like(captured.image)
+                np.copyto(display_frame, captured.image)
+                frame = display_frame
+            
+                with METRICS.time('draw'):
+                    draw_face_results(frame, faces)
+                status = [f"Frame: {captured.seq} | Faces: {len(faces)} | Known: {len(gallery.identities)} people"]
+                status += pipeline.status_lines()
+                if tracker is not None:
+                    status.append(tracker_status(tracker))
+                if motion is not None:
+                    status.append(motion.status())
+                if workers is not None:
+                    status.append(workers.status())
+                if enrolment.status():
+                    status.append(enrolment.status())
+                status.append(events.status())
+                if unknowns is not None:
+                    status.append(unknowns.status())
+                if sinks.status():
+                    status.append(sinks.status())
+                draw_status(frame, status)
+                if args.metrics:
+                    draw_metrics_overlay(frame, origin=(10, 30 + 25 * len(status)))
+                sinks.submit(frame, faces)
+            
+                if args.no_display:
+                    pipeline.frame_shown()
+                    continue
+            else:
+                # Keep showing the pause screen and reading keys, so 'p' resumes and 'q' quits
+                frame = pause_frame(*captured.image.shape[:2])
+            
+            with METRICS.time('display'):
+                cv2.imshow('Face Recognition - Live Feed', frame)
+            if not paused:
+                pipeline.frame_shown()
+            
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                print("[INFO] Quitting...")
+                break
+            elif key == ord('p'):
+                paused = not paused
+                print(f"[INFO] {'Paused' if paused else 'Resumed'}")
+            elif key == ord('s') and not paused:
+                save_screenshot(snapshots, frame)
+            elif key == ord('e') and not paused:
+                enrolment.start()
+    finally:
+        pipeline.stop()
+        if pipeline.worker.error is not None:
+            print(f"[ERROR] Recognition worker failed: {pipeline.worker.error}")
+        print(f"[INFO] {pipeline.summary()}")
+        if tracker is not None:
+            print(f"[INFO] {tracker_status(tracker)}")
+        if motion is not None:
+            print(f"[INFO] {motion.status()}")
+
+def main(args):
     """Main face recognition loop"""
+    # Load the face models in the background while the gallery and camera are opened
+    startup = StartupReport()
+    # With --shm-workers the workers run their own warm-up; this process only matches and enrols
+    prewarmer = prewarm(warm_up=args.warm_up and not args.shm_workers)
+    
     # Load known faces
-    known_encodings, known_names = load_known_faces()
-    if known_encodings is None:
+    gallery = load_known_faces()
+    if gallery is None:
         return
+    startup.mark('gallery loaded')
+    
+    if args.ann:
+        attach_ann_index(gallery, args.nprobe)
+    
+    # Swap in retrained or enrolled galleries without restarting
+    if args.watch and os.path.exists(GALLERY_FILE):
+        gallery = watch_gallery(gallery, GALLERY_FILE, ANN_INDEX_FILE)
+    
+    # Instrumentation is off (and nearly free) unless asked for
+    METRICS.enabled = args.metrics or args.metrics_port is not None
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+        print(f"[INFO] Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    
+    # Started before the camera opens, so the workers load their models meanwhile
+    workers = open_shm_workers(args)
     
-    # Initialize camera
-    video_capture = initialize_camera()
+    # Initialize camera (or open the requested video source)
+    video_capture = open_source(args)
     if video_capture is None:
+        if workers is not None:
+            workers.close()
         return
+    startup.mark('camera open')
+    sinks, snapshots = open_output_sinks(args, video_capture)
+    events = open_event_log(args)
+    unknowns = open_unknown_clusters(args)
     
     print("[INFO] Starting face recognition...")
     print("[INFO] Controls:")
     print("  - Press 'q' to quit")
     print("  - Press 'p' to pause/resume")
     print("  - Press 's' to save screenshot")
+    print("  - Press 'e' to enrol the person in front of the camera")
     
-    # Performance settings
-    process_every_n_frames = 2  # Process every 2nd frame
+    if args.pipelined or args.no_display:
+        try:
+            run_pipelined(args, gallery, video_capture, events, unknowns, sinks, snapshots, startup, prewarmer,
+                          workers)
+        except KeyboardInterrupt:
+            print("\n[INFO] Interrupted by user")
+        finally:
+            events.close()
+            close_unknown_clusters(unknowns)
+            if workers is not None:
+                workers.close()
+            sinks.close()
+            video_capture.release()
+            if not args.no_display:
+                cv2.destroyAllWindows()
+            print("[INFO] Done!")
+        return
+    
+    # Performance settings: detection cadence and downscale adapt to the frame budget
+    process_frame, tracker, motion = make_frame_processor(args, gallery, events, unknowns)
+    enrolment = EnrolmentControl(gallery, args.enrol_name)
+    scheduler = None
+    if tracker is None:
+        scheduler = AdaptiveScheduler(budget_ms=args.budget_ms,
+                                      target_recognition_fps=args.target_recognition_fps)
     frame_count = 0
     paused = False
     
-    # Initialize variables for face tracking
-    face_locations = []
-    face_names = []
+    # Results of the last processed frame, drawn on every frame
+    faces = []
     
     try:
         while True:
             if not paused:
-                ret, frame = video_capture.read()
+                with METRICS.time('capture'):
+                    ret, frame = video_capture.read()
                 if not ret:
+                    if args.source is not None and not is_camera_source(args.source):
+                        print("[INFO] End of video source")
+                        break
                     print("[WARNING] Failed to read frame, retrying...")
                     time.sleep(0.1)
                     continue
                 
                 frame_count += 1
+                METRICS.counter('frames_read_total', 'Frames read from the video source').inc()
+                enrolment.feed(frame)
                 
-                # Process face recognition every nth frame for performance
-                if frame_count % process_every_n_frames == 0:
-                    # Resize frame for faster processing
-                    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-                    rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Find faces
-                    face_locations = face_recognition.face_locations(rgb_small_frame, model="hog")
-                    
-                    if face_locations:
-                        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-                        
-                        face_names = []
-                        for face_encoding in face_encodings:
-                            # Compare with known faces
-                            matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-                            name = "Unknown"
-                            confidence = 0.0
-                            
-                            if True in matches:
-                                # Get face distances for confidence score
-                                face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-                                best_match_index = np.argmin(face_distances)
-                                
-                                if matches[best_match_index]:
-                                    name = known_names[best_match_index]
-                                    confidence = 1 - face_distances[best_match_index]
-                                    print(f"[RECOGNITION] {name} (confidence: {confidence:.2f})")
-                            
-                            face_names.append((name, confidence))
-                    else:
-                        face_names = []
+                if tracker is not None:
+                    # The tracker decides when to detect, and moves boxes on every frame
+                    faces = process_frame(frame)
+                    report_first_recognition(startup, prewarmer)
+                elif scheduler.should_process():
+                    timings = {}
+                    faces = process_frame(frame, timings, scheduler.scale)
+                    # Only frames that ran detection; the motion gate leaves timings empty on static frames
+                    if timings:
+                        scheduler.record_recognition(frame.shape, timings['detect'], timings['encode'], len(faces))
+                    report_first_recognition(startup, prewarmer)
                 
                 # Draw results on frame
-                for (top, right, bottom, left), (name, confidence) in zip(face_locations, face_names):
-                    # Scale coordinates back to original frame size
-                    top *= 4
-                    right *= 4
-                    bottom *= 4
-                    left *= 4
-                    
-                    # Choose color based on recognition
-                    if name != "Unknown":
-                        color = (0, 255, 0)  # Green for known faces
-                        display_name = f"{name} ({confidence:.2f})"
-                    else:
-                        color = (0, 0, 255)  # Red for unknown faces
-                        display_name = "Unknown"
-                    
-                    # Draw rectangle around face
-                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                    
-                    # Draw label background
-                    cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
-                    
-                    # Draw name
-                    cv2.putText(frame, display_name, (left + 6, bottom - 6),
-                               cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+                with METRICS.time('draw'):
+                    draw_face_results(frame, faces)
                 
                 # Add status information
-                status_y = 30
-                cv2.putText(frame, f"Frame: {frame_count} | Faces: {len(face_locations)}", 
-                           (10, status_y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
-                cv2.putText(frame, f"Known: {len(known_names)} people", 
-                           (10, status_y + 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
-                cv2.putText(frame, "Press 'q'=quit, 'p'=pause, 's'=screenshot", 
-                           (10, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+                status = [f"Frame: {frame_count} | Faces: {len(faces)}",
+                          f"Known: {len(gallery.identities)} people"]
+                if tracker is not None:
+                    status.append(tracker_status(tracker))
+                else:
+                    status.append(scheduler.status())
+                if motion is not None:
+                    status.append(motion.status())
+                if enrolment.status():
+                    status.append(enrolment.status())
+                status.append(events.status())
+                if unknowns is not None:
+                    status.append(unknowns.status())
+                if sinks.status():
+                    status.append(sinks.status())
+                draw_status(frame, status)
+                if args.metrics:
+                    draw_metrics_overlay(frame, origin=(10, 30 + 25 * len(status)))
+                sinks.submit(frame, faces)
             
             else:
                 # Show paused message
                 height, width = frame.shape[:2] if 'frame' in locals() else (480, 640)
-                pause_frame = np.zeros((height, width, 3), dtype=np.uint8)
-                cv2.putText(pause_frame, "PAUSED - Press 'p' to resume", 
-                           (width//2 - 150, height//2), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                frame = pause_frame
+                frame = pause_frame(height, width)
             
             # Display the frame
-            cv2.imshow('Face Recognition - Live Feed', frame)
+            with METRICS.time('display'):
+                cv2.imshow('Face Recognition - Live Feed', frame)
+            
+            if scheduler is not None and not paused:
+                scheduler.frame_done()
             
             # Handle keyboard input
             key = cv2.waitKey(1) & 0xFF
@@ -174,9 +556,9 @@ def main():
                 paused = not paused
                 print(f"[INFO] {'Paused' if paused else 'Resumed'}")
             elif key == ord('s') and not paused:
-                screenshot_name = f"recognition_screenshot_{int(time.time())}.jpg"
-                cv2.imwrite(screenshot_name, frame)
-                print(f"[INFO] Screenshot saved: {screenshot_name}")
+                save_screenshot(snapshots, frame)
+            elif key == ord('e') and not paused:
+                enrolment.start()
     
     except KeyboardInterrupt:
         print("\n[INFO] Interrupted by user")
@@ -186,9 +568,12 @@ def main():
         traceback.print_exc()
     finally:
         print("[INFO] Cleaning up...")
+        events.close()
+        close_unknown_clusters(unknowns)
+        sinks.close()
         video_capture.release()
         cv2.destroyAllWindows()
         print("[INFO] Done!")
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
@@ -0,0 +1,218 @@
+import cv2
+import numpy as np
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, identify_faces, scale_locations
+from metrics import METRICS
+
+TRACK_SCALE = 0.5  # Optical flow runs on a half-resolution grey frame
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def box_centre(box):
+    top, right, bottom, left = box
+    return (left + right) / 2.0, (top + bottom) / 2.0
+
+
+class Track:
+    """A face followed across frames with a persistent id and its last identity"""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = tuple(float(v) for v in box)
+        self.name = "Unknown"
+        self.match_confidence = 0.0
+        self.identified = False
+        self.frames_since_identified = 0
+        self.missed_detections = 0
+
+    def int_box(self):
+        return tuple(int(round(v)) for v in self.box)
+
+
+class FaceTracker:
+    """Associates detections across frames and decides which faces need encoding
+
+    Detection runs every `detect_every` frames. Detections are matched to
+    existing tracks by IoU (falling back to centroid distance for fast
+    movement), and in between detections boxes follow the median Lucas-Kanade
+    optical flow of corner features inside them. The 128-d encoding and
+    gallery match only run for new tracks, unidentified tracks every
+    `retry_unknown_every` frames, and tracks whose identity confidence has
+    decayed below `min_identity_confidence`. Pass a shared
+    batch_encoder.MicroBatchEncoder to batch encodes with other trackers.
+    """
+
+    def __init__(self, gallery, detect_every=5, scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                 iou_threshold=0.3, max_missed_detections=2, min_identity_confidence=0.25,
+                 confidence_decay=0.995, retry_unknown_every=15, unknowns=None, encoder=None):
+        self.gallery = gallery
+        self.unknowns = unknowns
+        self.encoder = encoder
+        self.detect_every = detect_every
+        self.scale = scale
+        self.tolerance = tolerance
+        self.iou_threshold = iou_threshold
+        self.max_missed_detections = max_missed_detections
+        self.min_identity_confidence = min_identity_confidence
+        self.confidence_decay = confidence_decay
+        self.retry_unknown_every = retry_unknown_every
+
+        self.tracks = []
+        self.newly_identified = []  # (track, name, confidence) identified by the last process() call
+        self._next_id = 1
+        self._prev_gray = None
+        # Reused downscale and grayscale buffers; the two gray buffers alternate between frames
+        self._small = None
+        self._grays = [None, None]
+        self.frame_count = 0
+
+        # Counters for judging how much work tracking saves
+        self.detections_run = 0
+        self.encode_calls = 0
+        self.faces_encoded = 0
+
+    def process(self, frame):
+        """Update tracks with a new BGR frame and return results for drawing
+
+        Results have the same ((top, right, bottom, left), name, confidence)
+        form as frame_processing.recognize_frame.
+        """
+        gray = self._gray(frame)
+        self.newly_identified = []
+
+        if self.frame_count % self.detect_every == 0 or not self.tracks:
+            self._detect_and_associate(frame)
+        elif self._prev_gray is not None:
+            with METRICS.time('optical_flow'):
+                self._propagate(self._prev_gray, gray)
+
+        for track in self.tracks:
+            track.frames_since_identified += 1
+
+        self._prev_gray = gray
+        self.frame_count += 1
+        return self.results()
+
+    def _gray(self, frame):
+        """Downscaled grayscale frame for optical flow, written into whichever buffer is not _prev_gray"""
+        height, width = frame.shape[:2]
+        size = (max(int(round(width * TRACK_SCALE)), 1), max(int(round(height * TRACK_SCALE)), 1))
+        if self._small is None or self._small.shape[:2] != (size[1], size[0]):
+            self._small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self._grays = [np.empty((size[1], size[0]), dtype=np.uint8) for _ in range(2)]
+            self._prev_gray = None
+        cv2.resize(frame, size, dst=self._small)
+        gray = self._grays[1] if self._grays[0] is self._prev_gray else self._grays[0]
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=gray)
+        return gray
+
+    def results(self):
+        """Current tracks as ((top, right, bottom, left), name, confidence)"""
+        return [(track.int_box(), track.name, track.match_confidence if track.name != "Unknown" else 0.0)
+                for track in self.tracks]
+
+    def _detect_and_associate(self, frame):
+        rgb_small_frame = prepare_frame(frame, self.scale)
+        small_locations = detect_faces(rgb_small_frame)
+        self.detections_run += 1
+        boxes = scale_locations(small_locations, 1 / self.scale)
+
+        matched_tracks = self._associate(boxes)
+
+        # Build the track list in detection order; unmatched detections start new tracks
+        tracks = []
+        for box, track in zip(boxes, matched_tracks):
+            if track is None:
+                track = Track(self._next_id, box)
+                self._next_id += 1
+            else:
+                track.box = tuple(float(v) for v in box)
+                track.missed_detections = 0
+            tracks.append(track)
+
+        # Keep briefly-missed tracks alive so a single failed detection doesn't reset identity
+        kept = set(id(t) for t in tracks)
+        for track in self.tracks:
+            if id(track) not in kept:
+                track.missed_detections += 1
+                if track.missed_detections <= self.max_missed_detections:
+                    tracks.append(track)
+        self.tracks = tracks
+
+        # Encode only the faces whose identity is missing or stale
+        to_encode = [i for i, track in enumerate(tracks[:len(boxes)]) if self._needs_identity(track)]
+        if to_encode:
+            results = identify_faces(rgb_small_frame, [small_locations[i] for i in to_encode],
+                                     self.gallery, self.scale, self.tolerance, encoder=self.encoder,
+                                     unknowns=self.unknowns, frame=frame)
+            self.encode_calls += 1
+            self.faces_encoded += len(to_encode)
+            for i, (_, name, confidence) in zip(to_encode, results):
+                track = tracks[i]
+                track.name = name
+                track.match_confidence = confidence
+                track.identified = True
+                track.frames_since_identified = 0
+                self.newly_identified.append((track, name, confidence))
+
+    def _needs_identity(self, track):
+        if not track.identified:
+            return True
+        if track.name == "Unknown":
+            return track.frames_since_identified >= self.retry_unknown_every
+        # Match confidence decays with the number of frames since the face was encoded
+        decayed = track.match_confidence * self.confidence_decay ** track.frames_since_identified
+        return decayed < self.min_identity_confidence
+
+    def _associate(self, boxes):
+        """Greedy IoU matching of detections to tracks, then nearest-centroid for leftovers"""
+        assigned = [None] * len(boxes)
+        free = set(range(len(self.tracks)))
+
+        pairs = sorted(((box_iou(box, track.box), bi, ti)
+                        for bi, box in enumerate(boxes) for ti, track in enumerate(self.tracks)), reverse=True)
+        for iou, bi, ti in pairs:
+            if iou < self.iou_threshold:
+                break
+            if assigned[bi] is None and ti in free:
+                assigned[bi] = self.tracks[ti]
+                free.discard(ti)
+
+        # Fast motion can drop IoU to zero; accept a centroid within one box width
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is not None or not free:
+                continue
+            cx, cy = box_centre(box)
+            width = box[1] - box[3]
+            best = min(free, key=lambda ti: np.hypot(*np.subtract(box_centre(self.tracks[ti].box), (cx, cy))))
+            if np.hypot(*np.subtract(box_centre(self.tracks[best].box), (cx, cy))) < width:
+                assigned[bi] = self.tracks[best]
+                free.discard(best)
+        return assigned
+
+    def _propagate(self, prev_gray, gray):
+        """Move each box by the median optical flow of the features inside it"""
+        for track in self.tracks:
+            top, right, bottom, left = (v * TRACK_SCALE for v in track.box)
+            mask = np.zeros_like(prev_gray)
+            mask[max(int(top), 0):max(int(bottom), 0), max(int(left), 0):max(int(right), 0)] = 255
+            points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+            if points is None:
+                continue
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                            winSize=(15, 15), maxLevel=2)
+            good = status.ravel() == 1
+            if good.sum() < 3:
+                continue
+            dx, dy = np.median((new_points[good] - points[good]).reshape(-1, 2), axis=0) / TRACK_SCALE
+            track.box = (track.box[0] + dy, track.box[1] + dx, track.box[2] + dy, track.box[3] + dx)
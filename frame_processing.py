@@ -0,0 +1,166 @@
+import time
+import cv2
+import numpy as np
+from batch_encoder import encode_faces
+from metrics import METRICS
+from model_loader import face_recognition
+
+DETECTION_SCALE = 0.25  # Frames are shrunk by this factor before HOG detection
+TOLERANCE = 0.6
+
+
+def scale_locations(face_locations, factor):
+    """Scale (top, right, bottom, left) boxes by factor"""
+    return [tuple(int(round(v * factor)) for v in location) for location in face_locations]
+
+
+class FrameBuffers:
+    """Preallocated destinations for the downscale and colour conversion of each frame
+
+    Frames from one source keep the same size, so after the first frame
+    resize and cvtColor write into the same two arrays every time instead
+    of allocating new ones. The RGB array is C-contiguous, so dlib uses it
+    without another copy. It is overwritten by the next prepare() call, so
+    it must not be kept.
+    """
+
+    def __init__(self):
+        self.small = None
+        self.rgb = None
+        self._key = None
+
+    def prepare(self, frame, scale=DETECTION_SCALE):
+        """Downscaled RGB copy of a BGR frame, in the reused buffer"""
+        height, width = frame.shape[:2]
+        key = (height, width, scale)
+        if key != self._key:
+            size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+            self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.rgb = np.empty_like(self.small)
+            self._key = key
+        with METRICS.time('resize'):
+            cv2.resize(frame, (self.small.shape[1], self.small.shape[0]), dst=self.small)
+        with METRICS.time('cvtColor'):
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        return self.rgb
+
+
+def prepare_frame(frame, scale=DETECTION_SCALE, buffers=None):
+    """Downscale a BGR frame and convert it to RGB for dlib
+
+    With a FrameBuffers, the result is written into its reused buffers.
+    """
+    if buffers is not None:
+        return buffers.prepare(frame, scale)
+    with METRICS.time('resize'):
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+    with METRICS.time('cvtColor'):
+        return cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+
+def detect_faces(rgb_image):
+    """HOG face locations in an RGB image"""
+    with METRICS.time('face_locations'):
+        face_locations = face_recognition.face_locations(rgb_image, model="hog")
+    METRICS.counter('faces_detected_total', 'Faces found by the detector').inc(len(face_locations))
+    return face_locations
+
+
+def identify_faces(rgb_image, face_locations, gallery, scale=DETECTION_SCALE, tolerance=TOLERANCE, timings=None,
+                   encoder=None, unknowns=None, frame=None):
+    """Encode the given faces of an RGB image and match them against the gallery
+
+    face_locations are in rgb_image coordinates; the returned boxes are
+    scaled back to full-frame coordinates by 1 / scale. If a timings dict is
+    given, the encoding time in seconds is stored under 'encode'. All faces
+    of the frame are encoded in one batch, or through a shared
+    batch_encoder.MicroBatchEncoder if one is given. The encodings of
+    unknown faces are added to `unknowns` (an UnknownFaceClusters) if given;
+    pass the full-resolution BGR frame as `frame` to take their thumbnails
+    from it rather than from the downscaled rgb_image.
+    """
+    if timings is not None:
+        timings['encode'] = 0.0
+    if not face_locations:
+        return []
+
+    start = time.perf_counter()
+    with METRICS.time('face_encodings'):
+        if encoder is not None:
+            face_encodings = encoder.encode(rgb_image, face_locations)
+        else:
+            face_encodings = encode_faces(rgb_image, face_locations)
+    if timings is not None:
+        timings['encode'] = time.perf_counter() - start
+    return match_faces(rgb_image, face_locations, face_encodings, gallery, scale, tolerance, unknowns, frame=frame)
+
+
+def match_faces(image, face_locations, face_encodings, gallery, scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                unknowns=None, rgb=True, frame=None):
+    """Match already computed encodings of the faces of an image against the gallery
+
+    Returns boxes scaled by 1 / scale like identify_faces. image (RGB, or BGR
+    if rgb is False) is only used for thumbnails of unknown faces, unless the
+    full-resolution BGR frame is given, which they are then cropped from.
+    """
+    if not len(face_locations):
+        return []
+    results = []
+    # Match all faces in the frame against the gallery in one call
+    with METRICS.time('match'):
+        matches = gallery.identify(face_encodings, tolerance=tolerance)
+    boxes = scale_locations(face_locations, 1 / scale)
+    if unknowns is not None:
+        for location, box, encoding, (name, _) in zip(face_locations, boxes, face_encodings, matches):
+            if name == "Unknown":
+                if frame is not None:
+                    unknowns.add(encoding, frame, box, rgb=False)
+                else:
+                    unknowns.add(encoding, image, location, rgb=rgb)
+    for location, (name, distance) in zip(boxes, matches):
+        confidence = 1 - distance if name != "Unknown" else 0.0
+        results.append((location, name, confidence))
+    return results
+
+
+def recognize_frame(frame, gallery, scale=DETECTION_SCALE, tolerance=TOLERANCE, timings=None, buffers=None,
+                    unknowns=None):
+    """Detect, encode and identify the faces in a BGR frame
+
+    Returns a list of ((top, right, bottom, left), name, confidence) with boxes
+    in full-frame coordinates. Unknown faces have confidence 0.0. If a
+    timings dict is given, detection (including resize) and encoding times in
+    seconds are stored under 'detect' and 'encode'. Pass a FrameBuffers to
+    reuse the resize and colour conversion buffers between frames, and an
+    UnknownFaceClusters to collect the unknown faces.
+    """
+    start = time.perf_counter()
+    rgb_small_frame = prepare_frame(frame, scale, buffers)
+    face_locations = detect_faces(rgb_small_frame)
+    METRICS.counter('frames_processed_total', 'Frames run through detection').inc()
+    if timings is not None:
+        timings['detect'] = time.perf_counter() - start
+    return identify_faces(rgb_small_frame, face_locations, gallery, scale, tolerance, timings, unknowns=unknowns,
+                          frame=frame)
+
+
+def draw_face_results(frame, results):
+    """Draw labelled boxes for recognition results onto a BGR frame"""
+    for (top, right, bottom, left), name, confidence in results:
+        # Choose color based on recognition
+        if name != "Unknown":
+            color = (0, 255, 0)  # Green for known faces
+            display_name = f"{name} ({confidence:.2f})"
+        else:
+            color = (0, 0, 255)  # Red for unknown faces
+            display_name = "Unknown"
+
+        # Draw rectangle around face
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+
+        # Draw label background
+        cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
+
+        # Draw name
+        cv2.putText(frame, display_name, (left + 6, bottom - 6),
+                    cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
@@ -0,0 +1,156 @@
+import time
+from collections import Counter
+import numpy as np
+from face_gallery import FaceGallery, DEFAULT_TOLERANCE
+
+HOLDOUT_EVERY = 5     # Every 5th encoding of a person is held out to measure recall
+RECALL_MARGIN = 0.01  # Prototype recall may fall this far below the recall of all encodings
+MAX_PROTOTYPES = 10   # Upper limit on prototypes per person
+
+
+def pairwise_distances(encodings):
+    """Euclidean distance between every pair of encodings"""
+    x = np.asarray(encodings, dtype=np.float32)
+    sq = np.einsum('ij,ij->i', x, x)
+    d2 = x @ x.T
+    d2 *= -2.0
+    d2 += sq[:, None]
+    d2 += sq[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+def k_medoids(encodings, k, iterations=20):
+    """Indices of up to k encodings that represent the rest with the least total distance
+
+    Starts from the most central encoding and adds the encoding farthest from
+    those chosen so far, then alternates between assigning encodings to the
+    nearest medoid and moving each medoid to the centre of its cluster. The
+    result is deterministic, and every prototype is a real encoding rather
+    than an average of different poses.
+    """
+    n = len(encodings)
+    if k >= n:
+        return np.arange(n)
+    d = pairwise_distances(encodings)
+    medoids = [int(np.argmin(d.sum(axis=1)))]
+    while len(medoids) < k:
+        nearest = d[:, medoids].min(axis=1)
+        if nearest.max() == 0.0:
+            break  # The rest are duplicates of chosen encodings
+        medoids.append(int(np.argmax(nearest)))
+    medoids = np.array(medoids)
+
+    for _ in range(iterations):
+        assignment = np.argmin(d[:, medoids], axis=1)
+        updated = medoids.copy()
+        for cluster in range(len(medoids)):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members):
+                updated[cluster] = members[np.argmin(d[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    return np.sort(medoids)
+
+
+def recall_per_person(gallery, encodings, names, tolerance=DEFAULT_TOLERANCE):
+    """Fraction of each person's encodings that the gallery identifies as that person"""
+    if not len(encodings):
+        return {}
+    ids, dists = gallery.match(encodings, k=1)
+    hits = {}
+    for name, identity_id, distance in zip(names, ids[:, 0], dists[:, 0]):
+        correct = distance <= tolerance and gallery.identities[identity_id] == name
+        hits.setdefault(name, []).append(correct)
+    return {name: float(np.mean(person_hits)) for name, person_hits in hits.items()}
+
+
+def overall_recall(gallery, encodings, names, tolerance=DEFAULT_TOLERANCE):
+    per_person = recall_per_person(gallery, encodings, names, tolerance)
+    counts = Counter(names)
+    total = sum(counts.values())
+    return sum(per_person[name] * counts[name] for name in per_person) / total if total else 1.0
+
+
+def _split(person_encodings, holdout_every):
+    """(train, held-out) encodings per person; people with few images hold out nothing"""
+    train, held = {}, {}
+    for name, encodings in person_encodings.items():
+        encodings = np.asarray(encodings, dtype=np.float32)
+        mask = np.zeros(len(encodings), dtype=bool)
+        if len(encodings) >= holdout_every:
+            mask[holdout_every - 1::holdout_every] = True
+        train[name], held[name] = encodings[~mask], encodings[mask]
+    return train, held
+
+
+def _flatten(per_person):
+    encodings = [e for name in per_person for e in per_person[name]]
+    names = [name for name in per_person for _ in per_person[name]]
+    return encodings, names
+
+
+def select_prototypes(person_encodings, tolerance=DEFAULT_TOLERANCE, margin=RECALL_MARGIN,
+                      max_prototypes=MAX_PROTOTYPES, holdout_every=HOLDOUT_EVERY):
+    """Pick k-medoid prototypes per person, with k as small as held-out recall allows
+
+    Every person starts with one prototype. Prototypes are chosen from the
+    training part of each person's encodings, and the held-out part is
+    matched against them and against the full training set. People whose
+    recall falls more than `margin` below the full set's get one more
+    prototype, until everyone is within the margin or at max_prototypes.
+    The final prototypes are chosen with the same k from all encodings.
+
+    Returns (encodings, names, report). The report has 'k' per person and
+    the held-out 'full_recall' and 'prototype_recall'.
+    """
+    train, held = _split(person_encodings, holdout_every)
+    held_encodings, held_names = _flatten(held)
+    train_encodings, train_names = _flatten(train)
+    full_gallery = FaceGallery(train_encodings, train_names)
+    target = recall_per_person(full_gallery, held_encodings, held_names, tolerance)
+
+    k = {name: 1 for name in person_encodings}
+    chosen = {}
+    while True:
+        for name in person_encodings:
+            if (name, k[name]) not in chosen:
+                chosen[name, k[name]] = train[name][k_medoids(train[name], k[name])]
+        prototypes = {name: chosen[name, k[name]] for name in person_encodings}
+        gallery = FaceGallery(*_flatten(prototypes))
+        recall = recall_per_person(gallery, held_encodings, held_names, tolerance)
+        grow = [name for name in recall
+                if recall[name] < target[name] - margin and k[name] < min(max_prototypes, len(train[name]))]
+        if not grow:
+            break
+        for name in grow:
+            k[name] += 1
+
+    prototype_recall = overall_recall(gallery, held_encodings, held_names, tolerance)
+    full_recall = overall_recall(full_gallery, held_encodings, held_names, tolerance)
+
+    encodings, names = [], []
+    for name, person in person_encodings.items():
+        person = np.asarray(person, dtype=np.float32)
+        for encoding in person[k_medoids(person, k[name])]:
+            encodings.append(encoding)
+            names.append(name)
+    report = {'k': k, 'full_recall': full_recall, 'prototype_recall': prototype_recall,
+              'held_out': len(held_encodings)}
+    return encodings, names, report
+
+
+def time_matching(gallery, queries, batch=16, min_seconds=0.2):
+    """Mean seconds per face for gallery.identify on batches of `batch` faces"""
+    queries = np.asarray(queries, dtype=np.float32)
+    batches = [queries[i:i + batch] for i in range(0, len(queries), batch)]
+    faces = 0
+    start = time.perf_counter()
+    while True:
+        for chunk in batches:
+            gallery.identify(chunk)
+            faces += len(chunk)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / faces
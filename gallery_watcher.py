@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from face_gallery import GALLERY_FILE, gallery_lock, load_gallery, save_gallery
+from frame_processing import prepare_frame, detect_faces
+from batch_encoder import encode_faces
+from ivf_index import IVFIndex
+
+WATCH_INTERVAL = 1.0  # Seconds between checks of the gallery file
+ENROL_SAMPLES = 5     # Encodings captured per enrolment
+ENROL_EVERY = 3       # Frames between enrolment samples, so the samples differ a little
+ENROL_SCALE = 0.5     # Enrolment detects at a larger scale than live recognition for better encodings
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class LiveGallery:
+    """A gallery reference that can be replaced while recognition keeps running
+
+    Pass it anywhere a FaceGallery is expected: attribute lookups (identify,
+    identities, ...) go to the current gallery. A replacement is prepared
+    completely, including its ANN index if the old gallery had one, and then
+    swapped in with a single assignment. Calls already running finish on the
+    gallery they started with, so nothing waits and no frame is dropped.
+    Memory-mapped galleries stay valid after the file is replaced, because
+    save_gallery renames a new file into place.
+    """
+
+    def __init__(self, gallery, path=GALLERY_FILE, index_file=None, log=print):
+        self._gallery = gallery
+        self.path = path
+        self.index_file = index_file
+        self.log = log
+        self.version = 1
+        self._signature = _file_signature(path)
+        self._write_lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self._gallery
+
+    def __getattr__(self, name):
+        return getattr(self._gallery, name)
+
+    def __len__(self):
+        return len(self._gallery)
+
+    def swap(self, gallery):
+        self._gallery = gallery
+        self.version += 1
+
+    def _prepare(self, gallery, nprobe):
+        """Give a new gallery an ANN index when the current one uses one"""
+        if nprobe is None:
+            return gallery
+        index = None
+        if self.index_file and os.path.exists(self.index_file) and \
+                os.path.getmtime(self.index_file) >= os.path.getmtime(self.path):
+            try:
+                index = IVFIndex.load(self.index_file, nprobe=nprobe)
+                index.bind(gallery.matrix)
+            except (OSError, ValueError):
+                index = None
+        if index is None:
+            index = IVFIndex.build(gallery.matrix, nprobe=nprobe)
+        gallery.attach_index(index)
+        return gallery
+
+    def _nprobe(self):
+        index = self._gallery.index
+        return index.nprobe if index is not None else None
+
+    def reload_if_changed(self):
+        """Load and swap in the gallery file if it changed on disk; True if swapped"""
+        signature = _file_signature(self.path)
+        if signature is None or signature == self._signature:
+            return False
+        with self._write_lock:
+            # Record the signature first, so a broken file is not retried until it changes again
+            self._signature = signature
+            gallery = self._prepare(load_gallery(self.path), self._nprobe())
+            self.swap(gallery)
+        self.log(f"[INFO] Gallery reloaded: {len(gallery)} encodings of {len(gallery.identities)} people")
+        return True
+
+    def enrol(self, name, encodings):
+        """Add encodings for a person, save the gallery file and swap in the result
+
+        The file is locked for the whole read-modify-write, and reloaded first
+        if another process rewrote it since the last reload, so a retrain or
+        another enrolment in between is not overwritten.
+        """
+        with self._write_lock, gallery_lock(self.path):
+            signature = _file_signature(self.path)
+            if signature is not None and signature != self._signature:
+                self._signature = signature
+                self.swap(self._prepare(load_gallery(self.path), self._nprobe()))
+                self.log("[INFO] Gallery changed on disk; enrolling into the new version")
+            gallery = self._gallery.with_encodings(name, encodings)
+            save_gallery(gallery, self.path)
+            # Our own write must not trigger a reload
+            self._signature = _file_signature(self.path)
+            self.swap(self._prepare(gallery, self._nprobe()))
+        self.log(f"[INFO] Enrolled {name} with {len(encodings)} encodings; "
+                 f"gallery now has {len(gallery.identities)} people")
+
+    def enrol_async(self, name, encodings):
+        """enrol() on a background thread, so the caller's frame loop keeps running"""
+        thread = threading.Thread(target=self._enrol_logged, args=(name, encodings), name="enrol", daemon=True)
+        thread.start()
+        return thread
+
+    def _enrol_logged(self, name, encodings):
+        try:
+            self.enrol(name, encodings)
+        except Exception as e:
+            self.log(f"[ERROR] Enrolment of {name} failed: {e}")
+
+
+class GalleryWatcher(threading.Thread):
+    """Polls the gallery file and hot-swaps a LiveGallery when it is rewritten"""
+
+    def __init__(self, live_gallery, interval=WATCH_INTERVAL):
+        super().__init__(name="gallery-watcher", daemon=True)
+        self.live_gallery = live_gallery
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.live_gallery.reload_if_changed()
+            except Exception as e:
+                # Keep recognising with the current gallery; retry on the next change
+                self.live_gallery.log(f"[WARNING] Gallery reload failed, keeping the current gallery: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def watch_gallery(gallery, path=GALLERY_FILE, index_file=None, interval=WATCH_INTERVAL, log=print):
+    """Wrap a gallery loaded from path in a LiveGallery and start watching the file"""
+    live_gallery = LiveGallery(gallery, path, index_file, log)
+    GalleryWatcher(live_gallery, interval).start()
+    return live_gallery
+
+
+class EnrolmentSession:
+    """Collects encodings of the single face in front of the camera for a new person
+
+    Every ENROL_EVERY frames with exactly one face contribute one encoding.
+    Frames with no face or several faces are skipped, so nobody else gets
+    enrolled by mistake.
+    """
+
+    def __init__(self, name, samples=ENROL_SAMPLES, every=ENROL_EVERY, scale=ENROL_SCALE):
+        self.name = name
+        self.samples = samples
+        self.every = every
+        self.scale = scale
+        self.encodings = []
+        self._frames = 0
+        self.started_at = time.time()
+
+    def feed(self, frame):
+        """Offer a BGR frame; True once enough encodings have been collected"""
+        self._frames += 1
+        if self._frames % self.every == 0 and not self.done:
+            rgb_frame = prepare_frame(frame, self.scale)
+            face_locations = detect_faces(rgb_frame)
+            if len(face_locations) == 1:
+                self.encodings.extend(encode_faces(rgb_frame, face_locations))
+        return self.done
+
+    @property
+    def done(self):
+        return len(self.encodings) >= self.samples
+
+    def status(self):
+        return f"Enrolling {self.name}: {len(self.encodings)}/{self.samples} samples"
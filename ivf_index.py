@@ -0,0 +1,161 @@
+import hashlib
+import numpy as np
+
+DEFAULT_NPROBE = 8
+FORMAT_VERSION = 2  # 2 added the gallery fingerprint
+
+
+def matrix_fingerprint(matrix):
+    """Hash of a gallery matrix, so an index is never bound to different encodings of the same count"""
+    data = np.ascontiguousarray(matrix, dtype=np.float32)
+    return hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+
+
+def _nearest_centroids(vectors, centroids, chunk_size=65536):
+    """Index of the closest centroid for every vector, computed in chunks"""
+    c_sq = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        # |x - c|^2 = |x|^2 - 2x.c + |c|^2, and |x|^2 does not change the argmin
+        scores = chunk @ centroids.T
+        scores *= -2.0
+        scores += c_sq[None, :]
+        assignment[start:start + chunk_size] = np.argmin(scores, axis=1)
+    return assignment
+
+
+def kmeans(vectors, n_clusters, iterations=20, seed=0):
+    """Plain Lloyd k-means in NumPy, used to train the coarse quantizer"""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = _nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        order = np.argsort(assignment, kind='stable')
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        non_empty = counts > 0
+        sums = np.add.reduceat(vectors[order], starts[non_empty], axis=0)
+        centroids[non_empty] = sums / counts[non_empty, None]
+
+        # Re-seed empty clusters with random vectors so every list gets used
+        n_empty = int((~non_empty).sum())
+        if n_empty:
+            centroids[~non_empty] = vectors[rng.choice(len(vectors), n_empty, replace=False)]
+
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a FaceGallery
+
+    A coarse k-means quantizer splits the gallery into lists. A query is only
+    compared against the rows of its `nprobe` nearest lists, so raising nprobe
+    trades latency for recall (nprobe == n_lists is an exact search).
+    """
+
+    def __init__(self, centroids, offsets, row_ids, n_rows, nprobe=DEFAULT_NPROBE, fingerprint=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.row_ids = np.asarray(row_ids, dtype=np.int64)
+        self.n_rows = int(n_rows)
+        self.fingerprint = fingerprint
+        self.nprobe = nprobe
+        self._centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self._vectors = None
+        self._vector_sq = None
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, iterations=20, max_training_rows=200000, seed=0, nprobe=DEFAULT_NPROBE):
+        """Train the coarse quantizer on (a sample of) matrix and bucket every row"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(matrix))))
+        n_lists = min(n_lists, len(matrix))
+
+        rng = np.random.default_rng(seed)
+        training = matrix
+        if len(matrix) > max_training_rows:
+            training = matrix[np.sort(rng.choice(len(matrix), max_training_rows, replace=False))]
+
+        centroids = kmeans(training, n_lists, iterations=iterations, seed=seed)
+        assignment = _nearest_centroids(matrix, centroids)
+        row_ids = np.argsort(assignment, kind='stable')
+        offsets = np.r_[0, np.cumsum(np.bincount(assignment, minlength=n_lists))]
+        return cls(centroids, offsets, row_ids, len(matrix), nprobe=nprobe,
+                   fingerprint=matrix_fingerprint(matrix))
+
+    def save(self, path):
+        """Save the quantizer and inverted lists (not the vectors) to an .npz file"""
+        np.savez(path, format_version=FORMAT_VERSION, centroids=self.centroids,
+                 offsets=self.offsets, row_ids=self.row_ids, n_rows=self.n_rows,
+                 fingerprint=self.fingerprint or '')
+
+    @classmethod
+    def load(cls, path, nprobe=DEFAULT_NPROBE):
+        """Load an index written by save()"""
+        with np.load(path) as data:
+            if int(data['format_version']) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported index format version {int(data['format_version'])}; "
+                                 f"rebuild it with train_model_improved.py --ann")
+            return cls(data['centroids'], data['offsets'], data['row_ids'], int(data['n_rows']), nprobe=nprobe,
+                       fingerprint=str(data['fingerprint']) or None)
+
+    def bind(self, matrix):
+        """Copy the gallery rows into list order so each probed list is a contiguous slice"""
+        if len(matrix) != self.n_rows:
+            raise ValueError(f"Index was built for {self.n_rows} encodings, gallery has {len(matrix)}")
+        if self.fingerprint is not None and matrix_fingerprint(matrix) != self.fingerprint:
+            raise ValueError("Index was built for different encodings of the same count; "
+                             "rebuild it with train_model_improved.py --ann")
+        self._vectors = np.ascontiguousarray(matrix[self.row_ids], dtype=np.float32)
+        self._vector_sq = np.einsum('ij,ij->i', self._vectors, self._vectors)
+
+    def search(self, queries, k=1, nprobe=None):
+        """Approximate k nearest gallery rows for each query
+
+        Returns (row_ids, distances) of shape (queries, k). Slots with no
+        candidate are filled with -1 and inf.
+        """
+        if self._vectors is None:
+            raise RuntimeError("IVFIndex.bind() must be called before search()")
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if len(queries) == 0:
+            return rows, distances
+
+        centroid_scores = queries @ self.centroids.T
+        centroid_scores *= -2.0
+        centroid_scores += self._centroid_sq[None, :]
+        if nprobe < self.n_lists:
+            probes = np.argpartition(centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.n_lists), (len(queries), self.n_lists))
+
+        for qi, query in enumerate(queries):
+            positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probes[qi]])
+            if len(positions) == 0:
+                continue
+            d2 = self._vectors[positions] @ query
+            d2 *= -2.0
+            d2 += self._vector_sq[positions]
+            d2 += query @ query
+            np.maximum(d2, 0.0, out=d2)
+
+            n = min(k, len(positions))
+            best = np.argpartition(d2, n - 1)[:n] if n < len(positions) else np.arange(n)
+            best = best[np.argsort(d2[best], kind='stable')]
+            rows[qi, :n] = self.row_ids[positions[best]]
+            distances[qi, :n] = np.sqrt(d2[best])
+
+        return rows, distances
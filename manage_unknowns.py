@@ -0,0 +1,103 @@
+import argparse
+import os
+import time
+from face_gallery import GALLERY_FILE, load_gallery
+from gallery_watcher import LiveGallery
+from unknown_clusters import UnknownFaceClusters, UNKNOWN_DIR, record_removal
+
+
+def _when(t):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(t))
+
+
+def list_clusters(clusters, args):
+    gallery = load_gallery(args.gallery) if os.path.exists(args.gallery) else None
+    slots = [slot for slot in clusters.clusters()
+             if clusters.visits[slot] >= args.min_visits and clusters.counts[slot] >= args.min_faces]
+    if not slots:
+        print("[INFO] No unknown-face clusters")
+        return
+    nearest = {}
+    if gallery is not None and len(gallery):
+        ids, dists = gallery.match(clusters.centroids[slots], k=1)
+        nearest = {slot: (gallery.identities[i], d) for slot, i, d in zip(slots, ids[:, 0], dists[:, 0])}
+    print(f"{'id':>6} {'visits':>6} {'faces':>6}  {'first seen':<16}  {'last seen':<16}  nearest known")
+    for slot in slots:
+        name, distance = nearest.get(slot, ("-", float('nan')))
+        print(f"{clusters.ids[slot]:>6} {clusters.visits[slot]:>6} {clusters.counts[slot]:>6}  "
+              f"{_when(clusters.first_seen[slot]):<16}  {_when(clusters.last_seen[slot]):<16}  "
+              f"{name} ({distance:.2f})")
+        for path in clusters.thumbnails[slot]:
+            print(f"{'':>8}{path}")
+
+
+def promote(clusters, args):
+    encodings = [clusters.encodings(cluster_id) for cluster_id in args.ids]
+    if not os.path.exists(args.gallery):
+        print(f"[ERROR] {args.gallery} not found!")
+        return
+    # Saved through LiveGallery.enrol, so running recognition processes reload it like a live enrolment
+    LiveGallery(load_gallery(args.gallery), args.gallery).enrol(args.name, [e for group in encodings for e in group])
+    for cluster_id in args.ids:
+        clusters.remove(cluster_id)
+        record_removal(cluster_id, directory=args.dir)
+
+
+def merge(clusters, args):
+    for cluster_id in args.ids:
+        clusters.merge(args.into, cluster_id)
+        record_removal(cluster_id, into=args.into, directory=args.dir)
+    print(f"[INFO] Merged {', '.join(map(str, args.ids))} into {args.into}")
+
+
+def discard(clusters, args):
+    for cluster_id in args.ids:
+        clusters.remove(cluster_id)
+        record_removal(cluster_id, directory=args.dir)
+    print(f"[INFO] Discarded {', '.join(map(str, args.ids))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Review unknown-face clusters and enrol recurring visitors")
+    parser.add_argument('--dir', default=UNKNOWN_DIR, help="directory written by --collect-unknowns")
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    listing = commands.add_parser('list', help="show clusters, most visited first, with their thumbnails")
+    listing.add_argument('--min-visits', type=int, default=1)
+    listing.add_argument('--min-faces', type=int, default=1)
+    listing.set_defaults(run=list_clusters)
+
+    promoting = commands.add_parser('promote', help="enrol clusters in the gallery under a name")
+    promoting.add_argument('name')
+    promoting.add_argument('ids', type=int, nargs='+')
+    promoting.set_defaults(run=promote)
+
+    merging = commands.add_parser('merge', help="merge clusters of the same person")
+    merging.add_argument('into', type=int)
+    merging.add_argument('ids', type=int, nargs='+')
+    merging.set_defaults(run=merge)
+
+    discarding = commands.add_parser('discard', help="delete clusters and their thumbnails")
+    discarding.add_argument('ids', type=int, nargs='+')
+    discarding.set_defaults(run=discard)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"[ERROR] {args.dir} not found; collect unknown faces with --collect-unknowns first")
+        return
+    clusters = UnknownFaceClusters.load(args.dir, write_thumbnails=False)
+    try:
+        args.run(clusters, args)
+    except KeyError as e:
+        print(f"[ERROR] No cluster {e}")
+        return
+    if args.command != 'list':
+        # A running collector may have written thumbnails since its last save, so only
+        # the removed clusters' thumbnails are deleted here; the collector sweeps the rest
+        clusters.save(delete_stale=False)
+        clusters.delete_thumbnails(args.ids)
+
+
+if __name__ == "__main__":
+    main()
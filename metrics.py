@@ -0,0 +1,244 @@
+import bisect
+import threading
+import time
+import cv2
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency bucket upper bounds in seconds (Prometheus "le" values)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, float('inf'))
+METRIC_PREFIX = 'face_'
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter:
+    """Monotonic count"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down (e.g. a queue depth)"""
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Approximate quantile (seconds), interpolated inside the matching bucket"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if self.buckets[i] != float('inf') else lower * 2
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-2]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullMetric:
+    """Stand-in returned while metrics are disabled; every call is a no-op"""
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, seconds):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_NULL_METRIC = _NullMetric()
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges and per-stage latency histograms
+
+    While disabled, every accessor returns a shared no-op object, so
+    instrumentation in the hot loop costs one attribute check and a call.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, labels, help_text):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = kind()
+                    self._metrics[key] = metric
+                    if help_text:
+                        self._help[name] = help_text
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        if not self.enabled:
+            return _NULL_METRIC
+        return self._get(Counter, name, labels, help_text)
+
+    def gauge(self, name, help_text='', **labels):
+        if not self.enabled:
+            return _NULL_METRIC
+        return self._get(Gauge, name, labels, help_text)
+
+    def histogram(self, name, help_text='', **labels):
+        if not self.enabled:
+            return _NULL_METRIC
+        return self._get(Histogram, name, labels, help_text)
+
+    def time(self, stage):
+        """Context manager recording a stage's latency in stage_latency_seconds{stage=...}"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._get(Histogram, 'stage_latency_seconds', {'stage': stage},
+                                'Latency of each processing stage'))
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        seen = set()
+        for (name, labels), metric in items:
+            full_name = METRIC_PREFIX + name
+            if name not in seen:
+                seen.add(name)
+                kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} {kind}")
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{full_name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{full_name}_sum{_label_text(labels)} {metric.sum}")
+                lines.append(f"{full_name}_count{_label_text(labels)} {metric.count}")
+            else:
+                lines.append(f"{full_name}{_label_text(labels)} {metric.value}")
+        return '\n'.join(lines) + '\n'
+
+    def overlay_lines(self):
+        """Short per-stage p50/p95 lines and counters for drawing on the frame"""
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        counters = []
+        for (name, labels), metric in items:
+            if isinstance(metric, Histogram) and name == 'stage_latency_seconds' and metric.count:
+                stage = dict(labels)['stage']
+                lines.append(f"{stage}: p50 {1000 * metric.quantile(0.5):.1f} "
+                             f"p95 {1000 * metric.quantile(0.95):.1f} ms")
+            elif isinstance(metric, (Counter, Gauge)):
+                label = ','.join(str(v) for _, v in labels)
+                counters.append(f"{name}{'[' + label + ']' if label else ''}={metric.value}")
+        # Pack counters a few per line so the overlay stays compact
+        for i in range(0, len(counters), 3):
+            lines.append(' '.join(counters[i:i + 3]))
+        return lines
+
+
+# Shared registry used by all modules; enabled by the entry points on request
+METRICS = MetricsRegistry()
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=METRICS):
+    """Serve registry.render_prometheus() at http://host:port/metrics on a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def draw_metrics_overlay(frame, registry=METRICS, origin=(10, 130)):
+    """Draw the registry's overlay lines onto a BGR frame"""
+    x, y = origin
+    for line in registry.overlay_lines():
+        cv2.putText(frame, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 0), 1)
+        y += 18
@@ -0,0 +1,115 @@
+import importlib
+import threading
+import time
+import numpy as np
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access
+
+    Importing face_recognition loads all of dlib's models, which takes most
+    of a second or more. Modules that hold a LazyModule instead can be
+    imported instantly, and the models are loaded when first used or when
+    prewarm() loads them on a background thread. Concurrent first uses wait
+    for a single import.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, name):
+        module = self._module
+        if module is None:
+            module = self.load()
+        return getattr(module, name)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+face_recognition = LazyModule('face_recognition')
+face_recognition_api = LazyModule('face_recognition.api')
+dlib = LazyModule('dlib')
+
+
+def warm_up_inference():
+    """Run detection and encoding once on a blank image so the first real frame is not slower"""
+    image = np.full((120, 120, 3), 128, dtype=np.uint8)
+    face_recognition.face_locations(image, model="hog")
+    face_recognition.face_encodings(image, [(10, 110, 110, 10)])
+
+
+class ModelPrewarmer(threading.Thread):
+    """Loads the models (and optionally runs a warm-up inference) in the background"""
+
+    def __init__(self, warm_up=True):
+        super().__init__(name="model-prewarm", daemon=True)
+        self.warm_up = warm_up
+        self.loaded_after = None
+        self.warmed_after = None
+        self.error = None
+        self.started_at = time.perf_counter()
+
+    def run(self):
+        try:
+            face_recognition.load()
+            face_recognition_api.load()
+            self.loaded_after = time.perf_counter() - self.started_at
+            if self.warm_up:
+                warm_up_inference()
+                self.warmed_after = time.perf_counter() - self.started_at
+        except Exception as e:
+            self.error = e
+
+
+def prewarm(warm_up=True):
+    """Start loading the face models on a background thread and return the thread"""
+    prewarmer = ModelPrewarmer(warm_up)
+    prewarmer.start()
+    return prewarmer
+
+
+class StartupReport:
+    """Records how long each start-up step took and prints one report"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.reported = False
+
+    def mark(self, step):
+        """Record that a step finished now; later calls for the same step are ignored"""
+        if any(name == step for name, _ in self.marks):
+            return
+        self.marks.append((step, time.perf_counter() - self.start))
+
+    def report(self, prewarmer=None):
+        """Print the time since start at which each step finished (once)"""
+        if self.reported:
+            return
+        self.reported = True
+        marks = list(self.marks)
+        if prewarmer is not None:
+            # The prewarmer's clock starts when it is created, just after this report's
+            offset = prewarmer.started_at - self.start
+            if prewarmer.loaded_after is not None:
+                marks.append(('models loaded (background)', offset + prewarmer.loaded_after))
+            if prewarmer.warmed_after is not None:
+                marks.append(('warm-up done (background)', offset + prewarmer.warmed_after))
+        marks.sort(key=lambda mark: mark[1])
+        print("[STARTUP] " + " | ".join(f"{step} at {1000 * elapsed:.0f} ms" for step, elapsed in marks))
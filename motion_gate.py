@@ -0,0 +1,209 @@
+import math
+import time
+import cv2
+import numpy as np
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, identify_faces
+from face_tracker import box_iou
+from metrics import METRICS
+
+MOTION_WIDTH = 160  # Motion is analysed on a grey frame this many pixels wide
+ROI_SCALE = 0.5     # Preferred detection scale inside motion regions (whole frames use DETECTION_SCALE)
+
+
+def merge_boxes(boxes):
+    """Merge overlapping (top, right, bottom, left) boxes until none overlap"""
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                    boxes[i] = [min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+
+class MotionGate:
+    """Finds the regions of a frame that changed since the background model
+
+    Frames are shrunk to MOTION_WIDTH pixels wide, converted to grey and
+    blurred, then compared with the background:
+      - 'diff': absolute difference against a running average,
+      - 'mog2': OpenCV's MOG2 background subtractor (copes better with
+        flicker and swaying foliage, costs a little more).
+    The foreground mask is dilated and split into contours; boxes smaller
+    than min_area_fraction of the frame are ignored, the rest are padded
+    (faces sit above the moving body) and merged.
+    """
+
+    def __init__(self, method='diff', threshold=25, min_area_fraction=0.002, padding=0.3,
+                 learning_rate=0.05, warmup_frames=5):
+        if method not in ('diff', 'mog2'):
+            raise ValueError(f"Unknown motion method: {method}")
+        self.method = method
+        self.threshold = threshold
+        self.min_area_fraction = min_area_fraction
+        self.padding = padding
+        self.learning_rate = learning_rate
+        self.warmup_frames = warmup_frames
+        self.frames_seen = 0
+        self._background = None
+        self._subtractor = None
+        if method == 'mog2':
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(history=300, varThreshold=threshold,
+                                                                  detectShadows=False)
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        self._buffers = None
+
+    def regions(self, frame):
+        """Moving regions of a BGR frame as full-frame (top, right, bottom, left) boxes
+
+        Returns an empty list when nothing moved, and the whole frame while
+        the background model is still warming up.
+        """
+        height, width = frame.shape[:2]
+        factor = MOTION_WIDTH / float(width)
+        size = (MOTION_WIDTH, max(int(round(height * factor)), 1))
+        if self._buffers is None or self._buffers['small'].shape[:2] != (size[1], size[0]):
+            # Reused every frame; the background model only makes sense for one frame size
+            self._buffers = {'small': np.empty((size[1], size[0], 3), dtype=np.uint8)}
+            for name in ('gray', 'blurred', 'background', 'diff', 'mask', 'dilated'):
+                self._buffers[name] = np.empty((size[1], size[0]), dtype=np.uint8)
+            self._background = None
+        buffers = self._buffers
+        with METRICS.time('motion'):
+            cv2.resize(frame, size, dst=buffers['small'], interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(buffers['small'], cv2.COLOR_BGR2GRAY, dst=buffers['gray'])
+            gray = cv2.GaussianBlur(buffers['gray'], (5, 5), 0, dst=buffers['blurred'])
+            mask = self._foreground(gray)
+        self.frames_seen += 1
+        if self.frames_seen <= self.warmup_frames:
+            return [(0, width, height, 0)]
+
+        mask = cv2.dilate(mask, self._kernel, dst=self._buffers['dilated'], iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_area = self.min_area_fraction * mask.shape[0] * mask.shape[1]
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w * h < min_area:
+                continue
+            pad_x, pad_y = w * self.padding, h * self.padding
+            # Pad upwards more than downwards: a moving body puts the face at the top of its box
+            top = max(int((y - 2 * pad_y) / factor), 0)
+            bottom = min(int(math.ceil((y + h + pad_y) / factor)), height)
+            left = max(int((x - pad_x) / factor), 0)
+            right = min(int(math.ceil((x + w + pad_x) / factor)), width)
+            boxes.append((top, right, bottom, left))
+        return merge_boxes(boxes)
+
+    def _foreground(self, gray):
+        buffers = self._buffers
+        if self._subtractor is not None:
+            self._subtractor.apply(gray, buffers['diff'], learningRate=self.learning_rate)
+            return cv2.threshold(buffers['diff'], 127, 255, cv2.THRESH_BINARY, dst=buffers['mask'])[1]
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            buffers['mask'].fill(0)
+            return buffers['mask']
+        cv2.convertScaleAbs(self._background, dst=buffers['background'])
+        cv2.absdiff(gray, buffers['background'], dst=buffers['diff'])
+        cv2.accumulateWeighted(gray, self._background, self.learning_rate)
+        return cv2.threshold(buffers['diff'], self.threshold, 255, cv2.THRESH_BINARY, dst=buffers['mask'])[1]
+
+
+class MotionGatedRecognizer:
+    """Runs detection only where the scene changed, at a higher scale than whole frames
+
+    Frames without motion keep the previous results and skip detection
+    entirely. Otherwise each motion region is cropped from the full-resolution
+    frame and detected at roi_scale, reduced where needed so one region never
+    costs more than a whole-frame pass at `scale`. Small regions therefore get
+    extra resolution (and small faces in them are found), while a region
+    covering most of the frame is no slower than before. Faces outside every
+    motion region are carried over. A whole-frame pass every `refresh_every`
+    processed frames clears boxes of people who left without being seen
+    leaving.
+    """
+
+    def __init__(self, gallery, gate=None, scale=DETECTION_SCALE, roi_scale=ROI_SCALE, tolerance=TOLERANCE,
+                 refresh_every=150, unknowns=None):
+        self.gallery = gallery
+        self.unknowns = unknowns
+        self.gate = gate if gate is not None else MotionGate()
+        self.scale = scale
+        self.roi_scale = roi_scale
+        self.tolerance = tolerance
+        self.refresh_every = refresh_every
+        self.faces = []
+        self.last_regions = []
+
+        # Counters for judging how much detection the gate saves
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.detections_run = 0
+        self._since_refresh = 0
+
+    def process(self, frame, timings=None):
+        """Recognise faces in the moving parts of a BGR frame
+
+        Results have the same ((top, right, bottom, left), name, confidence)
+        form as frame_processing.recognize_frame, and the timings dict (if
+        given) is filled with 'detect' and 'encode' seconds in the same way.
+        It is left empty when the gate skips detection, so the frame is not
+        mistaken for a cheap detection.
+        """
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+        self.frames_processed += 1
+        self._since_refresh += 1
+        regions = self.gate.regions(frame)
+        if self.refresh_every and self._since_refresh >= self.refresh_every:
+            regions = [(0, width, height, 0)]
+        if regions and regions[0] == (0, width, height, 0):
+            self._since_refresh = 0
+        self.last_regions = regions
+
+        if not regions:
+            self.frames_skipped += 1
+            METRICS.counter('motion_skipped_frames_total', 'Frames where the motion gate skipped detection').inc()
+            return self.faces
+
+        # Faces clear of every motion region are unchanged
+        faces = [face for face in self.faces if not any(box_iou(face[0], region) > 0 for region in regions)]
+        encode_time = 0.0
+        frame_pixels = float(height * width)
+        for top, right, bottom, left in regions:
+            area = float((bottom - top) * (right - left))
+            if area <= 0:
+                continue
+            region_scale = min(self.roi_scale, self.scale * math.sqrt(frame_pixels / area))
+            crop = frame[top:bottom, left:right]
+            rgb_crop = prepare_frame(crop, region_scale)
+            face_locations = detect_faces(rgb_crop)
+            self.detections_run += 1
+            region_timings = {}
+            for (f_top, f_right, f_bottom, f_left), name, confidence in identify_faces(
+                    rgb_crop, face_locations, self.gallery, region_scale, self.tolerance, region_timings,
+                    unknowns=self.unknowns, frame=crop):
+                faces.append(((f_top + top, f_right + left, f_bottom + top, f_left + left), name, confidence))
+            encode_time += region_timings['encode']
+        METRICS.counter('frames_processed_total', 'Frames run through detection').inc()
+
+        if timings is not None:
+            timings['encode'] = encode_time
+            timings['detect'] = time.perf_counter() - start - encode_time
+        self.faces = faces
+        return faces
+
+    def status(self):
+        """Overlay line with the gate's work counters"""
+        skipped = 100.0 * self.frames_skipped / self.frames_processed if self.frames_processed else 0.0
+        return (f"Motion regions: {len(self.last_regions)} | Skipped: {skipped:.0f}% | "
+                f"Detections: {self.detections_run}")
@@ -0,0 +1,345 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+from batch_encoder import DEFAULT_BATCH_SIZE, MicroBatchEncoder, encode_frames
+from event_log import EventLog, EVENT_LOG_FILE, open_event_store
+from face_gallery import GALLERY_FILE, load_gallery
+from gallery_watcher import watch_gallery
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, match_faces, draw_face_results
+from ivf_index import IVFIndex, DEFAULT_NPROBE
+from metrics import METRICS, start_metrics_server
+from multiscale_detection import DETECTION_MODES, make_detector, recognize_frame_multiscale
+from video_pipeline import CaptureThread, DropOldestQueue, RateCounter, open_video_source, is_camera_source
+
+STATUS_EVERY = 5.0  # Seconds between per-stream status lines
+
+# Per-process state, set up once by init_worker
+_worker = {}
+
+
+def init_worker(gallery_file, ann, nprobe, tolerance, watch, batch_size=DEFAULT_BATCH_SIZE):
+    """Memory-map the shared gallery once per worker process (its pages are shared between workers)"""
+    index_file = os.path.splitext(gallery_file)[0] + '.ivf.npz'
+    gallery = load_gallery(gallery_file)
+    if ann:
+        gallery.attach_index(IVFIndex.load(index_file, nprobe=nprobe))
+    if watch:
+        gallery = watch_gallery(gallery, gallery_file, index_file)
+    _worker.update(gallery=gallery, tolerance=tolerance, detectors={}, encoder=MicroBatchEncoder(batch_size))
+
+
+def recognise_small_frames(items, scale):
+    """Detect, encode and match faces in already downscaled RGB frames of several streams (runs in a worker)
+
+    items are (stream_id, seq, rgb_small_frame). The faces of all the frames
+    are encoded together through the worker's MicroBatchEncoder. Returns a
+    (stream_id, seq, faces, seconds, error) per frame and the (batches,
+    faces) the encoder ran for them. A frame whose detection fails gets
+    faces None and the error message, without failing the other frames.
+    """
+    start = time.perf_counter()
+    encoder = _worker['encoder']
+    batches, encoded = encoder.batches_run, encoder.faces_encoded
+    results, located = [], []
+    for stream_id, seq, rgb_small_frame in items:
+        try:
+            located.append((stream_id, seq, rgb_small_frame, detect_faces(rgb_small_frame)))
+        except Exception as e:
+            results.append((stream_id, seq, None, 0.0, f"{type(e).__name__}: {e}"))
+    encodings = encode_frames(encoder, [(rgb, locations) for _, _, rgb, locations in located])
+    faces = [match_faces(rgb_small_frame, face_locations, face_encodings, _worker['gallery'], scale,
+                         _worker['tolerance'])
+             for (_, _, rgb_small_frame, face_locations), face_encodings in zip(located, encodings)]
+    seconds = time.perf_counter() - start
+    results += [(stream_id, seq, frame_faces, seconds, None)
+                for (stream_id, seq, _, _), frame_faces in zip(located, faces)]
+    return results, (encoder.batches_run - batches, encoder.faces_encoded - encoded)
+
+
+def recognise_full_frame(stream_id, seq, frame, mode, scale):
+    """Recognise faces in a full-resolution BGR frame with a multi-scale detection mode (runs in a worker)"""
+    start = time.perf_counter()
+    # One detector per stream and worker, so each keeps its own pyramid tile rotation
+    detector = _worker['detectors'].get((stream_id, mode))
+    if detector is None:
+        detector = _worker['detectors'][(stream_id, mode)] = make_detector(mode, scale)
+    faces = recognize_frame_multiscale(frame, _worker['gallery'], detector, tolerance=_worker['tolerance'])
+    return [(stream_id, seq, faces, time.perf_counter() - start, None)], (0, 0)
+
+
+class Stream:
+    """One video source with its capture thread, newest-frame slot and latest results"""
+
+    def __init__(self, stream_id, source, video_capture, display, detection='fixed'):
+        self.id = stream_id
+        self.source = source
+        self.detection = detection
+        self.frames = DropOldestQueue(1, name=f'stream{stream_id}')
+        outputs = [self.frames]
+        self.display_frames = None
+        if display:
+            self.display_frames = DropOldestQueue(1, name=f'display{stream_id}')
+            outputs.append(self.display_frames)
+        self.capture = CaptureThread(video_capture, outputs)
+        self.video_capture = video_capture
+        self.in_flight = False
+        self.faces = []
+        self.processed = 0
+        self.errors = 0
+        self.recognition_rate = RateCounter(window=STATUS_EVERY)
+
+    @property
+    def finished(self):
+        return self.capture.finished.is_set() and len(self.frames) == 0
+
+    def status(self):
+        return (f"[STREAM {self.id}] {self.source} ({self.detection}): captured {self.capture.frames_read}, "
+                f"recognised {self.processed} ({self.recognition_rate.rate:.1f} FPS), "
+                f"dropped {self.frames.dropped}, errors {self.errors}, faces {[name for _, name, _ in self.faces]}")
+
+
+class MultiStreamServer:
+    """Shares one gallery and one pool of worker processes across many video sources
+
+    Each stream keeps only its newest frame, so an overloaded stream drops
+    frames instead of building a backlog. The dispatcher hands frames to the
+    pool round-robin with at most one frame per stream in flight, so a busy
+    stream cannot starve the others. In the fixed detection mode, frames are
+    downscaled and converted to RGB before they are sent, which cuts the
+    data pickled to each worker 16x at the default scale, and the newest
+    frames of several streams go to a worker as one task, so their faces
+    are encoded in shared batches. Streams using a multi-scale mode send
+    the full frame, which refinement needs.
+
+    A frame that fails in a worker is dropped and counted against its
+    stream; if a worker process dies, the pool is restarted and the frames
+    in flight are dropped. Either way the other streams keep running.
+    """
+
+    def __init__(self, streams, workers, gallery_file=GALLERY_FILE, scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                 ann=False, nprobe=DEFAULT_NPROBE, watch=True, events=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.streams = streams
+        self.events = events if events is not None else EventLog(None)
+        self.workers = workers
+        self.scale = scale
+        # Spread the streams over the workers, so every worker gets a share of each round
+        self.frames_per_task = -(-len(streams) // workers)
+        self._pool_args = (gallery_file, ann, nprobe, tolerance, watch, batch_size)
+        self.pool = self._start_pool()
+        self.pool_restarts = 0
+        self.pending = {}
+        self.batches_run = 0
+        self.faces_encoded = 0
+        self._cursor = 0
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=self._pool_args)
+
+    def _restart_pool(self, error):
+        """Replace a pool whose worker died; the frames in flight are dropped"""
+        print(f"[ERROR] A worker process died ({error}); restarting the worker pool")
+        for streams in self.pending.values():
+            for stream in streams:
+                stream.in_flight = False
+        self.pending.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._start_pool()
+        self.pool_restarts += 1
+
+    def _submit(self, streams, future):
+        self.pending[future] = streams
+        for stream in streams:
+            stream.in_flight = True
+
+    def _submit_small_frames(self, group):
+        future = self.pool.submit(recognise_small_frames, [item for _, item in group], self.scale)
+        self._submit([stream for stream, _ in group], future)
+
+    def _dispatch(self):
+        """Submit newest frames round-robin while workers are free"""
+        try:
+            self._dispatch_frames()
+        except BrokenProcessPool as e:
+            self._restart_pool(e)
+
+    def _dispatch_frames(self):
+        n = len(self.streams)
+        group = []  # (stream, item) of fixed-mode frames for one task
+        for i in range(n):
+            if len(self.pending) >= self.workers:
+                break
+            stream = self.streams[(self._cursor + i) % n]
+            if stream.in_flight:
+                continue
+            frame = stream.frames.get_nowait()
+            if frame is None:
+                continue
+            if stream.detection == 'fixed':
+                group.append((stream, (stream.id, frame.seq, prepare_frame(frame.image, self.scale))))
+                if len(group) == self.frames_per_task:
+                    self._submit_small_frames(group)
+                    group = []
+            else:
+                future = self.pool.submit(recognise_full_frame, stream.id, frame.seq, frame.image,
+                                          stream.detection, self.scale)
+                self._submit([stream], future)
+        if group:
+            self._submit_small_frames(group)
+        self._cursor = (self._cursor + 1) % n
+
+    def _collect(self, timeout):
+        if not self.pending:
+            time.sleep(timeout)
+            return
+        done, _ = wait(self.pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            streams = self.pending.pop(future)
+            for stream in streams:
+                stream.in_flight = False
+            try:
+                results, (batches, faces_encoded) = future.result()
+            except BrokenProcessPool as e:
+                self._restart_pool(e)
+                return
+            except Exception as e:
+                # Drop these frames only; the streams send their next frames as usual
+                results = [(stream.id, None, None, 0.0, f"{type(e).__name__}: {e}") for stream in streams]
+                batches = faces_encoded = 0
+            self.batches_run += batches
+            self.faces_encoded += faces_encoded
+            for stream_id, seq, faces, worker_seconds, error in results:
+                stream = self.streams[stream_id]
+                if error is not None:
+                    if stream.errors == 0:
+                        print(f"[WARNING] Recognition failed on stream {stream.id}: {error}")
+                    stream.errors += 1
+                    continue
+                stream.faces = faces
+                stream.processed += 1
+                stream.recognition_rate.tick()
+                METRICS.histogram('worker_latency_seconds', 'Detect+encode+match time in a worker',
+                                  stream=stream.id).observe(worker_seconds)
+                METRICS.counter('frames_processed_total', 'Frames run through detection', stream=stream.id).inc()
+                self.events.observe(faces, stream=stream.id)
+
+    def _show(self):
+        """Draw each stream's newest frame with its latest results; False if the user quit"""
+        for stream in self.streams:
+            frame = stream.display_frames.get_nowait()
+            if frame is None:
+                continue
+            image = frame.image.copy()
+            draw_face_results(image, stream.faces)
+            cv2.putText(image, f"Stream {stream.id} | {stream.recognition_rate.rate:.1f} FPS recognised",
+                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+            cv2.imshow(f"Stream {stream.id}: {stream.source}", image)
+        return (cv2.waitKey(1) & 0xFF) != ord('q')
+
+    def run(self, display=False):
+        for stream in self.streams:
+            stream.capture.start()
+        last_status = time.time()
+        try:
+            while True:
+                self._dispatch()
+                self._collect(timeout=0.005)
+                if display and not self._show():
+                    print("[INFO] Quitting...")
+                    break
+                if time.time() - last_status >= STATUS_EVERY:
+                    last_status = time.time()
+                    for stream in self.streams:
+                        print(stream.status())
+                    print(self.encoder_status())
+                if not self.pending and all(stream.finished for stream in self.streams):
+                    print("[INFO] All sources finished")
+                    break
+        finally:
+            for stream in self.streams:
+                stream.capture.stop()
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            for stream in self.streams:
+                stream.capture.join(timeout=2)
+                stream.video_capture.release()
+                print(stream.status())
+            print(self.encoder_status())
+            self.events.close()
+
+    def encoder_status(self):
+        mean = self.faces_encoded / self.batches_run if self.batches_run else 0.0
+        return f"[INFO] Encoder: {self.faces_encoded} faces in {self.batches_run} batches ({mean:.1f} per batch)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognise faces on several video sources with one shared worker pool")
+    parser.add_argument('sources', nargs='+', help="camera indices, stream URLs (rtsp://...) or video files")
+    parser.add_argument('--workers', type=int, default=0, help="worker processes (0 = one per CPU core)")
+    parser.add_argument('--scale', type=float, default=DETECTION_SCALE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--ann', action='store_true', help="match with the approximate nearest-neighbour index")
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE)
+    parser.add_argument('--watch', action=argparse.BooleanOptionalAction, default=True,
+                        help="reload the gallery in every worker when the file is rewritten")
+    parser.add_argument('--detection', choices=DETECTION_MODES, default='fixed',
+                        help="detection mode for every stream")
+    parser.add_argument('--stream-detection', action='append', default=[], metavar='INDEX=MODE',
+                        help="detection mode for one stream, by its position in the source list (repeatable)")
+    parser.add_argument('--display', action='store_true', help="show one window per stream")
+    parser.add_argument('--event-log', action=argparse.BooleanOptionalAction, default=True,
+                        help="save enter/leave events per stream (they are printed either way)")
+    parser.add_argument('--event-file', default=EVENT_LOG_FILE,
+                        help="SQLite file for events, or a .jsonl file for JSON lines")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="most faces per encoder call in a worker (frames of several streams share calls)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gallery):
+        print(f"[ERROR] {args.gallery} not found! Please run train_model_improved.py first.")
+        return
+
+    if args.metrics_port is not None:
+        METRICS.enabled = True
+        start_metrics_server(args.metrics_port)
+        print(f"[INFO] Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+
+    detection = {}
+    for item in args.stream_detection:
+        index, _, mode = item.partition('=')
+        if not index.isdigit() or mode not in DETECTION_MODES:
+            parser.error(f"--stream-detection expects INDEX=MODE with MODE one of {', '.join(DETECTION_MODES)}")
+        detection[int(index)] = mode
+
+    streams = []
+    for i, source in enumerate(args.sources):
+        video_capture = open_video_source(source)
+        if video_capture is None:
+            print(f"[ERROR] Could not open video source {source}")
+            continue
+        if is_camera_source(source):
+            video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        streams.append(Stream(len(streams), source, video_capture, args.display, detection.get(i, args.detection)))
+    if not streams:
+        return
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    print(f"[INFO] {len(streams)} streams sharing {workers} worker processes")
+    events = EventLog(open_event_store(args.event_file) if args.event_log else None)
+    server = MultiStreamServer(streams, workers, args.gallery, args.scale, args.tolerance, args.ann, args.nprobe,
+                               args.watch, events, args.batch_size)
+    try:
+        server.run(display=args.display)
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrupted by user")
+    finally:
+        if args.display:
+            cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
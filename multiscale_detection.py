@@ -0,0 +1,137 @@
+import time
+import cv2
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, identify_faces, scale_locations
+from face_tracker import box_iou
+from metrics import METRICS
+
+DETECTION_MODES = ('fixed', 'coarse-to-fine', 'pyramid')
+REFINE_FACE_SIZE = 100    # Refinement crops are scaled so the candidate face is about this many pixels tall
+REFINE_MARGIN = 0.4       # Crop margin around a candidate, as a fraction of its size
+PYRAMID_SCALES = (0.5,)   # Extra scales scanned tile by tile for faces too small for the coarse pass
+TILE_OVERLAP = 0.25       # Neighbouring pyramid tiles overlap so faces on tile edges are not cut
+
+
+class MultiScaleDetector:
+    """Coarse-to-fine HOG detection with an optional sparse pyramid for small faces
+
+    1. Coarse pass: the whole frame at coarse_scale, as the fixed mode does.
+    2. Refinement: each candidate is cropped from the full-resolution frame
+       with a margin, scaled so the face is about REFINE_FACE_SIZE pixels
+       tall and detected again, giving a tighter box than the upscaled
+       coarse one. If refinement finds nothing, the coarse box is kept.
+    3. Sparse pyramid (optional): at each of pyramid_scales the frame is
+       split into overlapping tiles that each cost about as much as the
+       coarse pass. Only tiles_per_frame tiles are scanned per call, in
+       rotation, so small faces are found within a few frames at a bounded
+       extra cost per frame. Each tile's faces are reported until that tile
+       is scanned again.
+
+    Boxes are returned in full-frame (top, right, bottom, left) coordinates.
+    """
+
+    def __init__(self, coarse_scale=DETECTION_SCALE, refine=True, pyramid_scales=(), tiles_per_frame=1):
+        self.coarse_scale = coarse_scale
+        self.refine = refine
+        self.pyramid_scales = tuple(pyramid_scales)
+        self.tiles_per_frame = tiles_per_frame
+        self._tiles = None
+        self._tiles_key = None
+        self._tile_boxes = {}
+        self._next_tile = 0
+
+    def detect(self, frame):
+        """Face boxes in a BGR frame, in full-frame coordinates"""
+        boxes = scale_locations(detect_faces(prepare_frame(frame, self.coarse_scale)), 1 / self.coarse_scale)
+        if self.refine:
+            with METRICS.time('refine'):
+                boxes = [self._refine(frame, box) for box in boxes]
+        if self.pyramid_scales:
+            with METRICS.time('pyramid'):
+                for box in self._scan_tiles(frame):
+                    if all(box_iou(box, other) < 0.3 for other in boxes):
+                        boxes.append(box)
+        return boxes
+
+    def _refine(self, frame, box):
+        height, width = frame.shape[:2]
+        top, right, bottom, left = box
+        size = max(bottom - top, right - left, 1)
+        margin = int(size * REFINE_MARGIN)
+        crop_top, crop_left = max(top - margin, 0), max(left - margin, 0)
+        crop = frame[crop_top:min(bottom + margin, height), crop_left:min(right + margin, width)]
+        scale = min(REFINE_FACE_SIZE / float(size), 1.0)
+        candidates = scale_locations(detect_faces(prepare_frame(crop, scale)), 1 / scale)
+        candidates = [(t + crop_top, r + crop_left, b + crop_top, l + crop_left) for t, r, b, l in candidates]
+        if not candidates:
+            return box
+        best = max(candidates, key=lambda candidate: box_iou(candidate, box))
+        return best if box_iou(best, box) > 0.2 else box
+
+    def _tile_grid(self, shape):
+        """(scale, top, right, bottom, left) for every pyramid tile of a frame this shape"""
+        height, width = shape[:2]
+        tiles = []
+        for scale in self.pyramid_scales:
+            # A tile at this scale has as many pixels as the coarse pass over the whole frame
+            tile_h = min(int(height * self.coarse_scale / scale), height)
+            tile_w = min(int(width * self.coarse_scale / scale), width)
+            step_h = max(int(tile_h * (1 - TILE_OVERLAP)), 1)
+            step_w = max(int(tile_w * (1 - TILE_OVERLAP)), 1)
+            for top in range(0, max(height - tile_h, 0) + step_h, step_h):
+                tile_top = min(top, height - tile_h)
+                for left in range(0, max(width - tile_w, 0) + step_w, step_w):
+                    tile_left = min(left, width - tile_w)
+                    tiles.append((scale, tile_top, tile_left + tile_w, tile_top + tile_h, tile_left))
+        return tiles
+
+    def _scan_tiles(self, frame):
+        # The grid depends on the coarse scale, which the adaptive scheduler may change
+        key = (frame.shape[:2], self.coarse_scale)
+        if self._tiles_key != key:
+            self._tiles = self._tile_grid(frame.shape)
+            self._tiles_key = key
+            self._tile_boxes = {}
+            self._next_tile = 0
+        for _ in range(min(self.tiles_per_frame, len(self._tiles))):
+            scale, top, right, bottom, left = self._tiles[self._next_tile]
+            locations = detect_faces(prepare_frame(frame[top:bottom, left:right], scale))
+            self._tile_boxes[self._next_tile] = [(t + top, r + left, b + top, l + left)
+                                                 for t, r, b, l in scale_locations(locations, 1 / scale)]
+            self._next_tile = (self._next_tile + 1) % len(self._tiles)
+        # Overlapping tiles can both see a face; keep one box per face
+        boxes = []
+        for tile_boxes in self._tile_boxes.values():
+            for box in tile_boxes:
+                if all(box_iou(box, other) < 0.3 for other in boxes):
+                    boxes.append(box)
+        return boxes
+
+    @property
+    def tile_count(self):
+        return len(self._tiles) if self._tiles is not None else 0
+
+
+def make_detector(mode, coarse_scale=DETECTION_SCALE, tiles_per_frame=1):
+    """Detector for a detection mode name, or None for the fixed single-scale mode"""
+    if mode not in DETECTION_MODES:
+        raise ValueError(f"Unknown detection mode: {mode}")
+    if mode == 'fixed':
+        return None
+    pyramid_scales = PYRAMID_SCALES if mode == 'pyramid' else ()
+    return MultiScaleDetector(coarse_scale, refine=True, pyramid_scales=pyramid_scales,
+                              tiles_per_frame=tiles_per_frame)
+
+
+def recognize_frame_multiscale(frame, gallery, detector, tolerance=TOLERANCE, timings=None, unknowns=None):
+    """Like frame_processing.recognize_frame, but detecting with a MultiScaleDetector
+
+    Faces are encoded from the full-resolution frame, since the refined
+    boxes are in full-frame coordinates.
+    """
+    start = time.perf_counter()
+    face_locations = detector.detect(frame)
+    METRICS.counter('frames_processed_total', 'Frames run through detection').inc()
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if face_locations else None
+    if timings is not None:
+        timings['detect'] = time.perf_counter() - start
+    return identify_faces(rgb_frame, face_locations, gallery, 1.0, tolerance, timings, unknowns=unknowns)
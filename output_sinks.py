@@ -0,0 +1,287 @@
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+from metrics import METRICS
+from video_pipeline import DropOldestQueue
+
+PREVIEW_FPS = 10          # Frames per second encoded for the MJPEG preview
+PREVIEW_QUALITY = 70      # JPEG quality of the preview
+RECORD_QUEUE_SIZE = 60    # Frames the recorder may fall behind before it drops the oldest
+SNAPSHOT_COOLDOWN = 30.0  # Seconds before the same person triggers another event snapshot
+SNAPSHOT_DIR = 'snapshots'
+
+PREVIEW_PAGE = b"""<!DOCTYPE html>
+<html><head><title>Face Recognition</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="max-width:100%"></body></html>
+"""
+
+
+class OutputSink(threading.Thread):
+    """Writes annotated frames on its own thread, fed through a drop-oldest queue
+
+    The frame loop only calls offer() and, if the sink wants the frame,
+    queues it. All encoding and I/O happens on the sink's thread, so a slow
+    disk or client costs dropped frames here instead of recognition speed.
+    """
+
+    def __init__(self, name, queue_size=1):
+        super().__init__(name=f"sink-{name}", daemon=True)
+        self.queue = DropOldestQueue(queue_size, name=f"sink-{name}")
+        self.written = 0
+        self.error = None
+
+    def offer(self, faces):
+        """A payload for write() if this sink wants the current frame, else None"""
+        return True
+
+    def put(self, frame, payload):
+        """Queue a frame the caller will not modify again"""
+        self.queue.put((frame, payload))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.write(*item)
+                self.written += 1
+                METRICS.counter('sink_frames_written_total', 'Frames written by output sinks',
+                                sink=self.name).inc()
+            except Exception as e:
+                if self.error is None:
+                    print(f"[WARNING] {self.name} failed: {e}")
+                self.error = e
+
+    def write(self, frame, payload):
+        raise NotImplementedError
+
+    def finish(self):
+        """Release resources once the queue has drained"""
+
+    def close(self, timeout=5.0):
+        self.queue.close()
+        self.join(timeout)
+        self.finish()
+
+    @property
+    def dropped(self):
+        return self.queue.dropped
+
+
+class MJPEGPreviewSink(OutputSink):
+    """Serves the annotated video as MJPEG over HTTP for headless machines
+
+    Open http://host:port/ in a browser. Frames are only JPEG-encoded while
+    a client is watching, at most `fps` per second. Every client gets the
+    newest frame when it is ready for one, so a slow client skips frames
+    without holding up the encoder or other clients.
+    """
+
+    def __init__(self, port, host='127.0.0.1', fps=PREVIEW_FPS, quality=PREVIEW_QUALITY):
+        super().__init__('preview')
+        self.interval = 1.0 / fps
+        self.quality = quality
+        self.clients = 0
+        self._jpeg = None
+        self._seq = 0
+        self._last_offer = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, name="preview-http", daemon=True).start()
+
+    def offer(self, faces):
+        now = time.perf_counter()
+        if self.clients == 0 or now - self._last_offer < self.interval:
+            return None
+        self._last_offer = now
+        return True
+
+    def write(self, frame, payload):
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        with self._cond:
+            self._jpeg = jpeg.tobytes()
+            self._seq += 1
+            self._cond.notify_all()
+
+    def next_jpeg(self, seq, timeout=1.0):
+        """(seq, jpeg) of the first frame newer than seq, or None on timeout or shutdown"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq != seq or self._closed, timeout) or self._closed:
+                return None
+            return self._seq, self._jpeg
+
+    def finish(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        sink = self
+
+        class PreviewHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html')
+                    self.send_header('Content-Length', str(len(PREVIEW_PAGE)))
+                    self.end_headers()
+                    self.wfile.write(PREVIEW_PAGE)
+                elif path == '/stream.mjpg':
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                with sink._cond:
+                    sink.clients += 1
+                seq = 0
+                try:
+                    while not sink._closed:
+                        item = sink.next_jpeg(seq)
+                        if item is None:
+                            continue
+                        seq, jpeg = item
+                        self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                         b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n')
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with sink._cond:
+                        sink.clients -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return PreviewHandler
+
+
+class VideoRecorderSink(OutputSink):
+    """Records the annotated video to a file on its own encode thread
+
+    The writer is opened with the size of the first frame. If the recorder
+    falls more than queue_size frames behind, the oldest frames are dropped
+    and the recording skips ahead.
+    """
+
+    def __init__(self, path, fps=15.0, fourcc='mp4v', queue_size=RECORD_QUEUE_SIZE):
+        super().__init__('recorder', queue_size)
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self._writer = None
+        self._size = None
+
+    def write(self, frame, payload):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._size = (width, height)
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self._size)
+            if not self._writer.isOpened():
+                raise IOError(f"cannot open {self.path} for writing with codec {self.fourcc}")
+        if (frame.shape[1], frame.shape[0]) != self._size:
+            frame = cv2.resize(frame, self._size)
+        self._writer.write(frame)
+
+    def finish(self):
+        if self._writer is not None:
+            self._writer.release()
+            print(f"[INFO] Recorded {self.written} frames to {self.path} ({self.dropped} dropped)")
+
+
+class SnapshotSink(OutputSink):
+    """Saves JPEG snapshots in the background: on request, and when a known person appears
+
+    With events on, a frame is saved when it shows someone who has not
+    triggered a snapshot in the last `cooldown` seconds. save() queues a
+    snapshot of any frame, e.g. for the screenshot key.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, events=True, cooldown=SNAPSHOT_COOLDOWN, queue_size=8,
+                 name='snapshots', verbose=True):
+        super().__init__(name, queue_size)
+        self.directory = directory
+        self.events = events
+        self.cooldown = cooldown
+        self.verbose = verbose
+        self._last_seen = {}
+
+    def offer(self, faces):
+        if not self.events:
+            return None
+        now = time.time()
+        names = sorted({name for _, name, _ in faces
+                        if name != "Unknown" and now - self._last_seen.get(name, 0.0) >= self.cooldown})
+        if not names:
+            return None
+        for name in names:
+            self._last_seen[name] = now
+        label = re.sub(r'[^A-Za-z0-9_-]+', '_', '_'.join(names))
+        return os.path.join(self.directory, f"snapshot_{time.strftime('%Y%m%d_%H%M%S')}_{label}.jpg")
+
+    def save(self, frame, path):
+        """Queue a copy of frame to be written to path"""
+        self.put(frame.copy(), path)
+
+    def write(self, frame, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if not cv2.imwrite(path, frame):
+            raise IOError(f"cannot write {path}")
+        if self.verbose:
+            print(f"[INFO] Snapshot saved: {path}")
+
+
+class OutputSinks:
+    """Hands each annotated frame to every sink that wants it
+
+    The frame is copied at most once per call, and only if some sink takes
+    it, so the caller can keep drawing into a reused buffer.
+    """
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        for sink in self.sinks:
+            sink.start()
+
+    def submit(self, frame, faces):
+        shared = None
+        for sink in self.sinks:
+            payload = sink.offer(faces)
+            if payload is None:
+                continue
+            if shared is None:
+                with METRICS.time('sink_copy'):
+                    shared = frame.copy()
+            sink.put(shared, payload)
+
+    def status(self):
+        parts = []
+        for sink in self.sinks:
+            if isinstance(sink, MJPEGPreviewSink):
+                parts.append(f"Preview: {sink.clients} watching")
+            elif isinstance(sink, VideoRecorderSink):
+                parts.append(f"Recorded: {sink.written} (dropped {sink.dropped})")
+            elif isinstance(sink, SnapshotSink) and sink.events:
+                parts.append(f"Snapshots: {sink.written}")
+        return " | ".join(parts)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -1,58 +1,81 @@
-import face_recognition
 import cv2
-import pickle
 import os
+import time
+from face_gallery import GALLERY_FILE, LEGACY_ENCODINGS_FILE, load_gallery, load_legacy_pickle
+from ivf_index import IVFIndex
+from adaptive_scheduler import AdaptiveScheduler
+from frame_processing import FrameBuffers, scale_locations
+from event_log import EventLog, EVENT_LOG_FILE, open_event_store
+from metrics import METRICS, start_metrics_server
+from model_loader import face_recognition, prewarm, StartupReport
+from video_pipeline import find_camera
+
+# The face models load in the background while the gallery and camera are opened
+startup = StartupReport()
+prewarmer = prewarm()
 
 # Load known face encodings
-ENCODINGS_FILE = 'known_faces.pkl'
-if not os.path.exists(ENCODINGS_FILE):
-    print(f"[ERROR] {ENCODINGS_FILE} not found! Please run train_model.py first.")
-    exit(1)
+ANN_INDEX_FILE = 'known_faces.ivf.npz'
+USE_ANN_INDEX = False  # Set to True to match with the index built by train_model_improved.py
+ANN_NPROBE = 8         # Index lists searched per face (higher = slower but more accurate)
+METRICS_PORT = None    # e.g. 9100 to serve per-stage metrics at http://127.0.0.1:9100/metrics
 
 try:
-    with open(ENCODINGS_FILE, 'rb') as f:
-        known_encodings, known_names = pickle.load(f)
-    print(f"[INFO] Loaded {len(known_names)} known faces: {known_names}")
+    if os.path.exists(GALLERY_FILE):
+        gallery = load_gallery(GALLERY_FILE)
+    elif os.path.exists(LEGACY_ENCODINGS_FILE):
+        print(f"[WARNING] {GALLERY_FILE} not found, loading legacy {LEGACY_ENCODINGS_FILE}")
+        gallery = load_legacy_pickle(LEGACY_ENCODINGS_FILE)
+    else:
+        print(f"[ERROR] {GALLERY_FILE} not found! Please run train_model.py first.")
+        exit(1)
+    print(f"[INFO] Loaded {len(gallery)} known faces: {gallery.identities[:20]}")
+    startup.mark('gallery loaded')
 except Exception as e:
     print(f"[ERROR] Failed to load known faces: {e}")
     exit(1)
 
-# Start webcam
-print("[INFO] Initializing camera...")
-video_capture = cv2.VideoCapture(0)
-
-# Check if camera opened successfully
-if not video_capture.isOpened():
-    print("[ERROR] Could not open camera. Trying different camera indices...")
-    for i in range(1, 4):
-        video_capture = cv2.VideoCapture(i)
-        if video_capture.isOpened():
-            print(f"[INFO] Camera found at index {i}")
-            break
+if USE_ANN_INDEX:
+    if os.path.exists(ANN_INDEX_FILE):
+        gallery.attach_index(IVFIndex.load(ANN_INDEX_FILE, nprobe=ANN_NPROBE))
+        print(f"[INFO] Using ANN index with {gallery.index.n_lists} lists (nprobe={ANN_NPROBE})")
     else:
-        print("[ERROR] No camera found!")
-        exit(1)
+        print(f"[WARNING] {ANN_INDEX_FILE} not found, using exact matching")
 
-# Set camera properties for better performance
-video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-video_capture.set(cv2.CAP_PROP_FPS, 30)
+if METRICS_PORT is not None:
+    METRICS.enabled = True
+    start_metrics_server(METRICS_PORT)
+    print(f"[INFO] Metrics at http://127.0.0.1:{METRICS_PORT}/metrics")
+
+# Start webcam (the camera that worked last time is tried first)
+print("[INFO] Initializing camera...")
+video_capture, camera_index = find_camera(width=640, height=480, fps=30)
+if video_capture is None:
+    print("[ERROR] No camera found!")
+    exit(1)
+print(f"[INFO] Camera found at index {camera_index}")
+startup.mark('camera open')
 
 print("[INFO] Starting webcam for real-time recognition...")
 print("[INFO] Press 'q' to quit")
 
 frame_count = 0
-process_every_n_frames = 3  # Process every 3rd frame for better performance
+FRAME_BUDGET_MS = 33  # Detection cadence and downscale adapt to keep ~30 FPS
+scheduler = AdaptiveScheduler(budget_ms=FRAME_BUDGET_MS, initial_cadence=3)
+buffers = FrameBuffers()
+events = EventLog(open_event_store(EVENT_LOG_FILE))
 face_locations = []
 face_encodings = []
 face_names = []
 
 try:
     while True:
-        ret, frame = video_capture.read()
+        with METRICS.time('capture'):
+            ret, frame = video_capture.read()
         if not ret:
             print("[ERROR] Failed to grab frame from camera")
             continue
+        METRICS.counter('frames_read_total', 'Frames read from the video source').inc()
 
         # Show original frame dimensions for debugging (only once)
         if frame_count == 0:
@@ -61,42 +84,44 @@ try:
         
         frame_count += 1
 
-        # Only process every nth frame for face recognition (for performance)
-        if frame_count % process_every_n_frames == 0:
-            # Resize and convert to RGB
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = small_frame[:, :, ::-1]
+        # Only process some frames for face recognition; the scheduler picks which and at what scale
+        if scheduler.should_process():
+            scale = scheduler.scale
+            start = time.perf_counter()
+
+            # Resize and convert to RGB, into buffers reused every frame
+            rgb_small_frame = buffers.prepare(frame, scale)
 
             # Detect face locations and encodings
-            face_locations = face_recognition.face_locations(rgb_small_frame, model="hog")
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+            with METRICS.time('face_locations'):
+                face_locations = face_recognition.face_locations(rgb_small_frame, model="hog")
+            detected = time.perf_counter()
+            with METRICS.time('face_encodings'):
+                face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+            METRICS.counter('faces_detected_total', 'Faces found by the detector').inc(len(face_locations))
+            METRICS.counter('encodes_total', 'Faces run through the 128-d encoder').inc(len(face_locations))
+            scheduler.record_recognition(frame.shape, detected - start, time.perf_counter() - detected,
+                                         len(face_locations))
+            if not startup.reported:
+                startup.mark('first recognised frame')
+                startup.report(prewarmer)
 
-            face_names = []
-            for face_encoding in face_encodings:
-                # Compare with known faces
-                matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-                name = "Unknown"
-                confidence = 0.0
-
-                if True in matches:
-                    # Find the best match
-                    face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-                    best_match_index = face_distances.argmin()
-                    if matches[best_match_index]:
-                        name = known_names[best_match_index]
-                        confidence = 1 - face_distances[best_match_index]
-                        print(f"[INFO] Recognized: {name} (confidence: {confidence:.2f})")
+            # Scale face box coordinates back to original frame size
+            face_locations = scale_locations(face_locations, 1 / scale)
 
+            face_names = []
+            # Match every face in the frame against the gallery in one call
+            with METRICS.time('match'):
+                matches = gallery.identify(face_encodings, tolerance=0.6)
+            confidences = [1 - distance if name != "Unknown" else 0.0 for name, distance in matches]
+            for (name, _), confidence in zip(matches, confidences):
                 face_names.append(f"{name} ({confidence:.2f})")
+            # People are announced once when they appear and once when they leave
+            events.observe([(location, name, confidence)
+                            for location, (name, _), confidence in zip(face_locations, matches, confidences)])
 
         # Draw the results on every frame (even if we didn't process it)
         for (top, right, bottom, left), name in zip(face_locations, face_names):
-            # Scale face box coordinates back to original frame size
-            top *= 4
-            right *= 4
-            bottom *= 4
-            left *= 4
-
             # Choose color based on recognition
             color = (0, 255, 0) if "Unknown" not in name else (0, 0, 255)
             
@@ -109,13 +134,15 @@ try:
                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
 
         # Add status information
-        status_text = f"Frame: {frame_count} | Known faces: {len(known_names)} | Detected: {len(face_locations)}"
+        status_text = f"Frame: {frame_count} | Known faces: {len(gallery.identities)} | Detected: {len(face_locations)}"
         cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        cv2.putText(frame, scheduler.status(), (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
         cv2.putText(frame, "Press 'q' to quit", (10, frame.shape[0] - 20), 
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
 
         # Display the frame
         cv2.imshow('Face Recognition - Live Feed', frame)
+        scheduler.frame_done()
 
         # Handle key presses with minimal delay
         key = cv2.waitKey(1) & 0xFF
@@ -132,6 +159,7 @@ except Exception as e:
     print(f"[ERROR] An error occurred: {e}")
 finally:
     print("[INFO] Cleaning up...")
+    events.close()
 
 video_capture.release()
 cv2.destroyAllWindows()
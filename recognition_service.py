@@ -0,0 +1,395 @@
+import argparse
+import base64
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+from batch_encoder import DEFAULT_BATCH_SIZE, DEFAULT_DEADLINE_MS, MicroBatchEncoder, encode_frames
+from face_gallery import GALLERY_FILE, load_gallery
+from gallery_watcher import watch_gallery
+from face_tracker import FaceTracker
+from frame_processing import DETECTION_SCALE, TOLERANCE, prepare_frame, detect_faces, match_faces
+from ivf_index import IVFIndex, DEFAULT_NPROBE
+from metrics import METRICS
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 32 * 1024 * 1024
+STREAM_IDLE_SECONDS = 60.0  # Stream sessions unused for this long are dropped
+MIN_IMAGE_SIDE = 32  # Smaller images are rejected; they cannot hold a face the detector finds
+
+# Per-process state, set up once by init_worker
+_worker = {}
+
+
+def index_file_for(gallery_file):
+    return os.path.splitext(gallery_file)[0] + '.ivf.npz'
+
+
+def load_service_gallery(gallery_file, ann, nprobe, watch):
+    """Load the gallery, with its ANN index if asked for, and keep it in sync with the file if watching"""
+    gallery = load_gallery(gallery_file)
+    if ann:
+        gallery.attach_index(IVFIndex.load(index_file_for(gallery_file), nprobe=nprobe))
+    if watch:
+        gallery = watch_gallery(gallery, gallery_file, index_file_for(gallery_file))
+    return gallery
+
+
+def init_worker(gallery_file, ann, nprobe, scale, tolerance, watch, batch_size=DEFAULT_BATCH_SIZE):
+    """Memory-map the gallery once per worker process (face_recognition loads its models on import)"""
+    gallery = load_service_gallery(gallery_file, ann, nprobe, watch)
+    _worker.update(gallery=gallery, scale=scale, tolerance=tolerance, encoder=MicroBatchEncoder(batch_size))
+
+
+def warm_up(_=None):
+    """Run one blank detection so the first real request does not pay for lazy initialisation"""
+    detect_faces(np.zeros((64, 64, 3), dtype=np.uint8))
+    return os.getpid()
+
+
+class ImageError(ValueError):
+    """A request image that cannot be recognised (answered with 400)"""
+
+
+def decode_image(data):
+    """BGR image from encoded bytes (JPEG, PNG, ...), or None if they cannot be decoded"""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def read_image(data, scale, timing):
+    """Decode a request image, storing decode_ms in timing
+
+    Raises ImageError if it cannot be decoded, or if it is too small to
+    downscale by `scale` (cv2.resize fails on an empty result).
+    """
+    start = time.perf_counter()
+    image = decode_image(data)
+    timing['decode_ms'] = round(1000.0 * (time.perf_counter() - start), 3)
+    if image is None:
+        raise ImageError('could not decode image')
+    height, width = image.shape[:2]
+    min_side = max(MIN_IMAGE_SIDE, math.ceil(1 / scale))
+    if min(height, width) < min_side:
+        raise ImageError(f'image is {width}x{height}; both sides must be at least {min_side} pixels')
+    return image
+
+
+def failure(e, timing):
+    """(status, response) for an exception raised while recognising one image"""
+    if isinstance(e, ImageError):
+        return 400, {'error': str(e), 'timing': timing}
+    return 500, {'error': f"{type(e).__name__}: {e}", 'timing': timing}
+
+
+def face_records(results):
+    return [{'box': list(box), 'name': name, 'confidence': round(confidence, 4)}
+            for box, name, confidence in results]
+
+
+def _detect_bytes(data, timing):
+    """(rgb_small_frame, face_locations) for encoded image bytes, storing decode and detect times in timing"""
+    image = read_image(data, _worker['scale'], timing)
+    start = time.perf_counter()
+    rgb_small_frame = prepare_frame(image, _worker['scale'])
+    face_locations = detect_faces(rgb_small_frame)
+    timing['detect_ms'] = round(1000.0 * (time.perf_counter() - start), 3)
+    return rgb_small_frame, face_locations
+
+
+def _encode_each(frames):
+    """Encodings per frame, encoded one frame at a time; a frame that fails gets its exception instead"""
+    encodings = []
+    for frame in frames:
+        try:
+            encodings.append(encode_frames(_worker['encoder'], [frame])[0])
+        except Exception as e:
+            encodings.append(e)
+    return encodings
+
+
+def recognise_images(images):
+    """Decode, detect, encode and match several images (runs in a worker)
+
+    The faces of all the images are encoded together through the worker's
+    MicroBatchEncoder; encode_ms is the time of that shared encode. Returns
+    a (status, response) per image: 200 with faces and timing in ms, 400 if
+    the image is unreadable or too small, or 500 if recognising it failed.
+    A failing image never fails the others.
+    """
+    results = [None] * len(images)
+    detected = []  # (index, (rgb_small_frame, face_locations), timing) of the readable images
+    for i, data in enumerate(images):
+        timing = {}
+        try:
+            detected.append((i, _detect_bytes(data, timing), timing))
+        except Exception as e:
+            results[i] = failure(e, timing)
+
+    frames = [frame for _, frame, _ in detected]
+    start = time.perf_counter()
+    try:
+        encodings = encode_frames(_worker['encoder'], frames)
+    except Exception:
+        # Find the image that failed: encode them one by one
+        encodings = _encode_each(frames)
+    encode_ms = round(1000.0 * (time.perf_counter() - start), 3)
+
+    for (i, (rgb_small_frame, face_locations), timing), face_encodings in zip(detected, encodings):
+        timing['encode_ms'] = encode_ms
+        try:
+            if isinstance(face_encodings, Exception):
+                raise face_encodings
+            start = time.perf_counter()
+            faces = match_faces(rgb_small_frame, face_locations, face_encodings, _worker['gallery'],
+                                _worker['scale'], _worker['tolerance'])
+            timing['match_ms'] = round(1000.0 * (time.perf_counter() - start), 3)
+            results[i] = 200, {'faces': face_records(faces), 'timing': timing}
+        except Exception as e:
+            results[i] = failure(e, timing)
+    return results
+
+
+def recognise_bytes(data):
+    """Decode, detect, encode and match one image (runs in a worker); returns (status, response)"""
+    return recognise_images([data])[0]
+
+
+class StreamSession:
+    """Tracker state for one client video stream, so identities persist between frames"""
+
+    def __init__(self, gallery, detect_every, scale, tolerance, encoder=None):
+        self.tracker = FaceTracker(gallery, detect_every=detect_every, scale=scale, tolerance=tolerance,
+                                   encoder=encoder)
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.frames = 0
+
+
+class RecognitionService:
+    """Keeps the models and gallery warm and answers recognition requests
+
+    Single and batch images go to a pool of worker processes, so requests
+    are handled concurrently on every core. A batch is split into one chunk
+    per worker, and each worker encodes the faces of its chunk in shared
+    batches. Stream frames are handled in this process by a FaceTracker per
+    stream id, which only encodes new faces; frames of one stream are
+    processed in order, and the trackers of all streams share one
+    MicroBatchEncoder, so concurrent streams are encoded together.
+    """
+
+    def __init__(self, gallery_file=GALLERY_FILE, workers=1, scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                 ann=False, nprobe=DEFAULT_NPROBE, detect_every=5, watch=True, batch_size=DEFAULT_BATCH_SIZE,
+                 deadline_ms=DEFAULT_DEADLINE_MS):
+        # Every process watches the gallery file, so a retrained gallery reaches all of them
+        self.gallery = load_service_gallery(gallery_file, ann, nprobe, watch)
+        self.workers = workers
+        self.scale = scale
+        self.tolerance = tolerance
+        self.detect_every = detect_every
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                        initargs=(gallery_file, ann, nprobe, scale, tolerance, watch, batch_size))
+        self.encoder = MicroBatchEncoder(batch_size, deadline_ms)
+        self.streams = {}
+        self._streams_lock = threading.Lock()
+        self.started_at = time.time()
+
+    def warm_up(self):
+        """Start every worker and load its models before the first request arrives"""
+        pids = set(self.pool.map(warm_up, range(self.workers)))
+        warm_up()
+        return len(pids)
+
+    def recognise(self, data):
+        return self.pool.submit(recognise_bytes, data).result()
+
+    def recognise_batch(self, images):
+        if not images:
+            return []
+        chunk = -(-len(images) // self.workers)
+        chunks = [images[i:i + chunk] for i in range(0, len(images), chunk)]
+        return [result for results in self.pool.map(recognise_images, chunks) for result in results]
+
+    def stream_frame(self, stream_id, data):
+        """(status, response) with the faces in the next frame of a client stream, with persistent track ids"""
+        timing = {}
+        try:
+            image = read_image(data, self.scale, timing)
+        except ImageError as e:
+            return failure(e, timing)
+
+        session = self._session(stream_id)
+        with session.lock:
+            start = time.perf_counter()
+            session.tracker.process(image)
+            session.frames += 1
+            timing['track_ms'] = round(1000.0 * (time.perf_counter() - start), 3)
+            tracks = [{'track': track.id, 'box': list(track.int_box()), 'name': track.name,
+                       'confidence': round(track.match_confidence if track.name != "Unknown" else 0.0, 4)}
+                      for track in session.tracker.tracks]
+            timing['encoded_faces'] = len(session.tracker.newly_identified)
+        return 200, {'faces': tracks, 'timing': timing}
+
+    def _session(self, stream_id):
+        now = time.time()
+        with self._streams_lock:
+            for key in [k for k, s in self.streams.items() if now - s.last_used > STREAM_IDLE_SECONDS]:
+                del self.streams[key]
+            session = self.streams.get(stream_id)
+            if session is None:
+                session = StreamSession(self.gallery, self.detect_every, self.scale, self.tolerance, self.encoder)
+                self.streams[stream_id] = session
+            session.last_used = now
+            return session
+
+    def end_stream(self, stream_id):
+        with self._streams_lock:
+            return self.streams.pop(stream_id, None) is not None
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.workers, 'people': len(self.gallery.identities),
+                'encodings': len(self.gallery), 'streams': len(self.streams),
+                'stream_encoder': {'faces': self.encoder.faces_encoded, 'batches': self.encoder.batches_run},
+                'uptime_s': round(time.time() - self.started_at, 1)}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.encoder.close()
+
+
+def make_handler(service):
+    class RecognitionHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps connections open between requests; every response sets Content-Length
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/health':
+                self._send_json(200, service.health())
+            elif path == '/metrics':
+                self._send(200, METRICS.render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            start = time.perf_counter()
+            path = self.path.split('?')[0]
+            body = self._read_body()
+            if body is None:
+                return
+            try:
+                self._post(path, body, start)
+            except Exception as e:
+                # e.g. a worker process died; answer rather than dropping the connection
+                print(f"[ERROR] {path}: {type(e).__name__}: {e}")
+                self._send_json(500, {'error': f"{type(e).__name__}: {e}"}, start)
+
+        def _post(self, path, body, start):
+            if path == '/recognize':
+                self._send_json(*service.recognise(body), start)
+            elif path == '/recognize/batch':
+                try:
+                    images = [base64.b64decode(image) for image in json.loads(body)['images']]
+                except (ValueError, KeyError, TypeError):
+                    self._send_json(400, {'error': 'expected JSON {"images": [base64, ...]}'}, start)
+                    return
+                # Each result carries its own status, so one bad image does not fail the batch
+                results = [dict(response, status=status) for status, response in service.recognise_batch(images)]
+                self._send_json(200, {'results': results}, start)
+            elif path.startswith('/streams/') and len(path) > len('/streams/'):
+                self._send_json(*service.stream_frame(path[len('/streams/'):], body), start)
+            else:
+                self._send_json(404, {'error': 'not found'}, start)
+
+        def do_DELETE(self):
+            path = self.path.split('?')[0]
+            if path.startswith('/streams/') and service.end_stream(path[len('/streams/'):]):
+                self._send_json(200, {'status': 'ended'})
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def _read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length <= 0:
+                self._send_json(411, {'error': 'Content-Length required'})
+                return None
+            if length > MAX_BODY_BYTES:
+                # The body is not read, so this connection cannot be reused
+                self.close_connection = True
+                self._send_json(413, {'error': f'body larger than {MAX_BODY_BYTES} bytes'})
+                return None
+            return self.rfile.read(length)
+
+        def _send_json(self, status, payload, start=None):
+            if start is not None:
+                elapsed = time.perf_counter() - start
+                payload['timing_total_ms'] = round(1000.0 * elapsed, 3)
+                METRICS.histogram('request_seconds', 'Recognition service request latency',
+                                  path=self.path.split('?')[0].split('/')[1]).observe(elapsed)
+            self._send(status, json.dumps(payload).encode('utf-8'), 'application/json', start)
+
+        def _send(self, status, body, content_type, start=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if start is not None:
+                self.send_header('Server-Timing', f'total;dur={1000.0 * (time.perf_counter() - start):.1f}')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RecognitionHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local face recognition service with warm models")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=0, help="worker processes (0 = one per CPU core)")
+    parser.add_argument('--scale', type=float, default=DETECTION_SCALE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--ann', action='store_true', help="match with the approximate nearest-neighbour index")
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE)
+    parser.add_argument('--detect-every', type=int, default=5, help="frames between detections on /streams")
+    parser.add_argument('--watch', action=argparse.BooleanOptionalAction, default=True,
+                        help="reload the gallery in the background when the file is rewritten")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="most faces per encoder call (batches and concurrent streams)")
+    parser.add_argument('--batch-deadline-ms', type=float, default=DEFAULT_DEADLINE_MS,
+                        help="longest a stream frame waits for other streams' faces to fill a batch")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gallery):
+        print(f"[ERROR] {args.gallery} not found! Please run train_model_improved.py first.")
+        return
+
+    METRICS.enabled = True
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    start = time.time()
+    service = RecognitionService(args.gallery, workers, args.scale, args.tolerance, args.ann, args.nprobe,
+                                 args.detect_every, args.watch, args.batch_size, args.batch_deadline_ms)
+    service.warm_up()
+    print(f"[INFO] {workers} workers ready in {time.time() - start:.1f}s, "
+          f"{len(service.gallery.identities)} people in the gallery")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"[INFO] Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Shutting down")
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from batch_encoder import encode_faces
+from frame_processing import DETECTION_SCALE, FrameBuffers, detect_faces, scale_locations
+from metrics import METRICS
+from model_loader import warm_up_inference
+
+SLOTS_PER_WORKER = 2  # Frames in flight per worker: one being processed and one waiting, so no worker idles
+
+
+class SharedFrameRing:
+    """Frame slots of one shape in a single shared memory block
+
+    The process that creates the ring copies each frame into a free slot;
+    worker processes attach to it by name and read the slot in place, so
+    frames are never pickled. Only the creator unlinks the block.
+    """
+
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.owner = name is None
+        size = slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.name = self.shm.name
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def close(self):
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A view is still alive somewhere; the mapping goes when the process exits
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker_main(tasks, results, warm_up):
+    """Worker process: detect and encode faces in ring slots until a None task arrives"""
+    # Ctrl-C reaches the whole process group; the parent stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if warm_up:
+        warm_up_inference()
+    ring = None
+    buffers = FrameBuffers()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, ring_name, slots, shape, slot, scale = task
+        start = time.perf_counter()
+        try:
+            if ring is None or ring.name != ring_name:
+                if ring is not None:
+                    ring.close()
+                ring = SharedFrameRing(slots, shape, ring_name)
+            rgb_small_frame = buffers.prepare(ring.frames[slot], scale)
+            face_locations = detect_faces(rgb_small_frame)
+            encodings = np.array(encode_faces(rgb_small_frame, face_locations), dtype=np.float32)
+            results.put((seq, slot, scale_locations(face_locations, 1 / scale), encodings,
+                         time.perf_counter() - start, None))
+        except Exception as e:
+            results.put((seq, slot, [], None, time.perf_counter() - start, f"{type(e).__name__}: {e}"))
+    if ring is not None:
+        ring.close()
+
+
+class ShmWorkerPool:
+    """Detection and encoding worker processes fed through a shared-memory frame ring
+
+    Threads cannot spread HOG detection and the encoder's Python-side work
+    over several cores, and pickling whole frames to a process pool costs
+    about as much as it saves. Here a frame is copied once into a ring slot,
+    the task sent to the workers is a few integers, and a worker returns
+    only the face boxes (in full-frame coordinates) and their encodings.
+    Matching against the gallery stays in this process, so live gallery
+    reloads and enrolment work as before.
+
+    Workers are spawned rather than forked, since the parent already runs
+    capture and watcher threads. They load the models (and run the warm-up
+    inference) while the camera opens. The ring is created for the first
+    frame's size and has SLOTS_PER_WORKER slots per worker.
+    """
+
+    def __init__(self, workers, scale=DETECTION_SCALE, warm_up=True):
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.scale = scale
+        self.slots = workers * SLOTS_PER_WORKER
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=_worker_main, args=(self.tasks, self.results, warm_up),
+                                          name=f"shm-worker-{i}", daemon=True) for i in range(workers)]
+        for process in self.processes:
+            process.start()
+        self.ring = None
+        self.errors = 0
+        self._free = deque(range(self.slots))
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def wait_for_slot(self, timeout=None):
+        """True once a ring slot is free"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._free or self._closed, timeout) and not self._closed
+
+    def submit(self, seq, image):
+        """Copy a BGR frame into a free slot and queue it for the workers; returns the slot"""
+        with self._cond:
+            if self.ring is None or self.ring.shape != image.shape:
+                # A new frame size gets a new ring once no frame of the old size is in flight
+                self._cond.wait_for(lambda: len(self._free) == self.slots or self._closed)
+                if not self._closed:
+                    if self.ring is not None:
+                        self.ring.close()
+                    self.ring = SharedFrameRing(self.slots, image.shape)
+            self._cond.wait_for(lambda: self._free or self._closed)
+            if self._closed:
+                raise RuntimeError("the worker pool is closed")
+            slot = self._free.popleft()
+            # Copied under the lock, so close() cannot unmap the ring mid-copy
+            with METRICS.time('shm_copy'):
+                np.copyto(self.ring.frames[slot], image)
+        self.tasks.put((seq, self.ring.name, self.slots, self.ring.shape, slot, self.scale))
+        return slot
+
+    def frame(self, slot):
+        if self._closed:
+            raise RuntimeError("the worker pool is closed")
+        return self.ring.frames[slot]
+
+    def release(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def get_result(self, timeout=0.1):
+        """(seq, slot, face_locations, encodings, seconds, error) of a finished frame, or None on timeout
+
+        Raises RuntimeError if a worker process died.
+        """
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            for process in self.processes:
+                if not process.is_alive() and not self._closed:
+                    raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
+            return None
+
+    def in_flight(self):
+        return self.slots - len(self._free)
+
+    def status(self):
+        return f"Workers: {self.workers} processes | In flight: {self.in_flight()}/{self.slots}"
+
+    def inference_worker(self, frames, results, finish_frame):
+        """A RecognitionPipeline inference stage that runs on this pool (pass as make_worker)"""
+        return ShmInferenceWorker(self, frames, results, finish_frame)
+
+    def close(self, timeout=2.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for q in (self.tasks, self.results):
+            q.cancel_join_thread()
+            q.close()
+        if self.ring is not None:
+            self.ring.close()
+
+
+class ShmInferenceWorker(threading.Thread):
+    """Keeps every worker of a ShmWorkerPool busy and publishes results in capture order
+
+    A dispatcher thread hands the newest frame to the pool whenever a ring
+    slot is free. This thread collects results, which may finish out of
+    order, and publishes them in the order the frames were captured, so
+    labels never jump back to an older frame. finish_frame(image,
+    face_locations, face_encodings) turns each result into faces (matching
+    them against the gallery) before the slot is reused.
+    """
+
+    def __init__(self, pool, frames, results, finish_frame):
+        super().__init__(name="shm-collector", daemon=True)
+        self.pool = pool
+        self.frames = frames
+        self.results = results
+        self.finish_frame = finish_frame
+        self.frames_processed = 0
+        self.error = None
+        self._pending = deque()  # Frames handed to the pool, in capture order
+        self._lock = threading.Lock()
+        self._dispatched_all = threading.Event()
+        self._stop_event = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="shm-dispatch", daemon=True)
+
+    def start(self):
+        super().start()
+        self._dispatcher.start()
+
+    def _dispatch(self):
+        try:
+            while not self._stop_event.is_set():
+                # Wait for a slot before taking a frame, so the frame sent is the newest one
+                if not self.pool.wait_for_slot(timeout=0.1):
+                    continue
+                frame = self.frames.get(timeout=0.1)
+                if frame is None:
+                    if self.frames.closed:
+                        break
+                    continue
+                with self._lock:
+                    self._pending.append(frame)
+                self.pool.submit(frame.seq, frame.image)
+        except Exception as e:
+            self.error = e
+            self._stop_event.set()
+        finally:
+            self._dispatched_all.set()
+
+    def run(self):
+        done = {}  # seq -> (slot, face_locations, encodings, error)
+        try:
+            while not self._stop_event.is_set():
+                with self._lock:
+                    if self._dispatched_all.is_set() and not self._pending:
+                        break
+                result = self.pool.get_result(timeout=0.1)
+                if result is None:
+                    continue
+                seq, slot, face_locations, encodings, seconds, error = result
+                METRICS.histogram('shm_worker_seconds', 'Detection and encoding time in a worker process').observe(
+                    seconds)
+                done[seq] = (slot, face_locations, encodings, error)
+                self._publish_in_order(done)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._stop_event.set()
+            self._dispatcher.join()
+            self.results.close()
+
+    def _publish_in_order(self, done):
+        while True:
+            with self._lock:
+                if not self._pending or self._pending[0].seq not in done:
+                    return
+                frame = self._pending.popleft()
+            slot, face_locations, encodings, error = done.pop(frame.seq)
+            try:
+                if error is not None:
+                    if self.pool.errors == 0:
+                        print(f"[WARNING] Worker failed on frame {frame.seq}: {error}")
+                    self.pool.errors += 1
+                    continue
+                faces = self.finish_frame(self.pool.frame(slot), face_locations, encodings)
+            finally:
+                self.pool.release(slot)
+            self.frames_processed += 1
+            METRICS.counter('frames_processed_total', 'Frames run through detection').inc()
+            self.results.put((frame.seq, frame.captured_at, faces))
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,87 @@
+import argparse
+import tracemalloc
+import cv2
+import numpy as np
+from frame_processing import DETECTION_SCALE, FrameBuffers, prepare_frame, draw_face_results
+from motion_gate import MotionGate
+from face_recognition_stable import pause_frame
+
+# Allocation per frame is measured as the traced peak during the frame minus
+# the traced memory before it, so short-lived temporaries count in full.
+# numpy and OpenCV output arrays are allocated through numpy and are traced.
+# What remains with the buffers is small result objects (contours, boxes,
+# strings) that grow with the number of faces, not with the frame size.
+
+
+def make_frames(count, width, height):
+    """Synthetic BGR frames with a square moving across a noisy background"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = 40 + 20 * i
+        cv2.rectangle(frame, (x, 120), (x + 120, 280), (200, 180, 160), -1)
+        frames.append(frame)
+    return frames
+
+
+def bytes_per_frame(step, frames, warmup, iterations):
+    """Mean and worst bytes allocated by one call of step(frame) after warm-up"""
+    for i in range(warmup):
+        step(frames[i % len(frames)])
+    tracemalloc.start()
+    samples = []
+    for i in range(iterations):
+        frame = frames[i % len(frames)]
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        step(frame)
+        samples.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return sum(samples) / len(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the frame hot loop allocates (almost) nothing per frame")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--max-bytes', type=int, default=4096, help="allowed mean allocation per frame")
+    args = parser.parse_args()
+
+    frames = make_frames(8, args.width, args.height)
+    buffers = FrameBuffers()
+    display = np.empty_like(frames[0])
+    faces = [((120, 160, 280, 40), "Example", 0.8), ((100, 500, 200, 400), "Unknown", 0.0)]
+
+    def overlay(frame):
+        np.copyto(display, frame)
+        draw_face_results(display, faces)
+
+    checks = [
+        ("prepare_frame (reused buffers)", lambda frame: buffers.prepare(frame, DETECTION_SCALE), True),
+        ("motion gate (diff)", MotionGate('diff').regions, True),
+        ("motion gate (mog2)", MotionGate('mog2').regions, True),
+        ("display copy + overlay", overlay, True),
+        ("pause screen", lambda frame: pause_frame(*frame.shape[:2]), True),
+        # For comparison only: the same work without the buffers
+        ("prepare_frame (new arrays)", lambda frame: prepare_frame(frame, DETECTION_SCALE), False),
+    ]
+
+    print(f"[INFO] {args.iterations} frames of {args.width}x{args.height} per check")
+    failed = False
+    for name, step, checked in checks:
+        mean, worst = bytes_per_frame(step, frames, warmup=30, iterations=args.iterations)
+        result = "" if not checked else ("ok" if mean <= args.max_bytes else "TOO MANY")
+        print(f"{name:<34}{mean:>12.0f} B/frame{worst:>12} B max  {result}")
+        failed = failed or (checked and mean > args.max_bytes)
+
+    if failed:
+        print(f"[ERROR] Some steps allocate more than {args.max_bytes} bytes per frame")
+        exit(1)
+    print("[INFO] Steady-state allocation per frame is within the limit")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
-import face_recognition
 import os
-import pickle
+from face_gallery import FaceGallery, GALLERY_FILE, gallery_lock, save_gallery
+from encoding_cache import EncodingCache, CACHE_FILE, ENCODING_CONFIG
+from training_images import NO_FACE, encode_face
 
 DATASET_DIR = 'dataset'
-ENCODINGS_FILE = 'known_faces.pkl'
+ENCODINGS_FILE = GALLERY_FILE
+ANN_INDEX_FILE = 'known_faces.ivf.npz'
 
 known_encodings = []
 known_names = []
+image_paths = []
+cache = EncodingCache(CACHE_FILE)
 
 print("[INFO] Starting training...")
 
@@ -18,19 +22,47 @@ for person_name in os.listdir(DATASET_DIR):
     
     for image_name in os.listdir(person_dir):
         image_path = os.path.join(person_dir, image_name)
-        print(f"[INFO] Processing {image_path}")
+        image_paths.append(image_path)
 
-        image = face_recognition.load_image_file(image_path)
-        encodings = face_recognition.face_encodings(image)
+        # Reuse the encoding if this exact image content was encoded before
+        digest = cache.digest(image_path)
+        cached = cache.get(digest)
+        if cached is not None:
+            encoding = cached[0]
+        else:
+            print(f"[INFO] Processing {image_path}")
+            # Detection is skipped when the face box and landmarks are already cached
+            cached_detection = cache.get_detection(digest)
+            if cached_detection is not None and cached_detection[0] is None:
+                encoding, error = None, cached_detection[1]
+            else:
+                encoding, error, detection = encode_face(image_path, cached_detection and cached_detection[0])
+                if cached_detection is None and (detection is not None or error == NO_FACE):
+                    cache.put_detection(digest, detection, error)
+            # Read/decode errors may be transient, so only definite results are cached
+            if encoding is not None or error == NO_FACE:
+                cache.put(digest, encoding, error)
+            else:
+                print(f"[WARNING] Could not encode {image_name}: {error}")
+                continue
 
-        if len(encodings) > 0:
-            known_encodings.append(encodings[0])
+        if encoding is not None:
+            known_encodings.append(encoding)
             known_names.append(person_name)
         else:
             print(f"[WARNING] No face found in {image_name}")
 
+# Forget images that were removed from the dataset
+cache.prune(image_paths)
+cache.close()
+
 # Save encodings
-with open(ENCODINGS_FILE, 'wb') as f:
-    pickle.dump((known_encodings, known_names), f)
+with gallery_lock(ENCODINGS_FILE):
+    save_gallery(FaceGallery(known_encodings, known_names, model=ENCODING_CONFIG), ENCODINGS_FILE)
+
+# A stale index would no longer line up with the new encodings
+if os.path.exists(ANN_INDEX_FILE):
+    os.remove(ANN_INDEX_FILE)
+    print(f"[INFO] Removed stale index {ANN_INDEX_FILE}")
 
 print("[INFO] Training completed. Encodings saved.")
@@ -1,129 +1,317 @@
-import face_recognition
 import os
-import pickle
+import time
+import argparse
 import numpy as np
+from multiprocessing import Pool
+from face_gallery import FaceGallery, GALLERY_FILE, gallery_lock, save_gallery
+from ivf_index import IVFIndex
+from gallery_prototypes import select_prototypes, time_matching, RECALL_MARGIN, MAX_PROTOTYPES
+from encoding_cache import EncodingCache, CACHE_FILE, encoding_config, detection_config
+from training_images import DETECT_SIZE, NO_FACE, encode_face
 
 DATASET_DIR = 'dataset'
-ENCODINGS_FILE = 'known_faces.pkl'
+ENCODINGS_FILE = GALLERY_FILE
+ANN_INDEX_FILE = 'known_faces.ivf.npz'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PROGRESS_EVERY = 50  # Print progress every N images
 
-def train_faces_single_encoding_per_person():
-    """Create a single averaged encoding per person"""
-    print("[INFO] Training with single encoding per person...")
-    
-    known_encodings = []
-    known_names = []
-    
+def list_dataset_images():
+    """List (person_name, image_path) pairs in dataset order"""
+    images = []
     for person_name in os.listdir(DATASET_DIR):
         person_dir = os.path.join(DATASET_DIR, person_name)
-        
+
         if not os.path.isdir(person_dir):
             continue
-        
-        print(f"[INFO] Processing person: {person_name}")
-        person_encodings = []
-        
+
         for image_name in os.listdir(person_dir):
-            if not image_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            if image_name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((person_name, os.path.join(person_dir, image_name)))
+    return images
+
+def encode_image(task):
+    """Encode the first face in an image, returning (encoding, error, detection)
+
+    task is (image_path, cached detection or None, jitters, detect_size).
+    """
+    image_path, detection, jitters, detect_size = task
+    return encode_face(image_path, detection, jitters, detect_size)
+
+def encode_images(image_paths, workers=1, chunksize=8, cache=None, jitters=1, detect_size=DETECT_SIZE):
+    """Encode images serially or on a process pool, keeping input order
+
+    Each pool worker imports face_recognition (and so loads the dlib models)
+    once, then receives images in chunks. Results come back in input order, so
+    the encodings are identical to a serial run. Failures are collected and
+    returned as (image_path, reason) pairs instead of being printed inline.
+
+    With a cache, only images whose content is not already cached are encoded,
+    and images whose face box and landmarks are cached skip detection.
+    """
+    encodings = [None] * len(image_paths)
+    errors = [None] * len(image_paths)
+    detections = {}
+
+    pending = list(range(len(image_paths)))
+    digests = {}
+    if cache is not None:
+        pending = []
+        for i, image_path in enumerate(image_paths):
+            digests[i] = cache.digest(image_path)
+            cached = cache.get(digests[i])
+            if cached is not None:
+                encodings[i], errors[i] = cached
                 continue
-                
-            image_path = os.path.join(person_dir, image_name)
-            print(f"  - Processing {image_name}")
-            
-            try:
-                image = face_recognition.load_image_file(image_path)
-                encodings = face_recognition.face_encodings(image)
-                
-                if len(encodings) > 0:
-                    person_encodings.append(encodings[0])
-                    print(f"    ✓ Face encoding extracted")
-                else:
-                    print(f"    ✗ No face found in {image_name}")
-            except Exception as e:
-                print(f"    ✗ Error processing {image_name}: {e}")
-        
-        if person_encodings:
+            cached_detection = cache.get_detection(digests[i])
+            if cached_detection is not None and cached_detection[0] is None:
+                # Detection already found no face; no need to look again
+                errors[i] = cached_detection[1]
+                cache.put(digests[i], None, errors[i])
+                continue
+            if cached_detection is not None:
+                detections[i] = cached_detection[0]
+            pending.append(i)
+        print(f"[INFO] {len(image_paths) - len(pending)} images cached, {len(pending)} to encode "
+              f"({len(detections)} of them with cached face boxes)")
+
+    total = len(pending)
+    tasks = [(image_paths[i], detections.get(i), jitters, detect_size) for i in pending]
+    start_time = time.time()
+
+    if workers > 1 and total > 1:
+        pool = Pool(processes=min(workers, total))
+        results = pool.imap(encode_image, tasks, chunksize=chunksize)
+    else:
+        pool = None
+        results = map(encode_image, tasks)
+
+    try:
+        for done, (i, (encoding, error, detection)) in enumerate(zip(pending, results), start=1):
+            encodings[i], errors[i] = encoding, error
+            # Read/decode errors may be transient, so only definite results are cached
+            if cache is not None and (encoding is not None or error == NO_FACE):
+                cache.put(digests[i], encoding, error)
+                if i not in detections:
+                    cache.put_detection(digests[i], detection, error)
+
+            if done % PROGRESS_EVERY == 0 or done == total:
+                elapsed = time.time() - start_time
+                print(f"[INFO] Encoded {done}/{total} images ({done / elapsed:.1f} images/s)")
+                if cache is not None:
+                    cache.commit()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        removed_files, _ = cache.prune(image_paths)
+        if removed_files:
+            print(f"[INFO] Dropped {removed_files} deleted images from the cache")
+        cache.commit()
+
+    failures = [(image_paths[i], error) for i, error in enumerate(errors) if error is not None]
+    return encodings, failures
+
+def report_failures(failures):
+    """Print the images that could not be encoded"""
+    if not failures:
+        return
+    print(f"[WARNING] {len(failures)} images produced no encoding:")
+    for image_path, reason in failures:
+        print(f"    ✗ {image_path}: {reason}")
+
+def train_faces_single_encoding_per_person(workers=1, cache=None, jitters=1, detect_size=DETECT_SIZE):
+    """Create a single averaged encoding per person"""
+    print("[INFO] Training with single encoding per person...")
+
+    images = list_dataset_images()
+    encodings, failures = encode_images([path for _, path in images], workers=workers, cache=cache,
+                                        jitters=jitters, detect_size=detect_size)
+    report_failures(failures)
+
+    # Group encodings per person, keeping the order people were first seen in
+    person_encodings = {}
+    for (person_name, _), encoding in zip(images, encodings):
+        person_encodings.setdefault(person_name, [])
+        if encoding is not None:
+            person_encodings[person_name].append(encoding)
+
+    known_encodings = []
+    known_names = []
+
+    for person_name, encodings_for_person in person_encodings.items():
+        if encodings_for_person:
             # Average all encodings for this person
-            average_encoding = np.mean(person_encodings, axis=0)
+            average_encoding = np.mean(encodings_for_person, axis=0)
             known_encodings.append(average_encoding)
             known_names.append(person_name)
-            print(f"  → Created averaged encoding from {len(person_encodings)} images")
+            print(f"  → {person_name}: averaged encoding from {len(encodings_for_person)} images")
         else:
             print(f"  → No valid face encodings found for {person_name}")
-    
+
     return known_encodings, known_names
 
-def train_faces_multiple_encodings_per_person():
+def train_faces_multiple_encodings_per_person(workers=1, cache=None, jitters=1, detect_size=DETECT_SIZE):
     """Keep multiple encodings per person (original method)"""
     print("[INFO] Training with multiple encodings per person...")
-    
+
+    images = list_dataset_images()
+    encodings, failures = encode_images([path for _, path in images], workers=workers, cache=cache,
+                                        jitters=jitters, detect_size=detect_size)
+    report_failures(failures)
+
     known_encodings = []
     known_names = []
-    
-    for person_name in os.listdir(DATASET_DIR):
-        person_dir = os.path.join(DATASET_DIR, person_name)
-        
-        if not os.path.isdir(person_dir):
-            continue
-        
-        print(f"[INFO] Processing person: {person_name}")
-        person_count = 0
-        
-        for image_name in os.listdir(person_dir):
-            if not image_name.lower().endswith(('.jpg', '.jpeg', '.png')):
-                continue
-                
-            image_path = os.path.join(person_dir, image_name)
-            print(f"  - Processing {image_name}")
-            
-            try:
-                image = face_recognition.load_image_file(image_path)
-                encodings = face_recognition.face_encodings(image)
-                
-                if len(encodings) > 0:
-                    known_encodings.append(encodings[0])
-                    known_names.append(person_name)
-                    person_count += 1
-                    print(f"    ✓ Face encoding extracted")
-                else:
-                    print(f"    ✗ No face found in {image_name}")
-            except Exception as e:
-                print(f"    ✗ Error processing {image_name}: {e}")
-        
+    person_counts = {}
+
+    for (person_name, _), encoding in zip(images, encodings):
+        person_counts.setdefault(person_name, 0)
+        if encoding is not None:
+            known_encodings.append(encoding)
+            known_names.append(person_name)
+            person_counts[person_name] += 1
+
+    for person_name, person_count in person_counts.items():
         print(f"  → Created {person_count} encodings for {person_name}")
-    
+
     return known_encodings, known_names
 
-def main():
+def train_faces_prototypes(workers=1, cache=None, jitters=1, detect_size=DETECT_SIZE,
+                           margin=RECALL_MARGIN, max_prototypes=MAX_PROTOTYPES):
+    """Keep a few representative encodings (k-medoids) per person"""
+    print("[INFO] Training with representative prototypes per person...")
+
+    images = list_dataset_images()
+    encodings, failures = encode_images([path for _, path in images], workers=workers, cache=cache,
+                                        jitters=jitters, detect_size=detect_size)
+    report_failures(failures)
+
+    person_encodings = {}
+    for (person_name, _), encoding in zip(images, encodings):
+        if encoding is not None:
+            person_encodings.setdefault(person_name, []).append(encoding)
+    if not person_encodings:
+        return [], []
+
+    known_encodings, known_names, report = select_prototypes(person_encodings, margin=margin,
+                                                             max_prototypes=max_prototypes)
+    for person_name, person in person_encodings.items():
+        print(f"  → {person_name}: {report['k'][person_name]} prototypes from {len(person)} encodings")
+
+    # Compare with keeping every encoding: size, held-out recall and matching time
+    all_encodings = [e for person in person_encodings.values() for e in person]
+    all_names = [name for name, person in person_encodings.items() for _ in person]
+    full_gallery = FaceGallery(all_encodings, all_names)
+    prototype_gallery = FaceGallery(known_encodings, known_names)
+    full_time = time_matching(full_gallery, all_encodings)
+    prototype_time = time_matching(prototype_gallery, all_encodings)
+    print(f"[INFO] Compression: {len(all_encodings)} → {len(known_encodings)} encodings "
+          f"({len(all_encodings) / len(known_encodings):.1f}x smaller)")
+    print(f"[INFO] Held-out recall ({report['held_out']} images): all encodings {report['full_recall']:.3f}, "
+          f"prototypes {report['prototype_recall']:.3f}")
+    print(f"[INFO] Matching: {1e6 * full_time:.1f} → {1e6 * prototype_time:.1f} µs per face "
+          f"({full_time / prototype_time:.1f}x faster)")
+
+    return known_encodings, known_names
+
+def build_ann_index(gallery):
+    """Build an inverted-file index over the gallery and save it next to the encodings"""
+    print("[INFO] Building approximate nearest-neighbour index...")
+    index = IVFIndex.build(gallery.matrix)
+    index.save(ANN_INDEX_FILE)
+    print(f"- Index lists: {index.n_lists}")
+    print(f"- Index saved to: {ANN_INDEX_FILE}")
+
+def parse_args():
+    """Parse command line options (anything not given is asked interactively)"""
+    parser = argparse.ArgumentParser(description="Train face encodings from the dataset folder")
+    parser.add_argument('--method', choices=['single', 'multiple', 'prototypes'],
+                        help="single averaged encoding, multiple encodings, or a few representative "
+                             "encodings per person")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="encoding processes (0 = one per CPU core, 1 = serial)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"re-encode every image instead of using {CACHE_FILE}")
+    parser.add_argument('--jitters', type=int, default=1,
+                        help="re-sample each face this many times when encoding (slower, slightly more accurate)")
+    parser.add_argument('--detect-size', type=int, default=DETECT_SIZE,
+                        help="decode images for detection at a reduced size with at least this long side")
+    parser.add_argument('--recall-margin', type=float, default=RECALL_MARGIN,
+                        help="prototypes: allowed held-out recall loss compared with keeping every encoding")
+    parser.add_argument('--max-prototypes', type=int, default=MAX_PROTOTYPES,
+                        help="prototypes: most encodings kept per person")
+    parser.add_argument('--ann', action=argparse.BooleanOptionalAction, default=None,
+                        help="build the approximate nearest-neighbour index")
+    return parser.parse_args()
+
+def main(args):
     print("Face Recognition Training Script")
     print("=" * 40)
-    print("Choose training method:")
-    print("1. Single averaged encoding per person (recommended)")
-    print("2. Multiple encodings per person (original)")
-    
-    while True:
-        choice = input("Enter your choice (1 or 2): ").strip()
-        if choice in ['1', '2']:
-            break
-        print("Please enter 1 or 2")
-    
-    if choice == '1':
-        known_encodings, known_names = train_faces_single_encoding_per_person()
+
+    if args.method is None:
+        print("Choose training method:")
+        print("1. Single averaged encoding per person (recommended)")
+        print("2. Multiple encodings per person (original)")
+        print("3. A few representative encodings per person (compact)")
+
+        while True:
+            choice = input("Enter your choice (1, 2 or 3): ").strip()
+            if choice in ['1', '2', '3']:
+                break
+            print("Please enter 1, 2 or 3")
     else:
-        known_encodings, known_names = train_faces_multiple_encodings_per_person()
-    
+        choice = {'single': '1', 'multiple': '2', 'prototypes': '3'}[args.method]
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    if workers > 1:
+        print(f"[INFO] Encoding with {workers} worker processes")
+
+    # Only new or changed images are encoded; everything else comes from the cache
+    config = encoding_config(args.jitters, args.detect_size)
+    cache = None
+    if not args.no_cache:
+        cache = EncodingCache(CACHE_FILE, config, detection_config(args.detect_size))
+
+    try:
+        if choice == '1':
+            known_encodings, known_names = train_faces_single_encoding_per_person(
+                workers, cache, args.jitters, args.detect_size)
+        elif choice == '2':
+            known_encodings, known_names = train_faces_multiple_encodings_per_person(
+                workers, cache, args.jitters, args.detect_size)
+        else:
+            known_encodings, known_names = train_faces_prototypes(
+                workers, cache, args.jitters, args.detect_size, args.recall_margin, args.max_prototypes)
+    finally:
+        if cache is not None:
+            cache.close()
+
     if not known_encodings:
         print("[ERROR] No face encodings were created!")
         return
-    
-    # Save encodings
-    with open(ENCODINGS_FILE, 'wb') as f:
-        pickle.dump((known_encodings, known_names), f)
-    
+
+    # Save encodings as a float32 gallery that recognition processes memory-map
+    gallery = FaceGallery(known_encodings, known_names, model=config)
+    with gallery_lock(ENCODINGS_FILE):
+        save_gallery(gallery, ENCODINGS_FILE)
+
     print(f"\n[SUCCESS] Training completed!")
     print(f"- Total encodings: {len(known_encodings)}")
     print(f"- Unique people: {len(set(known_names))}")
     print(f"- People: {list(set(known_names))}")
     print(f"- Encodings saved to: {ENCODINGS_FILE}")
 
+    # Optional approximate nearest-neighbour index for very large galleries
+    build_index = args.ann
+    if build_index is None:
+        build_index = input("Build approximate nearest-neighbour index? (y/N): ").strip().lower() == 'y'
+    if build_index:
+        build_ann_index(gallery)
+    elif os.path.exists(ANN_INDEX_FILE):
+        # A stale index would no longer line up with the new encodings
+        os.remove(ANN_INDEX_FILE)
+        print(f"[INFO] Removed stale index {ANN_INDEX_FILE}")
+
 if __name__ == "__main__":
-    main()
+    main(parse_args())
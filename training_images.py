@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+from model_loader import dlib, face_recognition, face_recognition_api
+
+DETECT_SIZE = 480   # Training images are decoded at the largest reduction that keeps the long side this big
+CROP_PADDING = 0.5  # Margin kept around the face box for landmarks and encoding, as a fraction of its size
+NO_FACE = "No face found"
+
+# JPEG decoders can scale by 1/2, 1/4 and 1/8 while decoding, which is much
+# cheaper than decoding at full size and resizing. Orientation is ignored, as
+# in face_recognition.load_image_file, so boxes match the full-size decode.
+_REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def image_size(path):
+    """(width, height) from the image header, without decoding the pixels"""
+    from PIL import Image
+    with Image.open(path) as image:
+        return image.size
+
+
+def reduction_for(size, detect_size=DETECT_SIZE):
+    """Largest decoder reduction (8, 4, 2 or 1) that keeps the long side at least detect_size"""
+    for factor in (8, 4, 2):
+        if max(size) // factor >= detect_size:
+            return factor
+    return 1
+
+
+def read_image(path, factor=1):
+    """BGR image decoded at 1/factor of its size"""
+    image = cv2.imread(path, _REDUCED_READ_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError(f"cannot decode {path}")
+    return image
+
+
+def detect_first_face(path, detect_size=DETECT_SIZE):
+    """Full-resolution (top, right, bottom, left) of the first face in an image, or None
+
+    HOG detection runs on a reduced decode. If that finds nothing, the image
+    is detected again at full resolution, so small faces are not lost.
+    """
+    width, height = image_size(path)
+    factor = reduction_for((width, height), detect_size)
+    while True:
+        small = cv2.cvtColor(read_image(path, factor), cv2.COLOR_BGR2RGB)
+        face_locations = face_recognition.face_locations(small, model="hog")
+        if face_locations:
+            top, right, bottom, left = face_locations[0]
+            return top * factor, min(right * factor, width), min(bottom * factor, height), left * factor
+        if factor == 1:
+            return None
+        factor = 1
+
+
+def face_crop(image, box, padding=CROP_PADDING):
+    """RGB crop of a BGR image around a face box, and the crop's (top, left) in the image"""
+    top, right, bottom, left = box
+    pad_y, pad_x = int((bottom - top) * padding), int((right - left) * padding)
+    crop_top, crop_left = max(top - pad_y, 0), max(left - pad_x, 0)
+    crop_bottom, crop_right = min(bottom + pad_y, image.shape[0]), min(right + pad_x, image.shape[1])
+    # Only the crop is converted to RGB, not the whole image
+    return cv2.cvtColor(image[crop_top:crop_bottom, crop_left:crop_right], cv2.COLOR_BGR2RGB), (crop_top, crop_left)
+
+
+def encode_face(path, detection=None, jitters=1, detect_size=DETECT_SIZE):
+    """Encode the first face of a training image, returning (encoding, error, detection)
+
+    detection is (box, landmarks): the face box and its 5 landmark points
+    in full-resolution pixels. These are the landmarks face_recognition and
+    batch_encoder align query faces with, so gallery and query encodings
+    come from faces aligned the same way. Passing a cached detection skips detection
+    and landmarking, so only the encoder runs. The encoding always comes from
+    a full-resolution crop.
+    """
+    try:
+        if detection is None:
+            box = detect_first_face(path, detect_size)
+            if box is None:
+                return None, NO_FACE, None
+            landmarks = None
+        else:
+            box, landmarks = detection
+
+        crop, (crop_top, crop_left) = face_crop(read_image(path), box)
+        top, right, bottom, left = box
+        if landmarks is None:
+            crop_box = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+            shape = face_recognition_api._raw_face_landmarks(crop, [crop_box], model="small")[0]
+            landmarks = np.array([(p.x + crop_left, p.y + crop_top) for p in shape.parts()], dtype=np.int32)
+        else:
+            shape = dlib.full_object_detection(
+                dlib.rectangle(left - crop_left, top - crop_top, right - crop_left, bottom - crop_top),
+                [dlib.point(int(x) - crop_left, int(y) - crop_top) for x, y in landmarks])
+
+        encoding = np.array(face_recognition_api.face_encoder.compute_face_descriptor(crop, shape, jitters))
+        return encoding, None, (tuple(int(v) for v in box), landmarks)
+    except Exception as e:
+        return None, str(e), None
@@ -0,0 +1,352 @@
+import json
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from output_sinks import SnapshotSink
+
+UNKNOWN_DIR = 'unknown_faces'
+CLUSTERS_FILE = 'clusters.npz'
+REMOVED_FILE = 'removed.jsonl'
+MAX_CLUSTERS = 256         # Clusters kept; the least-visited, longest-unseen cluster makes room for a new one
+JOIN_RADIUS = 0.5          # An unknown face joins the nearest cluster whose centroid is at most this far away
+MERGE_RADIUS = 0.4         # Two clusters whose centroids drift this close are merged
+CENTROID_WINDOW = 50       # The centroid is a running mean over about the last 50 faces
+SAMPLES_PER_CLUSTER = 16   # Member encodings kept per cluster (reservoir sample); these are what promotion enrols
+THUMBNAILS_PER_CLUSTER = 4
+THUMBNAIL_EVERY = 5.0      # Seconds between thumbnails of one cluster, so they show different moments
+VISIT_GAP = 60.0           # A sighting this long after the last one counts as a new visit
+SAVE_INTERVAL = 30.0       # Seconds between background saves
+
+
+def _crop_thumbnail(image, location, rgb=True, padding=0.3):
+    """BGR crop around a (top, right, bottom, left) face box of an RGB (or BGR) image"""
+    top, right, bottom, left = location
+    pad_y, pad_x = int((bottom - top) * padding), int((right - left) * padding)
+    crop = image[max(top - pad_y, 0):bottom + pad_y, max(left - pad_x, 0):right + pad_x]
+    if not crop.size:
+        return None
+    return cv2.cvtColor(crop, cv2.COLOR_RGB2BGR) if rgb else crop.copy()
+
+
+class UnknownFaceClusters:
+    """Groups the encodings of unknown faces into clusters, online and in bounded memory
+
+    Each new encoding is compared with every cluster centroid in one
+    vectorised call. It joins the nearest cluster within `radius`, or starts
+    a new one; when all `max_clusters` slots are taken, the cluster with the
+    fewest visits that was seen longest ago is evicted. A cluster keeps a
+    running-mean centroid, a reservoir sample of its member encodings and a
+    few thumbnail paths, so memory and the cost of add() depend on
+    max_clusters and never on how many faces have been seen. A cluster whose
+    centroid drifts within `merge_radius` of another is merged into it.
+
+    Thumbnails are written by a background SnapshotSink. save() writes the
+    clusters to `directory`, applies removals recorded by manage_unknowns.py
+    and deletes thumbnails that no cluster refers to any more. Only the
+    collecting process should sweep like this: a reviewer's copy does not
+    know the thumbnails written since the last save, so it saves with
+    delete_stale=False and deletes only the clusters it removed.
+    """
+
+    def __init__(self, directory=UNKNOWN_DIR, max_clusters=MAX_CLUSTERS, radius=JOIN_RADIUS,
+                 merge_radius=MERGE_RADIUS, samples=SAMPLES_PER_CLUSTER, thumbnails=THUMBNAILS_PER_CLUSTER,
+                 dim=128, write_thumbnails=True):
+        self.directory = directory
+        self.max_clusters = max_clusters
+        self.radius = radius
+        self.merge_radius = merge_radius
+        self.max_thumbnails = thumbnails
+        self.centroids = np.zeros((max_clusters, dim), dtype=np.float32)
+        self.samples = np.zeros((max_clusters, samples, dim), dtype=np.float32)
+        self.sample_counts = np.zeros(max_clusters, dtype=np.int32)
+        self.counts = np.zeros(max_clusters, dtype=np.int64)
+        self.visits = np.zeros(max_clusters, dtype=np.int64)
+        self.first_seen = np.zeros(max_clusters)
+        self.last_seen = np.zeros(max_clusters)
+        self.last_thumbnail = np.zeros(max_clusters)
+        self.ids = np.full(max_clusters, -1, dtype=np.int64)  # -1 marks a free slot
+        self.thumbnails = [[] for _ in range(max_clusters)]
+        self.next_id = 1
+        self.added = 0
+        self.evicted = 0
+        self._rng = np.random.default_rng()
+        self._lock = threading.Lock()
+        self._saver = None
+        self._stop_event = threading.Event()
+        self.writer = None
+        if write_thumbnails:
+            self.writer = SnapshotSink(directory, events=False, queue_size=32, name='unknown-thumbnails',
+                                       verbose=False)
+            self.writer.start()
+
+    def __len__(self):
+        return int((self.ids >= 0).sum())
+
+    def clusters(self):
+        """Slots of the current clusters, most visited first"""
+        slots = np.flatnonzero(self.ids >= 0)
+        return slots[np.lexsort((-self.counts[slots], -self.visits[slots]))]
+
+    def slot_of(self, cluster_id):
+        slots = np.flatnonzero(self.ids == cluster_id)
+        return int(slots[0]) if len(slots) else None
+
+    def add(self, encoding, image=None, location=None, now=None, rgb=True):
+        """Add the encoding of an unknown face; returns its cluster id
+
+        image (RGB, or BGR if rgb is False) and location (top, right, bottom,
+        left) are only used when the cluster wants another thumbnail.
+        """
+        now = time.time() if now is None else now
+        encoding = np.asarray(encoding, dtype=np.float32)
+        with self._lock:
+            self.added += 1
+            slot = self._nearest(encoding, self.radius)
+            if slot is None:
+                slot = self._new_cluster(encoding, now)
+            else:
+                self._update(slot, encoding, now)
+                slot = self._merge_nearby(slot)
+            cluster_id = int(self.ids[slot])
+            wants_thumbnail = (self.writer is not None and image is not None
+                               and len(self.thumbnails[slot]) < self.max_thumbnails
+                               and now - self.last_thumbnail[slot] >= THUMBNAIL_EVERY)
+            if wants_thumbnail:
+                self.last_thumbnail[slot] = now
+                path = os.path.join(self.directory, str(cluster_id), f"{int(now * 1000)}.jpg")
+                self.thumbnails[slot].append(path)
+        if wants_thumbnail:
+            thumbnail = _crop_thumbnail(image, location, rgb)
+            if thumbnail is not None:
+                self.writer.put(thumbnail, path)
+        return cluster_id
+
+    def _distances(self, encoding):
+        d = self.centroids - encoding
+        d = np.sqrt(np.einsum('ij,ij->i', d, d))
+        d[self.ids < 0] = np.inf
+        return d
+
+    def _nearest(self, encoding, radius, exclude=None):
+        d = self._distances(encoding)
+        if exclude is not None:
+            d[exclude] = np.inf
+        slot = int(np.argmin(d))
+        return slot if d[slot] <= radius else None
+
+    def _new_cluster(self, encoding, now):
+        free = np.flatnonzero(self.ids < 0)
+        if len(free):
+            slot = int(free[0])
+        else:
+            # Evict the least-visited cluster, the longest unseen among equals
+            slot = int(np.lexsort((self.last_seen, self.visits))[0])
+            self.evicted += 1
+        self.ids[slot] = self.next_id
+        self.next_id += 1
+        self.centroids[slot] = encoding
+        self.samples[slot, 0] = encoding
+        self.sample_counts[slot] = 1
+        self.counts[slot] = 1
+        self.visits[slot] = 1
+        self.first_seen[slot] = self.last_seen[slot] = now
+        self.last_thumbnail[slot] = 0.0
+        self.thumbnails[slot] = []
+        return slot
+
+    def _update(self, slot, encoding, now):
+        self.counts[slot] += 1
+        count = self.counts[slot]
+        self.centroids[slot] += (encoding - self.centroids[slot]) / min(count, CENTROID_WINDOW)
+        # Reservoir sampling keeps a uniform sample of all members in fixed space
+        capacity = self.samples.shape[1]
+        if self.sample_counts[slot] < capacity:
+            self.samples[slot, self.sample_counts[slot]] = encoding
+            self.sample_counts[slot] += 1
+        else:
+            i = self._rng.integers(count)
+            if i < capacity:
+                self.samples[slot, i] = encoding
+        if now - self.last_seen[slot] >= VISIT_GAP:
+            self.visits[slot] += 1
+        self.last_seen[slot] = max(self.last_seen[slot], now)
+
+    def _merge_nearby(self, slot):
+        other = self._nearest(self.centroids[slot], self.merge_radius, exclude=slot)
+        if other is None:
+            return slot
+        # Keep the older cluster's id, so ids an operator has seen stay valid
+        into, source = (other, slot) if self.ids[other] < self.ids[slot] else (slot, other)
+        self._merge(into, source)
+        return into
+
+    def _merge(self, into, source):
+        """Fold the cluster in slot source into slot into and free source"""
+        a, b = self.counts[into], self.counts[source]
+        self.centroids[into] = (self.centroids[into] * a + self.centroids[source] * b) / (a + b)
+        # Draw the merged sample from both samples in proportion to the members they stand for
+        na, nb = self.sample_counts[into], self.sample_counts[source]
+        pool = np.concatenate([self.samples[into, :na], self.samples[source, :nb]])
+        capacity = self.samples.shape[1]
+        if len(pool) > capacity:
+            weights = np.r_[np.full(na, a / na), np.full(nb, b / nb)]
+            pool = pool[self._rng.choice(len(pool), capacity, replace=False, p=weights / weights.sum())]
+        self.samples[into, :len(pool)] = pool
+        self.sample_counts[into] = len(pool)
+        self.counts[into] = a + b
+        self.visits[into] += self.visits[source]
+        self.first_seen[into] = min(self.first_seen[into], self.first_seen[source])
+        self.last_seen[into] = max(self.last_seen[into], self.last_seen[source])
+        self.thumbnails[into] = (self.thumbnails[into] + self.thumbnails[source])[:self.max_thumbnails]
+        self._free(source)
+
+    def _free(self, slot):
+        self.ids[slot] = -1
+        self.thumbnails[slot] = []
+
+    def encodings(self, cluster_id):
+        """The sampled member encodings of a cluster"""
+        with self._lock:
+            slot = self.slot_of(cluster_id)
+            if slot is None:
+                raise KeyError(cluster_id)
+            return self.samples[slot, :self.sample_counts[slot]].copy()
+
+    def merge(self, into_id, cluster_id):
+        with self._lock:
+            into, source = self.slot_of(into_id), self.slot_of(cluster_id)
+            if into is None or source is None:
+                raise KeyError(into_id if into is None else cluster_id)
+            self._merge(into, source)
+
+    def remove(self, cluster_id):
+        with self._lock:
+            slot = self.slot_of(cluster_id)
+            if slot is None:
+                raise KeyError(cluster_id)
+            self._free(slot)
+
+    def status(self):
+        recurring = int((self.visits[self.ids >= 0] > 1).sum())
+        return f"Unknown clusters: {len(self)} ({recurring} recurring)"
+
+    def _apply_removals(self):
+        """Merge or drop clusters that manage_unknowns.py removed from the saved file"""
+        path = os.path.join(self.directory, REMOVED_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            removals = [json.loads(line) for line in f if line.strip()]
+        with self._lock:
+            for removal in removals:
+                slot = self.slot_of(removal['id'])
+                if slot is None:
+                    continue
+                into = self.slot_of(removal['into']) if removal.get('into') is not None else None
+                if into is not None:
+                    self._merge(into, slot)
+                else:
+                    self._free(slot)
+
+    def save(self, delete_stale=True):
+        """Write the clusters to directory/clusters.npz and (if delete_stale) delete unreferenced thumbnails"""
+        self._apply_removals()
+        with self._lock:
+            slots = np.flatnonzero(self.ids >= 0)
+            arrays = {
+                'ids': self.ids[slots], 'centroids': self.centroids[slots], 'samples': self.samples[slots],
+                'sample_counts': self.sample_counts[slots], 'counts': self.counts[slots],
+                'visits': self.visits[slots], 'first_seen': self.first_seen[slots],
+                'last_seen': self.last_seen[slots],
+            }
+            thumbnails = [list(self.thumbnails[slot]) for slot in slots]
+            meta = {'next_id': self.next_id, 'thumbnails': thumbnails}
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CLUSTERS_FILE)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+        if delete_stale:
+            self._delete_thumbnails([entry.path for entry in os.scandir(self.directory) if entry.is_dir()])
+
+    def delete_thumbnails(self, cluster_ids):
+        """Delete the thumbnails of removed clusters, except those a merged cluster took over"""
+        self._delete_thumbnails([os.path.join(self.directory, str(cluster_id)) for cluster_id in cluster_ids])
+
+    def _delete_thumbnails(self, directories):
+        """Delete the thumbnails in directories that no cluster refers to, and directories left empty"""
+        with self._lock:
+            referenced = {os.path.normpath(path) for slot in np.flatnonzero(self.ids >= 0)
+                          for path in self.thumbnails[slot]}
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            for thumbnail in os.scandir(directory):
+                if thumbnail.name.endswith('.jpg') and os.path.normpath(thumbnail.path) not in referenced:
+                    os.remove(thumbnail.path)
+            if not os.listdir(directory):
+                os.rmdir(directory)
+
+    @classmethod
+    def load(cls, directory=UNKNOWN_DIR, **kwargs):
+        """Clusters saved in directory, or an empty set if there are none"""
+        clusters = cls(directory, **kwargs)
+        path = os.path.join(directory, CLUSTERS_FILE)
+        if not os.path.exists(path):
+            return clusters
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            # Keep the most visited clusters if the saved file has more than fit
+            order = np.lexsort((-data['counts'], -data['visits']))[:clusters.max_clusters]
+            n = len(order)
+            samples = min(data['samples'].shape[1], clusters.samples.shape[1])
+            clusters.ids[:n] = data['ids'][order]
+            clusters.centroids[:n] = data['centroids'][order]
+            clusters.samples[:n, :samples] = data['samples'][order, :samples]
+            clusters.sample_counts[:n] = np.minimum(data['sample_counts'][order], samples)
+            clusters.counts[:n] = data['counts'][order]
+            clusters.visits[:n] = data['visits'][order]
+            clusters.first_seen[:n] = data['first_seen'][order]
+            clusters.last_seen[:n] = data['last_seen'][order]
+        for slot, i in enumerate(order):
+            clusters.thumbnails[slot] = meta['thumbnails'][i][:clusters.max_thumbnails]
+            clusters.last_thumbnail[slot] = clusters.last_seen[slot]
+        clusters.next_id = meta['next_id']
+        clusters._apply_removals()
+        return clusters
+
+    def start_autosave(self, interval=SAVE_INTERVAL):
+        """Save every `interval` seconds on a background thread"""
+        self._saver = threading.Thread(target=self._autosave, args=(interval,), name="unknown-clusters-save",
+                                       daemon=True)
+        self._saver.start()
+
+    def _autosave(self, interval):
+        while not self._stop_event.wait(interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"[WARNING] Saving unknown-face clusters failed: {e}")
+
+    def close(self):
+        """Stop saving in the background, write the pending thumbnails and save once more"""
+        self._stop_event.set()
+        if self._saver is not None:
+            self._saver.join()
+        if self.writer is not None:
+            self.writer.close()
+        self.save()
+
+
+def record_removal(cluster_id, into=None, directory=UNKNOWN_DIR):
+    """Note that a cluster was promoted, discarded (into=None) or merged into another
+
+    A recognition process that is still collecting applies the note at its
+    next save, so it does not write the cluster back.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, REMOVED_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'id': int(cluster_id), 'into': None if into is None else int(into)}) + '\n')
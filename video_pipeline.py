@@ -0,0 +1,357 @@
+import json
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from metrics import METRICS
+
+CAMERA_CACHE_FILE = 'camera_cache.json'
+CAMERA_PROBE_INDICES = 5
+
+
+def _read_camera_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _open_camera(index, backend, width, height, fps):
+    """Open and configure a camera; None unless it delivers a frame"""
+    video_capture = cv2.VideoCapture(index, backend) if backend else cv2.VideoCapture(index)
+    if not video_capture.isOpened():
+        video_capture.release()
+        return None
+    video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        video_capture.set(cv2.CAP_PROP_FPS, fps)
+    video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    ret, _ = video_capture.read()
+    if not ret:
+        video_capture.release()
+        return None
+    return video_capture
+
+
+def find_camera(width=640, height=480, fps=None, cache_file=CAMERA_CACHE_FILE, max_index=CAMERA_PROBE_INDICES):
+    """Open the first working camera, trying the one that worked last time first
+
+    The index and capture backend that worked are saved in cache_file.
+    Opening with a known backend skips OpenCV's backend probing, and a
+    cache hit skips opening the indices before it, which is most of the
+    camera start-up time. Returns (video_capture, index), or (None, None).
+    """
+    cached = _read_camera_cache(cache_file)
+    if cached is not None:
+        video_capture = _open_camera(cached.get('index', 0), cached.get('backend'), width, height, fps)
+        if video_capture is not None:
+            return video_capture, cached.get('index', 0)
+        print(f"[INFO] Cached camera {cached.get('index')} is not available, probing...")
+
+    for index in range(max_index):
+        video_capture = _open_camera(index, None, width, height, fps)
+        if video_capture is None:
+            continue
+        cache = {
+            'index': index,
+            'backend': int(video_capture.get(cv2.CAP_PROP_BACKEND)),
+            'backend_name': video_capture.getBackendName(),
+            'width': int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': video_capture.get(cv2.CAP_PROP_FPS),
+        }
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except OSError:
+            pass
+        return video_capture, index
+    return None, None
+
+
+def open_video_source(source):
+    """Open a camera index ("0", "1", ...) or a video file / stream URL"""
+    if isinstance(source, int) or str(source).isdigit():
+        video_capture = cv2.VideoCapture(int(source))
+    else:
+        video_capture = cv2.VideoCapture(source)
+    if not video_capture.isOpened():
+        video_capture.release()
+        return None
+    return video_capture
+
+
+def is_camera_source(source):
+    return isinstance(source, int) or str(source).isdigit()
+
+
+class DropOldestQueue:
+    """Bounded queue that discards its oldest item instead of blocking the producer"""
+
+    def __init__(self, maxsize=1, name=None):
+        self.name = name
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                METRICS.counter('frames_dropped_total', 'Items discarded by drop-oldest queues',
+                                queue=self.name).inc()
+            self._items.append(item)
+            METRICS.gauge('queue_depth', 'Items waiting in each pipeline queue', queue=self.name).set(len(self._items))
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Oldest queued item, or None on timeout or once closed and drained"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            return self._pop()
+
+    def get_nowait(self):
+        with self._cond:
+            return self._pop()
+
+    def _pop(self):
+        if not self._items:
+            return None
+        item = self._items.popleft()
+        METRICS.gauge('queue_depth', 'Items waiting in each pipeline queue', queue=self.name).set(len(self._items))
+        return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CapturedFrame:
+    """A frame with its sequence number and capture timestamp"""
+    __slots__ = ('seq', 'image', 'captured_at')
+
+    def __init__(self, seq, image, captured_at):
+        self.seq = seq
+        self.image = image
+        self.captured_at = captured_at
+
+
+class CaptureThread(threading.Thread):
+    """Reads frames continuously and publishes each one to all output queues
+
+    Camera drivers are drained as fast as they deliver, so downstream stages
+    always see the newest frame instead of a stale buffered one. Video files
+    are paced at their native frame rate (unless realtime=False) so they
+    behave like a live camera.
+    """
+
+    def __init__(self, video_capture, outputs, realtime=True):
+        super().__init__(name="capture", daemon=True)
+        self.video_capture = video_capture
+        self.outputs = outputs
+        self.frames_read = 0
+        self.finished = threading.Event()
+        self._stop_event = threading.Event()
+        fps = video_capture.get(cv2.CAP_PROP_FPS)
+        self._frame_interval = 1.0 / fps if realtime and fps and fps > 0 else 0.0
+
+    def run(self):
+        next_frame_at = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                with METRICS.time('capture'):
+                    ret, image = self.video_capture.read()
+                if not ret:
+                    break
+                self.frames_read += 1
+                METRICS.counter('frames_read_total', 'Frames read from the video source').inc()
+                frame = CapturedFrame(self.frames_read, image, time.perf_counter())
+                for queue in self.outputs:
+                    queue.put(frame)
+
+                if self._frame_interval:
+                    next_frame_at += self._frame_interval
+                    delay = next_frame_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_frame_at = time.perf_counter()
+        finally:
+            self.finished.set()
+            for queue in self.outputs:
+                queue.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class InferenceWorker(threading.Thread):
+    """Runs process_frame on the newest available frame and publishes the results"""
+
+    def __init__(self, frames, results, process_frame):
+        super().__init__(name="inference", daemon=True)
+        self.frames = frames
+        self.results = results
+        self.process_frame = process_frame
+        self.frames_processed = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                frame = self.frames.get(timeout=0.1)
+                if frame is None:
+                    if self.frames.closed:
+                        break
+                    continue
+                faces = self.process_frame(frame.image)
+                self.frames_processed += 1
+                self.results.put((frame.seq, frame.captured_at, faces))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.results.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class RateCounter:
+    """Events per second over a sliding window"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._times = deque()
+
+    def tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        self._times.append(now)
+        while self._times and now - self._times[0] > self.window:
+            self._times.popleft()
+
+    @property
+    def rate(self):
+        if len(self._times) < 2:
+            return 0.0
+        span = self._times[-1] - self._times[0]
+        return (len(self._times) - 1) / span if span > 0 else 0.0
+
+
+class LatencyStats:
+    """Keeps recent latency samples (seconds) and reports percentiles in ms"""
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, q):
+        if not self._samples:
+            return 0.0
+        return 1000.0 * float(np.percentile(self._samples, q))
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class RecognitionPipeline:
+    """Capture -> inference -> render pipeline connected by drop-oldest queues
+
+    The capture thread feeds a one-slot inference queue (so inference always
+    works on the newest frame) and a small display queue. The render stage
+    runs on the caller's thread (cv2.imshow must stay on the main thread) and
+    overlays the most recent results on every displayed frame, so display
+    FPS is independent of recognition FPS.
+
+    Glass-to-label latency is the time from a frame being captured to the
+    first render that shows labels computed from it. make_worker builds the
+    inference stage from (frames, results, process_frame); the default runs
+    process_frame on one thread.
+    """
+
+    def __init__(self, video_capture, process_frame, realtime=True, display_queue_size=2,
+                 make_worker=InferenceWorker):
+        self.inference_frames = DropOldestQueue(1, name='inference')
+        self.display_frames = DropOldestQueue(display_queue_size, name='display')
+        self.results = DropOldestQueue(1, name='results')
+        self.capture = CaptureThread(video_capture, [self.inference_frames, self.display_frames], realtime)
+        self.worker = make_worker(self.inference_frames, self.results, process_frame)
+
+        self.display_rate = RateCounter()
+        self.recognition_rate = RateCounter()
+        self.glass_to_label = LatencyStats()
+        self.latest_faces = []
+        self.latest_result_seq = 0
+        self._pending_latency = None
+
+    def start(self):
+        self.worker.start()
+        self.capture.start()
+
+    def stop(self):
+        self.capture.stop()
+        self.worker.stop()
+        self.capture.join(timeout=2)
+        self.worker.join(timeout=2)
+
+    def next_frame(self, timeout=1.0):
+        """Next frame to display with the latest results applied, or None when the source ends
+
+        Returns (CapturedFrame, faces).
+        """
+        while True:
+            frame = self.display_frames.get(timeout=timeout)
+            if frame is not None:
+                break
+            if self.display_frames.closed:
+                return None
+
+        result = self.results.get_nowait()
+        if result is not None:
+            self.latest_result_seq, captured_at, self.latest_faces = result
+            self.recognition_rate.tick()
+            self._pending_latency = captured_at
+
+        return frame, self.latest_faces
+
+    def frame_shown(self):
+        """Record that the frame from next_frame() has been rendered"""
+        now = time.perf_counter()
+        self.display_rate.tick(now)
+        if self._pending_latency is not None:
+            self.glass_to_label.add(now - self._pending_latency)
+            METRICS.histogram('glass_to_label_seconds', 'Capture to first render showing its labels').observe(
+                now - self._pending_latency)
+            self._pending_latency = None
+
+    def status_lines(self):
+        """Short status strings for the on-screen overlay"""
+        return [
+            f"Display: {self.display_rate.rate:.1f} FPS | Recognition: {self.recognition_rate.rate:.1f} FPS",
+            f"Glass-to-label: p50 {self.glass_to_label.percentile(50):.0f}ms "
+            f"p95 {self.glass_to_label.percentile(95):.0f}ms | Dropped: {self.display_frames.dropped}",
+        ]
+
+    def summary(self):
+        """Final statistics as a printable string"""
+        return (f"Frames captured: {self.capture.frames_read}, recognised: {self.worker.frames_processed}, "
+                f"display drops: {self.display_frames.dropped}, inference skips: {self.inference_frames.dropped}\n"
+                f"Glass-to-label latency: p50 {self.glass_to_label.percentile(50):.1f}ms, "
+                f"p95 {self.glass_to_label.percentile(95):.1f}ms, p99 {self.glass_to_label.percentile(99):.1f}ms")